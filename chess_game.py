@@ -6,12 +6,29 @@ import time
 import logging
 import datetime
 import random
+import itertools
+import math
+import hashlib
+from array import array
 import os
 import json
 import chess.polyglot
+import chess.syzygy
 import socket
+import select
 import threading
-import pickle
+import sys
+import argparse
+import multiprocessing
+import csv
+import sqlite3
+import struct
+import queue
+import atexit
+import tempfile
+import tracemalloc
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from collections import OrderedDict, deque
 from pyngrok import ngrok
 
 # --- CONFIG ---
@@ -28,10 +45,115 @@ PIECES_UNICODE = {
 }
 ANIMATION_SPEED = 10
 ANIMATION_STEPS = 5
+PREMOVE_LIMIT = 4  # Queued premoves per side
+LATENCY_SAMPLES = 200
+REPLAY_SNAPSHOT_INTERVAL = 16  # Plies between stored boards: jumping anywhere replays fewer moves than this
 SOCKET_TIMEOUT = 10  # Timeout for socket operations in seconds
+EVAL_CACHE_SIZE = 200000  # Max positions kept in the evaluation cache
+ANALYSIS_DB = "analysis.db"
+ANALYSIS_DB_MAX_ENTRIES = 500000  # Oldest entries are evicted beyond this
+DB_TIMEOUT = 5  # Seconds to wait on a locked sqlite database
+HISTORY_DB = "history.db"
+HISTORY_SNAPSHOTS_KEPT = 100  # Learning-data snapshots; the games themselves are all kept
+ANALYSIS_FILE = "analysis.txt"
+ANALYSIS_FILE_MAX_BYTES = 1024 * 1024  # Oldest saved reports are dropped beyond this
+MEMORY_DUMP_FILE = "memory_dump.txt"  # Written by Ctrl+M
+MEMORY_DUMP_TOP = 25
+LEGACY_LEARNING_FILE = "learning_data.json"  # Imported once into the history store
+OPENING_PLIES = 6  # Plies used to group games by opening
+EXPLORER_DB = "explorer.db"
+EXPLORER_MAX_PLIES = 30  # Deeper positions are not indexed
+EXPLORER_MIN_GAMES = 5  # Rarer moves are ignored by the bot and left out of exported books
+GAME_DB = "games.db"
+GAME_DB_SEARCH_LIMIT = 200  # Matching games listed per query
+GAME_DB_COUNT_LIMIT = 10000  # Matches counted per query; more are reported as "10000+"
+PONDER_ENABLED = True  # Search the predicted reply while the human thinks
+PONDER_POLL_MS = 50
+SYZYGY_PATHS = [path for path in os.environ.get("SYZYGY_PATH", "syzygy").split(os.pathsep) if path]
+SYZYGY_CACHE_SIZE = 100000
+SYZYGY_BUNDLED_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "syzygy")  # KQvK, KRvK and KPvK, checked by check-tablebases
+TB_WIN_SCORE = 50000  # Below checkmate, above any material score
+PUZZLE_DB = "puzzles.db"  # Index over the puzzle corpus files below
+PUZZLE_SOURCES = ["puzzles.csv", "puzzles.jsonl"]  # Lichess CSV export or JSONL
+PUZZLE_RATING_WINDOW = 150
+PUZZLE_SEARCH_DEPTH = 3
+PUZZLE_MIN_SWING = 200  # Centipawns the best move must gain over the static eval and the second-best move
+PUZZLE_MAX_PLIES = 5
+TUNED_WEIGHTS_FILE = "tuned_weights.json"  # Written by the "tune" command, loaded at startup
+EVAL_TABLES_FILE = "eval_tables.cache"  # Precomputed value * weight tables, keyed by their inputs
+EVAL_TABLES_FILE_ENTRIES = 8  # Weight sets kept, both in memory and on disk
+TT_SIZE = 1 << 20  # Transposition table slots, shared by every search in the process
+ASPIRATION_WINDOW = 50  # Centipawns either side of the previous iteration's score
+NULL_MOVE_REDUCTION = 2
+NULL_MOVE_MIN_DEPTH = 3
+LMR_MIN_DEPTH = 4  # No quiescence search: shallower reduced searches are too noisy
+LMR_FULL_MOVES = 3  # Moves searched at full depth before reductions start
+MATE_SCORE = 99999
+ANALYSIS_LINES = 3  # Principal variations shown by infinite analysis
+ANALYSIS_MAX_DEPTH = 64
+ANALYSIS_REFRESH_MS = 250  # Sidebar refresh cap while analysing
+ENGINE_MATCH_FPS = 10  # Redraw cap while engines play each other
+ENGINE_MATCH_POLL_MS = 10
+ENGINE_MATCH_DIR = "engine_games"  # One PGN per finished engine game
+ENGINE_MATCH_MAX_PLIES = 400  # Adjudicated as a draw beyond this
+ENGINE_MATCH_KEEP = 500  # Newest game files kept in ENGINE_MATCH_DIR
+NET_POLL_MS = 20  # How often the UI drains network events
+SPECTATOR_MAX_CLIENTS = 256
+SPECTATOR_BUFFER_BYTES = 64 * 1024  # A viewer further behind than this is resynced from a fresh snapshot
+SPECTATOR_MAX_RESYNCS = 3  # Then dropped
+SPECTATOR_POLL = 0.05  # Seconds the fan-out loop waits for socket readiness
+SPECTATOR_CLOCK_INTERVAL = 1.0  # Seconds between clock-only updates
 
 # --- LOGGING ---
-logging.basicConfig(filename='logs.txt', level=logging.INFO, format='%(asctime)s - %(message)s')
+LOG_FILE = os.environ.get("CHESS_LOG_FILE", "logs.txt")
+LOG_MAX_BYTES = 5 * 1024 * 1024
+LOG_BACKUP_COUNT = 3
+LOG_LEVELS = {"ui": "INFO", "engine": "INFO", "net": "INFO"}  # Override with CHESS_LOG_LEVELS="ui=DEBUG,net=WARNING"
+
+class JsonLogFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {"time": self.formatTime(record), "level": record.levelname, "subsystem": record.name.rsplit(".", 1)[-1], "thread": record.threadName, "message": record.getMessage()}
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry)
+
+def log_file_handler(path):
+    handler = RotatingFileHandler(path, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT, encoding="utf-8", delay=True)
+    handler.setFormatter(JsonLogFormatter())
+    return handler
+
+def setup_logging():
+    levels = dict(LOG_LEVELS)
+    for item in os.environ.get("CHESS_LOG_LEVELS", "").split(","):
+        if "=" in item:
+            name, level = item.split("=", 1)
+            levels[name.strip()] = level.strip().upper()
+    # File I/O happens on the listener thread; callers only enqueue
+    log_queue = queue.SimpleQueue()
+    listener = QueueListener(log_queue, log_file_handler(LOG_FILE))
+    listener.start()
+    atexit.register(listener.stop)
+    app_logger = logging.getLogger("chessapp")
+    app_logger.addHandler(QueueHandler(log_queue))
+    app_logger.propagate = False
+    for name, level in levels.items():
+        logging.getLogger(f"chessapp.{name}").setLevel(level)
+    return listener
+
+LOG_LISTENER = setup_logging()
+
+def set_log_file(path):
+    # Records already queued are written to the old file before the switch
+    global LOG_FILE
+    LOG_LISTENER.stop()
+    for handler in LOG_LISTENER.handlers:
+        handler.close()
+    LOG_FILE = path
+    LOG_LISTENER.handlers = (log_file_handler(path),)
+    LOG_LISTENER.start()
+ui_log = logging.getLogger("chessapp.ui")
+engine_log = logging.getLogger("chessapp.engine")
+net_log = logging.getLogger("chessapp.net")
 
 # --- EVALUATION / BOT ---
 PIECE_VALUES = {chess.PAWN: 100, chess.KNIGHT: 320, chess.BISHOP: 330, chess.ROOK: 500, chess.QUEEN: 900, chess.KING: 20000}
@@ -50,124 +172,3315 @@ PIECE_SQUARE_TABLES = {
     chess.KING: [-30, -40, -40, -50, -50, -40, -40, -30, -30, -40, -40, -50, -50, -40, -40, -30, -20, -30, -30, -40, -40, -30, -30, -20,
                  -10, -20, -20, -20, -20, -20, -20, -10, 20, 20, 10, 0, 0, 10, 20, 20, 20, 20, 10, 0, 0, 10, 20, 20]
 }
+# Several tables are shorter than 64 entries; missing squares score 0 instead of failing the evaluation
+for table in PIECE_SQUARE_TABLES.values():
+    table.extend([0] * (64 - len(table)))
+
+WEIGHT_GROUPS = ("pawn", "king", "mobility")
+
+def weight_group(piece_type):
+    # Minor and major pieces have no multiplier: "mobility" scales the mobility term only
+    return "pawn" if piece_type == chess.PAWN else "king" if piece_type == chess.KING else None
 
-def evaluate(board, learning_data=None):
+def load_tuned_weights(path=TUNED_WEIGHTS_FILE):
+    # Replaces the piece values and square tables in place; returns the file contents for its weights
     try:
-        if board.is_checkmate():
-            return -99999 if board.turn == chess.WHITE else 99999
-        if board.is_stalemate() or board.is_insufficient_material():
-            return 0
+        if not os.path.exists(path):
+            return None
+        with open(path) as f:
+            tuned = json.load(f)
+        for piece_type, value in tuned["piece_values"].items():
+            PIECE_VALUES[int(piece_type)] = value
+        for piece_type, table in tuned["piece_square_tables"].items():
+            PIECE_SQUARE_TABLES[int(piece_type)] = list(table)
+        EVAL_CACHE.invalidate()
+        engine_log.info(f"Loaded tuned weights version {tuned['version']} from {path}")
+        return tuned
+    except Exception as e:
+        engine_log.error(f"Loading tuned weights failed: {e}")
+        return None
 
-        score = 0
-        for square in chess.SQUARES:
-            piece = board.piece_at(square)
-            if piece:
-                value = PIECE_VALUES[piece.piece_type]
-                psqt = PIECE_SQUARE_TABLES[piece.piece_type]
-                idx = square if piece.color == chess.WHITE else 63 - square
-                weight = learning_data["weights"].get("pawn" if piece.piece_type == chess.PAWN else "king" if piece.piece_type == chess.KING else "mobility", 1.0) if learning_data else 1.0
-                score += (value + psqt[idx]) * weight if piece.color == chess.WHITE else -(value + psqt[idx]) * weight
+# --- EVALUATION CACHE ---
+class LRUCache:
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()  # Shared by the GUI and background searches
+
+    def get(self, key):
+        with self.lock:
+            value = self.entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        with self.lock:
+            total = self.hits + self.misses
+            return {"size": len(self.entries), "hits": self.hits, "misses": self.misses, "hit_rate": self.hits / total if total else 0.0}
+
+class EvalCache(LRUCache):
+    def __init__(self, max_size=EVAL_CACHE_SIZE):
+        super().__init__(max_size)
+
+    def key(self, board, learning_data=None, zobrist=None):
+        # Weight values are part of the key so differently weighted engines never share entries
+        if zobrist is None:
+            zobrist = chess.polyglot.zobrist_hash(board)
+        return (zobrist, weights_key(learning_data))
+
+    def invalidate(self):
+        # Scores under the old weights can no longer be hit: free them rather than wait for eviction
+        with self.lock:
+            self.entries.clear()
+
+# --- PRECOMPUTED EVALUATION TABLES ---
+# One 64-square block per (piece type, color): signed (value + psqt) * weight, Black already mirrored
+EVAL_TABLE_LAYOUT = [(index * 64, piece_type, color) for index, (color, piece_type) in enumerate((color, piece_type) for color in (chess.WHITE, chess.BLACK) for piece_type in chess.PIECE_TYPES)]
+EVAL_TABLES = OrderedDict()  # weights_key -> tables
+EVAL_TABLES_LOCK = threading.Lock()
+EVAL_TABLES_MAGIC = b"EVTABLE2"
+
+def weights_key(learning_data):
+    # The weight values themselves: engines with different weights never share tables or cached scores
+    if not learning_data:
+        return None
+    return tuple(float(learning_data["weights"].get(group, 1.0)) for group in WEIGHT_GROUPS)
+
+def eval_tables_signature(weights):
+    payload = json.dumps([sorted(PIECE_VALUES.items()), sorted(PIECE_SQUARE_TABLES.items()), sorted(weights.items())])
+    return hashlib.sha1(payload.encode()).hexdigest()
+
+def build_eval_tables(weights):
+    tables = []
+    for _, piece_type, color in EVAL_TABLE_LAYOUT:
+        weight = weights.get(weight_group(piece_type), 1.0)
+        psqt = PIECE_SQUARE_TABLES[piece_type]
+        if color == chess.WHITE:
+            tables.extend((PIECE_VALUES[piece_type] + psqt[square]) * weight for square in chess.SQUARES)
+        else:
+            tables.extend(-(PIECE_VALUES[piece_type] + psqt[63 - square]) * weight for square in chess.SQUARES)
+    return tables
+
+def read_eval_tables_file(path=EVAL_TABLES_FILE):
+    # Magic, then fixed-size records: 40-byte hex signature followed by the tables as native doubles
+    stored = OrderedDict()
+    try:
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                data = f.read()
+            record_size = 40 + len(EVAL_TABLE_LAYOUT) * 64 * array("d").itemsize
+            body = data[len(EVAL_TABLES_MAGIC):]
+            if not data.startswith(EVAL_TABLES_MAGIC) or len(body) % record_size:
+                engine_log.warning(f"Ignoring {path}: not an evaluation table cache")
+                return stored
+            for offset in range(0, len(body), record_size):
+                stored[body[offset:offset + 40].decode("ascii")] = body[offset + 40:offset + record_size]
+    except Exception as e:
+        engine_log.warning(f"Ignoring unreadable {path}: {e}")
+    return stored
 
-        mobility = len(list(board.legal_moves)) * 5 * (learning_data["weights"].get("mobility", 1.0) if learning_data else 1.0)
-        score += mobility if board.turn == chess.WHITE else -mobility
+def write_eval_tables_file(stored, path=EVAL_TABLES_FILE):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(EVAL_TABLES_MAGIC)
+        for signature, blob in stored.items():
+            f.write(signature.encode("ascii"))
+            f.write(blob)
+    os.replace(tmp_path, path)
 
+def load_eval_tables(weights, path=EVAL_TABLES_FILE):
+    signature = eval_tables_signature(weights)
+    stored = read_eval_tables_file(path)
+    if signature in stored:
+        tables = array("d")
+        tables.frombytes(stored[signature])
+        return tables.tolist()
+    tables = build_eval_tables(weights)
+    try:
+        stored.pop(signature, None)
+        stored[signature] = array("d", tables).tobytes()
+        while len(stored) > EVAL_TABLES_FILE_ENTRIES:
+            stored.popitem(last=False)
+        write_eval_tables_file(stored, path)
+    except Exception as e:
+        engine_log.warning(f"Could not write {path}: {e}")
+    return tables
+
+def get_eval_tables(learning_data=None):
+    key = weights_key(learning_data)
+    with EVAL_TABLES_LOCK:
+        tables = EVAL_TABLES.get(key)
+        if tables is None:
+            tables = EVAL_TABLES[key] = load_eval_tables(dict(zip(WEIGHT_GROUPS, key)) if key else {})
+            while len(EVAL_TABLES) > EVAL_TABLES_FILE_ENTRIES:
+                EVAL_TABLES.popitem(last=False)
+        else:
+            EVAL_TABLES.move_to_end(key)
+    return tables
+
+EVAL_CACHE = EvalCache()
+TUNED_WEIGHTS = load_tuned_weights()
+
+def evaluate(board, learning_data=None, zobrist=None):
+    try:
+        key = EVAL_CACHE.key(board, learning_data, zobrist)
+        score = EVAL_CACHE.get(key)
+        if score is None:
+            score = evaluate_uncached(board, learning_data)
+            EVAL_CACHE.put(key, score)
         return score
     except Exception as e:
-        logging.error(f"Evaluation failed: {e}")
+        engine_log.error("Evaluation failed: %s", e)
+        return 0
+
+def evaluate_uncached(board, learning_data=None):
+    # One move generation serves checkmate, stalemate and mobility
+    move_count = board.legal_moves.count()
+    if move_count == 0:
+        if board.is_check():
+            return -MATE_SCORE if board.turn == chess.WHITE else MATE_SCORE
+        return 0
+    if board.is_insufficient_material():
         return 0
 
-def alpha_beta(board, depth, alpha, beta, maximizing, learning_data=None):
+    tables = get_eval_tables(learning_data)
+    score = 0
+    for base, piece_type, color in EVAL_TABLE_LAYOUT:
+        for square in chess.scan_forward(board.pieces_mask(piece_type, color)):
+            score += tables[base + square]
+
+    mobility = move_count * 5 * (learning_data["weights"].get("mobility", 1.0) if learning_data else 1.0)
+    score += mobility if board.turn == chess.WHITE else -mobility
+
+    return score
+
+# --- ENDGAME TABLEBASES ---
+TABLEBASE = None
+TABLEBASE_MAX_PIECES = 0
+TABLEBASE_LOADED = False
+TB_CACHE = LRUCache(SYZYGY_CACHE_SIZE)
+
+def get_tablebase():
+    global TABLEBASE, TABLEBASE_MAX_PIECES, TABLEBASE_LOADED
+    if not TABLEBASE_LOADED:
+        TABLEBASE_LOADED = True
+        try:
+            tablebase = chess.syzygy.Tablebase()
+            for path in SYZYGY_PATHS:
+                if os.path.isdir(path):
+                    tablebase.add_directory(path)
+            if tablebase.wdl:
+                TABLEBASE = tablebase
+                TABLEBASE_MAX_PIECES = max(len(name) - 1 for name in tablebase.wdl)
+                engine_log.info(f"Syzygy tablebases loaded: {len(tablebase.wdl)} WDL tables, up to {TABLEBASE_MAX_PIECES} pieces")
+        except Exception as e:
+            engine_log.error(f"Loading Syzygy tablebases failed: {e}")
+    return TABLEBASE
+
+def set_syzygy_paths(paths):
+    global TABLEBASE, TABLEBASE_MAX_PIECES, TABLEBASE_LOADED
+    if TABLEBASE is not None:
+        TABLEBASE.close()
+    SYZYGY_PATHS[:] = paths
+    TABLEBASE, TABLEBASE_MAX_PIECES, TABLEBASE_LOADED = None, 0, False
+    TB_CACHE.clear()
+    return get_tablebase()
+
+def tablebase_eligible(board):
+    return get_tablebase() is not None and chess.popcount(board.occupied) <= TABLEBASE_MAX_PIECES and not board.castling_rights
+
+def probe_tablebase(board, kind="wdl"):
+    # Returns None when the position is not covered by the loaded tables
+    key = (chess.polyglot.zobrist_hash(board), kind)
+    cached = TB_CACHE.get(key)
+    if cached is not None:
+        return cached[0]
+    try:
+        value = TABLEBASE.probe_wdl(board) if kind == "wdl" else TABLEBASE.probe_dtz(board)
+    except KeyError:  # MissingTableError
+        value = None
+    TB_CACHE.put(key, (value,))
+    return value
+
+def tablebase_value(wdl, ply=0, halfmove_clock=0, dtz=None):
+    # Side-to-move score; cursed wins and blessed losses (WDL +-1) are draws under the 50-move rule
+    if dtz is not None and halfmove_clock + abs(dtz) > 100:
+        wdl = 0  # The clock runs out before the win can be converted
+    return TB_WIN_SCORE - ply if wdl == 2 else -(TB_WIN_SCORE - ply) if wdl == -2 else 0
+
+def tablebase_score(board, ply=0):
+    wdl = probe_tablebase(board, "wdl")
+    if wdl is None:
+        return None
+    dtz = probe_tablebase(board, "dtz") if wdl in (2, -2) and board.halfmove_clock else None
+    score = tablebase_value(wdl, ply, board.halfmove_clock, dtz)
+    return score if board.turn == chess.WHITE else -score
+
+def tablebase_move(board):
+    try:
+        if not tablebase_eligible(board):
+            return None
+        best_move, best_key = None, None
+        for move in board.legal_moves:
+            zeroing = board.is_zeroing(move)
+            board.push(move)
+            try:
+                if board.is_checkmate():
+                    key = (-3, 0)
+                else:
+                    wdl = probe_tablebase(board, "wdl")
+                    dtz = probe_tablebase(board, "dtz")
+                    if wdl is None or dtz is None:
+                        return None
+                    # Opponent's view: lowest WDL first, then fastest loss / slowest win for them.
+                    # A winning capture or pawn move is the zeroing the DTZ counts down to; the new position's DTZ starts over
+                    key = (wdl, 0 if zeroing and wdl < 0 else -dtz)
+            finally:
+                board.pop()
+            if best_key is None or key < best_key:
+                best_move, best_key = move, key
+        return best_move
+    except Exception as e:
+        engine_log.error(f"Tablebase move failed: {e}")
+        return None
+
+class SearchAborted(Exception):
+    pass
+
+class SearchContext:
+    def __init__(self, stop_event=None, deadline=None, tt=None):
+        self.stop_event = stop_event or threading.Event()
+        self.nodes = 0
+        self.deadline = deadline  # perf_counter() time after which an iterative search returns its last full depth
+        self.timed_out = False
+        self.depth = 0
+        self.tt = tt
+        self.learning_data = None
+        self.salt = 0
+        self.killers = {}
+        self.history = {}
+        self.path = []  # Zobrist keys of the positions leading to the current node
+
+    def prepare(self, learning_data):
+        self.learning_data = learning_data
+        self.tt = self.tt or TRANSPOSITION_TABLE
+        weights = tuple(sorted(learning_data["weights"].items())) if learning_data else ()
+        self.salt = hash(weights) & 0xFFFFFFFFFFFFFFFF
+        self.killers = {}
+        self.history = {}
+        self.path = []
+
+    def set_root(self, board):
+        # Game positions since the last irreversible move, so repetitions of played positions count too
+        replay = board.copy()
+        keys = []
+        for _ in range(min(board.halfmove_clock, len(board.move_stack))):
+            replay.pop()
+            keys.append(chess.polyglot.zobrist_hash(replay))
+        self.path = keys[::-1]
+
+    def is_repetition(self, key, halfmove_clock):
+        # Same side to move is every second entry; nothing before the last pawn move or capture can repeat
+        path = self.path
+        stop = max(len(path) - halfmove_clock - 1, -1)
+        for index in range(len(path) - 2, stop, -2):
+            if path[index] == key:
+                return True
+        return False
+
+def alpha_beta(board, depth, alpha, beta, maximizing, learning_data=None, ctx=None, pv=None, ply=0):
     try:
-        if depth == 0 or board.is_game_over():
+        if pv is not None:
+            pv.clear()
+        if ctx is not None:
+            ctx.nodes += 1
+            if ctx.stop_event.is_set():
+                raise SearchAborted()
+        if depth == 0:
             return evaluate(board, learning_data), None
+        # One move generation serves as the mate/stalemate test and the move list; repetition needs 16 reversible plies
+        moves = list(board.legal_moves)
+        if (not moves or board.is_insufficient_material() or board.halfmove_clock >= 150
+                or (board.halfmove_clock >= 16 and board.is_fivefold_repetition())):
+            return evaluate(board, learning_data), None
+        if ply > 0 and tablebase_eligible(board):
+            tb_score = tablebase_score(board, ply)
+            if tb_score is not None:
+                return tb_score, None
 
         best_move = None
-        moves = list(board.legal_moves)
+        child_pv = [] if pv is not None else None
         for move in moves:
             board.push(move)
-            eval_score, _ = alpha_beta(board, depth - 1, alpha, beta, not maximizing, learning_data)
+            eval_score, _ = alpha_beta(board, depth - 1, alpha, beta, not maximizing, learning_data, ctx, child_pv, ply + 1)
             board.pop()
             if maximizing:
                 if eval_score > alpha:
                     alpha = eval_score
                     best_move = move
+                    if pv is not None:
+                        pv[:] = [move] + child_pv
                 if alpha >= beta:
                     break
             else:
                 if eval_score < beta:
                     beta = eval_score
                     best_move = move
+                    if pv is not None:
+                        pv[:] = [move] + child_pv
                 if beta <= alpha:
                     break
         return alpha if maximizing else beta, best_move
+    except SearchAborted:
+        raise
     except Exception as e:
-        logging.error(f"Alpha-beta search failed: {e}")
+        engine_log.error("Alpha-beta search failed: %s", e)
         return 0, None
 
-def get_bot_move(board, difficulty, learning_data=None):
+# --- SELECTIVE SEARCH ---
+SEARCH_TECHNIQUES = ("pvs", "aspiration", "null_move", "lmr", "tt", "ordering", "fast_terminal")
+TT_EXACT, TT_LOWER, TT_UPPER = 0, 1, 2
+SEARCH_INFINITY = 10 ** 6
+
+class SearchConfig:
+    def __init__(self, pvs=True, aspiration=True, null_move=True, lmr=True, tt=True, ordering=True, fast_terminal=True):
+        self.pvs = pvs
+        self.aspiration = aspiration
+        self.null_move = null_move
+        self.lmr = lmr
+        self.tt = tt
+        self.ordering = ordering
+        self.fast_terminal = fast_terminal  # Terminal and repetition checks from one move generation and a Zobrist path
+
+    def label(self):
+        return "+".join(name for name in SEARCH_TECHNIQUES if getattr(self, name)) or "plain"
+
+SEARCH_CONFIG = SearchConfig()
+
+class TranspositionTable:
+    def __init__(self, size=TT_SIZE):
+        self.size = size
+        self.entries = [None] * size  # (key, depth, score, flag, move, generation)
+        self.generation = 0
+        self.filled = 0  # Slots in use, kept by store so reports do not walk the table
+
+    def probe(self, key):
+        entry = self.entries[key % self.size]
+        return entry if entry is not None and entry[0] == key else None
+
+    def store(self, key, depth, score, flag, move):
+        index = key % self.size
+        entry = self.entries[index]
+        # Depth-preferred, but entries from earlier searches are always replaceable
+        if entry is None or entry[0] == key or entry[5] != self.generation or depth >= entry[1]:
+            self.entries[index] = (key, depth, score, flag, move, self.generation)
+            if entry is None:
+                self.filled += 1
+
+    def new_search(self):
+        self.generation += 1
+
+    def clear(self):
+        self.entries = [None] * self.size
+        self.filled = 0
+
+TRANSPOSITION_TABLE = TranspositionTable()
+
+def has_non_pawn_material(board, color):
+    # Zugzwang guard: null-move pruning is unsound in king and pawn endings
+    return bool(board.occupied_co[color] & ~(board.pawns | board.kings))
+
+def order_moves(board, moves, tt_move, ply, ctx):
+    killers = ctx.killers.get(ply, ())
+    history = ctx.history
+
+    def key(move):
+        if move == tt_move:
+            return 1 << 30
+        if board.is_capture(move):
+            victim = board.piece_type_at(move.to_square) or chess.PAWN  # En passant
+            return (1 << 20) + PIECE_VALUES[victim] * 16 - board.piece_type_at(move.from_square)
+        if move.promotion:
+            return (1 << 19) + PIECE_VALUES[move.promotion]
+        if move in killers:
+            return (1 << 18) - killers.index(move)
+        return history.get((move.from_square, move.to_square), 0)
+
+    moves.sort(key=key, reverse=True)
+    return moves
+
+def mate_in(ply):
+    return MATE_SCORE - ply
+
+def score_to_tt(score, ply):
+    # Mate scores are stored relative to the node, so they stay valid wherever the position recurs
+    if score >= MATE_SCORE - 1000:
+        return score + ply
+    if score <= -(MATE_SCORE - 1000):
+        return score - ply
+    return score
+
+def score_from_tt(score, ply):
+    if score >= MATE_SCORE - 1000:
+        return score - ply
+    if score <= -(MATE_SCORE - 1000):
+        return score + ply
+    return score
+
+def negamax(board, depth, alpha, beta, ply, ctx, config, pv=None, allow_null=True, root_moves=None):
+    # Fail-soft negamax: scores are from the side to move's point of view
+    if pv is not None:
+        pv.clear()
+    ctx.nodes += 1
+    if ctx.deadline is not None and ctx.nodes & 1023 == 0 and time.perf_counter() >= ctx.deadline:
+        ctx.timed_out = True
+        ctx.stop_event.set()
+    if ctx.stop_event.is_set():
+        raise SearchAborted()
+    zobrist = chess.polyglot.zobrist_hash(board) if config.fast_terminal or config.tt else None
+    moves = None
+    if config.fast_terminal:
+        if ply > 0 and (board.halfmove_clock >= 100 or ctx.is_repetition(zobrist, board.halfmove_clock)):
+            return 0
+        if depth > 0:
+            moves = list(board.legal_moves)
+            if not moves:
+                return -mate_in(ply) if board.is_check() else 0
+            if board.is_insufficient_material():
+                return 0
+    elif board.is_game_over():
+        score = evaluate(board, ctx.learning_data, zobrist)
+        return score if board.turn == chess.WHITE else -score
+    if ply > 0 and tablebase_eligible(board):
+        tb_score = tablebase_score(board, ply)
+        if tb_score is not None:
+            return tb_score if board.turn == chess.WHITE else -tb_score
+
+    key = zobrist ^ ctx.salt if config.tt else None
+    tt_move = None
+    if key is not None:
+        entry = ctx.tt.probe(key)
+        if entry is not None:
+            tt_move = entry[4]
+            if ply > 0 and entry[1] >= depth:
+                score, flag = score_from_tt(entry[2], ply), entry[3]
+                if flag == TT_EXACT or (flag == TT_LOWER and score >= beta) or (flag == TT_UPPER and score <= alpha):
+                    return score
+    if depth <= 0:
+        # evaluate() finds leaf mates and stalemates from its own single move generation
+        score = evaluate(board, ctx.learning_data, zobrist)
+        score = score if board.turn == chess.WHITE else -score
+        if abs(score) == MATE_SCORE:
+            score = -mate_in(ply) if score < 0 else mate_in(ply)
+        return score
+
+    in_check = board.is_check()
+    # Popped on every normal return; an aborted search discards the path with the context
+    ctx.path.append(zobrist)
+    if (config.null_move and allow_null and ply > 0 and depth >= NULL_MOVE_MIN_DEPTH and not in_check
+            and abs(beta) < MATE_SCORE - 1000 and has_non_pawn_material(board, board.turn)):
+        reduction = NULL_MOVE_REDUCTION + (1 if depth > 6 else 0)
+        board.push(chess.Move.null())
+        try:
+            score = -negamax(board, depth - 1 - reduction, -beta, -beta + 1, ply + 1, ctx, config, None, False)
+        finally:
+            board.pop()
+        if score >= beta:
+            ctx.path.pop()
+            return score
+
+    if root_moves is not None:
+        moves = list(root_moves)  # Multi-PV: the root is restricted to moves not already reported
+    elif moves is None:
+        moves = list(board.legal_moves)
+    if config.ordering:
+        order_moves(board, moves, tt_move, ply, ctx)
+    elif tt_move in moves:
+        moves.remove(tt_move)
+        moves.insert(0, tt_move)
+
+    original_alpha = alpha
+    best_score, best_move = -SEARCH_INFINITY, None
+    child_pv = [] if pv is not None else None
+    for index, move in enumerate(moves):
+        quiet = not board.is_capture(move) and move.promotion is None
+        board.push(move)
+        try:
+            if index == 0:
+                score = -negamax(board, depth - 1, -beta, -alpha, ply + 1, ctx, config, child_pv)
+            else:
+                reduction = 0
+                if config.lmr and quiet and depth >= LMR_MIN_DEPTH and index >= LMR_FULL_MOVES and not in_check and not board.is_check():
+                    reduction = 1 if index < 2 * LMR_FULL_MOVES else 2
+                search_full = True
+                if reduction:
+                    score = -negamax(board, depth - 1 - reduction, -alpha - 1, -alpha, ply + 1, ctx, config, child_pv)
+                    search_full = score > alpha
+                if search_full and config.pvs:
+                    score = -negamax(board, depth - 1, -alpha - 1, -alpha, ply + 1, ctx, config, child_pv)
+                    search_full = alpha < score < beta
+                if search_full:
+                    score = -negamax(board, depth - 1, -beta, -alpha, ply + 1, ctx, config, child_pv)
+        finally:
+            board.pop()
+        if score > best_score:
+            best_score, best_move = score, move
+            if score > alpha:
+                alpha = score
+                if pv is not None:
+                    pv[:] = [move] + child_pv
+                if alpha >= beta:
+                    if quiet and config.ordering:
+                        killers = ctx.killers.setdefault(ply, [])
+                        if move not in killers:
+                            killers.insert(0, move)
+                            del killers[2:]
+                        ctx.history[(move.from_square, move.to_square)] = ctx.history.get((move.from_square, move.to_square), 0) + depth * depth
+                    break
+    ctx.path.pop()
+
+    if key is not None and root_moves is None:
+        flag = TT_UPPER if best_score <= original_alpha else TT_LOWER if best_score >= beta else TT_EXACT
+        ctx.tt.store(key, depth, score_to_tt(best_score, ply), flag, best_move)
+    return best_score
+
+def search_root(board, max_depth, learning_data=None, ctx=None, pv=None, config=None):
+    # Iterative deepening; returns (white-perspective score, move) from the deepest completed iteration
+    config = config or SEARCH_CONFIG
+    ctx = ctx or SearchContext()
+    ctx.prepare(learning_data)
+    if config.fast_terminal:
+        ctx.set_root(board)
+    ctx.tt.new_search()
+    best_score, best_line = None, []
+    for depth in range(1, max_depth + 1):
+        line = []
+        try:
+            if config.aspiration and best_score is not None:
+                window = ASPIRATION_WINDOW
+                while True:
+                    alpha, beta = (best_score - window, best_score + window) if window else (-SEARCH_INFINITY, SEARCH_INFINITY)
+                    score = negamax(board, depth, alpha, beta, 0, ctx, config, line)
+                    if alpha < score < beta or not window:
+                        break
+                    window = window * 4 if window < 16 * ASPIRATION_WINDOW else None  # Then give up on the window
+            else:
+                score = negamax(board, depth, -SEARCH_INFINITY, SEARCH_INFINITY, 0, ctx, config, line)
+        except SearchAborted:
+            if ctx.timed_out and best_line:
+                break
+            raise
+        if line:
+            best_score, best_line = score, line
+            ctx.depth = depth
+        if not line or abs(score) >= MATE_SCORE - 1000:
+            break  # Terminal root or forced mate: deeper iterations cannot change the move
+    if pv is not None:
+        pv[:] = best_line
+    if best_score is None:
+        return evaluate(board, learning_data), None
+    return (best_score if board.turn == chess.WHITE else -best_score), best_line[0]
+
+def multipv_search(board, max_depth, count, learning_data=None, ctx=None, config=None, report=None):
+    # Iterative deepening over the top `count` root moves; report(depth, lines) after every completed depth,
+    # lines being [(white-perspective score, pv)]. Runs until max_depth, a forced mate or ctx is stopped.
+    config = config or SEARCH_CONFIG
+    ctx = ctx or SearchContext()
+    ctx.prepare(learning_data)
+    if config.fast_terminal:
+        ctx.set_root(board)
+    ctx.tt.new_search()
+    root_moves = list(board.legal_moves)
+    lines = []
+    for depth in range(1, max_depth + 1):
+        # Last iteration's best lines first, so each PV search starts from a good bound
+        ranked = [line[1][0] for line in lines]
+        remaining = ranked + [move for move in root_moves if move not in ranked]
+        current = []
+        try:
+            while remaining and len(current) < count:
+                line = []
+                score = negamax(board, depth, -SEARCH_INFINITY, SEARCH_INFINITY, 0, ctx, config, line, root_moves=remaining)
+                if not line:
+                    break
+                current.append((score if board.turn == chess.WHITE else -score, line))
+                remaining = [move for move in remaining if move != line[0]]
+        except SearchAborted:
+            break
+        current.sort(key=lambda line: line[0], reverse=board.turn == chess.WHITE)
+        lines = current
+        ctx.depth = depth
+        if report:
+            report(depth, lines)
+        if not lines or abs(lines[0][0]) >= MATE_SCORE - 1000:
+            break
+    return lines
+
+def get_bot_move(board, difficulty, learning_data=None, ctx=None, pv=None, depth=None, use_book=True, use_tablebase=True):
     try:
-        experience = learning_data["games"] if learning_data and learning_data["games"] > 0 else 0
-        depth = min(6, max(2, 2 + experience // 10))
-        if experience < 20 and os.path.exists("polyglot.bin"):
-            with chess.polyglot.open_reader("polyglot.bin") as reader:
-                entries = list(reader.find_all(board))
-                if entries:
-                    return max(entries, key=lambda e: e.weight).move
-        _, move = alpha_beta(board, depth, -float('inf'), float('inf'), board.turn == chess.WHITE, learning_data)
+        experience = learning_data["games"] if learning_data and learning_data.get("games", 0) > 0 else 0
+        depth = depth or min(6, max(2, 2 + experience // 10))
+        move = tablebase_move(board) if use_tablebase else None
+        if move is None and use_book and experience < 20:
+            move = book_move(board)
+        if move is not None:
+            if pv is not None:
+                pv[:] = [move]
+            return move
+        _, move = search_root(board, depth, learning_data, ctx, pv)
         return move
+    except SearchAborted:
+        raise
     except Exception as e:
-        logging.error(f"Bot move generation failed: {e}")
+        engine_log.error(f"Bot move generation failed: {e}")
         return random.choice(list(board.legal_moves)) if board.legal_moves else None
 
-# --- PUZZLES (Static Example) ---
+def book_move(board):
+    try:
+        if os.path.exists(EXPLORER_DB):
+            move = get_opening_explorer().choose_move(board)
+            if move is not None:
+                return move
+    except Exception as e:
+        engine_log.error(f"Opening explorer lookup failed: {e}")
+    if os.path.exists("polyglot.bin"):
+        with chess.polyglot.open_reader("polyglot.bin") as reader:
+            entries = list(reader.find_all(board))
+            if entries:
+                return max(entries, key=lambda e: e.weight).move
+    return None
+
+# --- ANALYSIS STORE ---
+def open_db(path):
+    conn = sqlite3.connect(path, timeout=DB_TIMEOUT, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")  # Readers never block the writer
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+def signed_hash(zobrist):
+    # sqlite integers are signed 64-bit
+    return zobrist - (1 << 64) if zobrist >= (1 << 63) else zobrist
+
+def hash_file_range(digest, path, start, end):
+    # Feeds bytes [start, end) of the file into a running hashlib digest
+    with open(path, "rb") as f:
+        f.seek(start)
+        remaining = end - start
+        while remaining > 0:
+            chunk = f.read(min(remaining, 1 << 20))
+            if not chunk:
+                break
+            digest.update(chunk)
+            remaining -= len(chunk)
+    return digest
+
+def weights_signature(learning_data):
+    key = weights_key(learning_data)
+    return "" if key is None else ",".join(repr(value) for value in key)
+
+class AnalysisStore:
+    EVICT_EVERY = 1000
+    TOUCH_BATCH = 256  # Recency updates are written in batches instead of on every read
+
+    def __init__(self, path=ANALYSIS_DB, max_entries=ANALYSIS_DB_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self.local = threading.local()
+        self.writes = 0
+        self.touched = {}
+        self.touch_lock = threading.Lock()
+        conn = self.connection()
+        with conn:
+            columns = [row[1] for row in conn.execute("PRAGMA table_info(analysis)")]
+            if columns and "weights" not in columns:
+                # Entries from before scores were keyed by weights cannot be attributed to any engine
+                conn.execute("DROP TABLE analysis")
+                engine_log.info("Analysis store predates weight signatures, starting a new one")
+            conn.execute("CREATE TABLE IF NOT EXISTS analysis (hash INTEGER NOT NULL, weights TEXT NOT NULL, depth INTEGER NOT NULL, score REAL NOT NULL, best_move TEXT, last_used REAL NOT NULL, PRIMARY KEY (hash, weights, depth))")
+            conn.execute("CREATE INDEX IF NOT EXISTS analysis_last_used ON analysis (last_used)")
+
+    def connection(self):
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = self.local.conn = open_db(self.path)
+        return conn
+
+    def lookup(self, board, depth, learning_data=None):
+        key = signed_hash(chess.polyglot.zobrist_hash(board))
+        weights = weights_signature(learning_data)
+        conn = self.connection()
+        row = conn.execute("SELECT depth, score, best_move FROM analysis WHERE hash = ? AND weights = ? AND depth >= ? ORDER BY depth DESC LIMIT 1", (key, weights, depth)).fetchone()
+        if row is None:
+            return None
+        move = chess.Move.from_uci(row[2]) if row[2] else None
+        if move is not None and not board.is_legal(move):
+            return None  # Hash collision
+        with self.touch_lock:
+            self.touched[(key, weights, row[0])] = time.time()
+            full = len(self.touched) >= self.TOUCH_BATCH
+        if full:
+            self.flush_touched()
+        return row[1], move
+
+    def flush_touched(self, conn=None):
+        with self.touch_lock:
+            touched, self.touched = self.touched, {}
+        if not touched:
+            return
+        conn = conn or self.connection()
+        with conn:
+            conn.executemany("UPDATE analysis SET last_used = ? WHERE hash = ? AND weights = ? AND depth = ?",
+                             [(used, key, weights, depth) for (key, weights, depth), used in touched.items()])
+
+    def store(self, board, depth, score, move, learning_data=None):
+        key = signed_hash(chess.polyglot.zobrist_hash(board))
+        conn = self.connection()
+        with conn:
+            conn.execute("INSERT OR REPLACE INTO analysis VALUES (?, ?, ?, ?, ?, ?)", (key, weights_signature(learning_data), depth, score, move.uci() if move else None, time.time()))
+        self.writes += 1
+        if self.writes % self.EVICT_EVERY == 0:
+            self.evict()
+
+    def evict(self):
+        conn = self.connection()
+        self.flush_touched(conn)
+        with conn:
+            count = conn.execute("SELECT COUNT(*) FROM analysis").fetchone()[0]
+            if count > self.max_entries:
+                conn.execute("DELETE FROM analysis WHERE rowid IN (SELECT rowid FROM analysis ORDER BY last_used LIMIT ?)", (count - self.max_entries,))
+                engine_log.info(f"Analysis store evicted {count - self.max_entries} entries")
+
+ANALYSIS_STORE = None
+
+def get_analysis_store():
+    global ANALYSIS_STORE
+    if ANALYSIS_STORE is None:
+        ANALYSIS_STORE = AnalysisStore()
+        atexit.register(ANALYSIS_STORE.flush_touched)
+    return ANALYSIS_STORE
+
+def analyze_position(board, depth, learning_data=None):
+    try:
+        store = get_analysis_store()
+        cached = store.lookup(board, depth, learning_data)
+        if cached is not None:
+            return cached
+    except Exception as e:
+        engine_log.error(f"Analysis store lookup failed: {e}")
+        store = None
+    score, move = alpha_beta(board, depth, -float('inf'), float('inf'), board.turn == chess.WHITE, learning_data)
+    try:
+        if store is not None:
+            store.store(board, depth, score, move, learning_data)
+    except Exception as e:
+        engine_log.error(f"Analysis store write failed: {e}")
+    return score, move
+
+# --- GAME HISTORY ---
+class GameHistory:
+    def __init__(self, path=HISTORY_DB):
+        self.path = path
+        self.local = threading.local()
+        conn = self.connection()
+        with conn:
+            conn.execute("""CREATE TABLE IF NOT EXISTS games (
+                id INTEGER PRIMARY KEY, played_at REAL NOT NULL, result TEXT NOT NULL, score REAL NOT NULL,
+                elo REAL NOT NULL, accuracy REAL NOT NULL, accurate_moves INTEGER NOT NULL, total_moves INTEGER NOT NULL,
+                blunders INTEGER NOT NULL, time_white REAL NOT NULL, time_black REAL NOT NULL, difficulty INTEGER,
+                opening TEXT, moves TEXT NOT NULL, report TEXT)""")
+            conn.execute("CREATE INDEX IF NOT EXISTS games_played_at ON games (played_at)")
+            conn.execute("CREATE INDEX IF NOT EXISTS games_opening ON games (opening, accuracy)")
+            conn.execute("CREATE TABLE IF NOT EXISTS snapshots (id INTEGER PRIMARY KEY, taken_at REAL NOT NULL, game_id INTEGER REFERENCES games (id), data TEXT NOT NULL)")
+
+    def connection(self):
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = self.local.conn = open_db(self.path)
+        return conn
+
+    def latest_snapshot(self):
+        row = self.connection().execute("SELECT data FROM snapshots ORDER BY id DESC LIMIT 1").fetchone()
+        return json.loads(row[0]) if row else None
+
+    def save_snapshot(self, learning_data, game_id=None):
+        conn = self.connection()
+        with conn:
+            conn.execute("INSERT INTO snapshots (taken_at, game_id, data) VALUES (?, ?, ?)", (time.time(), game_id, json.dumps(learning_data)))
+            self.prune_snapshots(conn)
+
+    def prune_snapshots(self, conn):
+        # Only the latest snapshot is ever loaded
+        conn.execute("DELETE FROM snapshots WHERE id <= (SELECT MAX(id) FROM snapshots) - ?", (HISTORY_SNAPSHOTS_KEPT,))
+
+    def record_game(self, game, learning_data):
+        # Game row and weight snapshot commit together or not at all
+        conn = self.connection()
+        with conn:
+            cursor = conn.execute(
+                "INSERT INTO games (played_at, result, score, elo, accuracy, accurate_moves, total_moves, blunders, time_white, time_black, difficulty, opening, moves, report) "
+                "VALUES (:played_at, :result, :score, :elo, :accuracy, :accurate_moves, :total_moves, :blunders, :time_white, :time_black, :difficulty, :opening, :moves, :report)",
+                game)
+            conn.execute("INSERT INTO snapshots (taken_at, game_id, data) VALUES (?, ?, ?)", (time.time(), cursor.lastrowid, json.dumps(learning_data)))
+            self.prune_snapshots(conn)
+        return cursor.lastrowid
+
+    def rating_over_time(self, bucket="day", limit=30):
+        fmt = {"day": "%Y-%m-%d", "month": "%Y-%m", "year": "%Y"}[bucket]
+        conn = self.connection()
+        # Steps back from the latest game one period with games at a time, using index seeks on played_at,
+        # so only the games of the last `limit` periods are grouped
+        start, periods = None, 0
+        latest = conn.execute("SELECT MAX(played_at) FROM games").fetchone()[0]
+        while latest is not None and periods < limit:
+            start = conn.execute("SELECT CAST(strftime('%s', ?, 'unixepoch', ?) AS INTEGER)", (latest, f"start of {bucket}")).fetchone()[0]
+            periods += 1
+            latest = conn.execute("SELECT MAX(played_at) FROM games WHERE played_at < ?", (start,)).fetchone()[0]
+        if start is None:
+            return []
+        return conn.execute(
+            "SELECT strftime(?, played_at, 'unixepoch') AS period, AVG(elo), COUNT(*) FROM games WHERE played_at >= ? GROUP BY period ORDER BY period",
+            (fmt, start)).fetchall()
+
+    def accuracy_by_opening(self, min_games=1, limit=20):
+        return self.connection().execute(
+            "SELECT opening, AVG(accuracy), AVG(score), COUNT(*) AS n FROM games GROUP BY opening HAVING n >= ? ORDER BY n DESC LIMIT ?",
+            (min_games, limit)).fetchall()
+
+    def iter_games(self, since_id=0):
+        cursor = self.connection().execute("SELECT id, result, moves FROM games WHERE id > ? ORDER BY id", (since_id,))
+        for game_id, result, moves in cursor:
+            yield game_id, result, moves.split() if moves else []
+
+HISTORY = None
+
+def get_history():
+    global HISTORY
+    if HISTORY is None:
+        HISTORY = GameHistory()
+    return HISTORY
+
+def opening_name(moves, plies=OPENING_PLIES):
+    board = chess.Board()
+    sans = []
+    for move in moves[:plies]:
+        sans.append(board.san(move))
+        board.push(move)
+    return " ".join(sans)
+
+# --- OPENING EXPLORER ---
+def explorer_move_key(board, move):
+    # Polyglot move encoding, castling as king takes rook
+    if board.is_castling(move):
+        rook_file = 7 if board.is_kingside_castling(move) else 0
+        move = chess.Move(move.from_square, chess.square(rook_file, chess.square_rank(move.from_square)))
+    promotion = move.promotion - 1 if move.promotion else 0
+    return move.to_square | move.from_square << 6 | promotion << 12
+
+def explorer_move(board, key):
+    from_square, to_square, promotion = key >> 6 & 63, key & 63, key >> 12 & 7
+    piece, target = board.piece_at(from_square), board.piece_at(to_square)
+    if piece and piece.piece_type == chess.KING and target and target.piece_type == chess.ROOK and target.color == piece.color:
+        to_square = chess.square(6 if to_square > from_square else 2, chess.square_rank(from_square))
+    return chess.Move(from_square, to_square, promotion + 1 if promotion else None)
+
+def polyglot_weights(moves):
+    # Book weights are 16-bit: a position's weights are scaled down together and moves that round to 0 are left out
+    scale = max(1, math.ceil(max(weight for _, weight in moves) / 0xFFFF))
+    return [(move, weight // scale) for move, weight in moves if weight // scale]
+
+class ExplorerVisitor(chess.pgn.BaseVisitor):
+    # Collects (hash, move) pairs of the mainline without building a game tree
+    def __init__(self, max_plies):
+        self.max_plies = max_plies
+
+    def begin_game(self):
+        self.headers = {}
+        self.positions = []
+
+    def visit_header(self, tagname, tagvalue):
+        self.headers[tagname] = tagvalue
+
+    def end_headers(self):
+        if "FEN" in self.headers or self.headers.get("Result") not in ("1-0", "0-1", "1/2-1/2"):
+            return chess.pgn.SKIP
+        return None
+
+    def begin_variation(self):
+        return chess.pgn.SKIP
+
+    def handle_error(self, error):
+        # The parser skips the rest of the game; its earlier moves still count
+        engine_log.warning(f"PGN error in {self.headers.get('White', '?')} - {self.headers.get('Black', '?')}: {error}")
+
+    def begin_parse_san(self, board, san):
+        return chess.pgn.SKIP if board.ply() >= self.max_plies else None
+
+    def visit_move(self, board, move):
+        self.positions.append((board.turn, signed_hash(chess.polyglot.zobrist_hash(board)), explorer_move_key(board, move)))
+
+    def result(self):
+        return self.headers, self.positions
+
+class OpeningExplorer:
+    BATCH_GAMES = 5000
+
+    def __init__(self, path=EXPLORER_DB):
+        self.path = path
+        self.local = threading.local()
+        conn = self.connection()
+        with conn:
+            columns = [row[1] for row in conn.execute("PRAGMA table_info(moves)")]
+            if columns and "source_id" not in columns:
+                # Counts from before per-source rows cannot be taken back out when a file changes
+                conn.execute("DROP TABLE moves")
+                conn.execute("DROP TABLE sources")
+                engine_log.warning(f"{path} predates per-source counts; import the PGN files again")
+            # sha1 of the first size bytes: a rewritten file is told apart from an appended one by content, not mtime
+            conn.execute("CREATE TABLE IF NOT EXISTS sources (id INTEGER PRIMARY KEY, path TEXT UNIQUE NOT NULL, size INTEGER NOT NULL, digest TEXT NOT NULL, games INTEGER NOT NULL)")
+            # Results are from the mover's point of view; losses = games - wins - draws
+            conn.execute("CREATE TABLE IF NOT EXISTS moves (hash INTEGER NOT NULL, move INTEGER NOT NULL, source_id INTEGER NOT NULL, games INTEGER NOT NULL, wins INTEGER NOT NULL, "
+                         "draws INTEGER NOT NULL, elo_sum INTEGER NOT NULL, elo_games INTEGER NOT NULL, PRIMARY KEY (hash, move, source_id)) WITHOUT ROWID")
+
+    def connection(self):
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = self.local.conn = open_db(self.path)
+        return conn
+
+    def import_pgn(self, path, max_plies=EXPLORER_MAX_PLIES, progress=None):
+        conn = self.connection()
+        size = os.path.getsize(path)
+        key = os.path.abspath(path)
+        row = conn.execute("SELECT id, size, digest, games FROM sources WHERE path = ?", (key,)).fetchone()
+        digest = hash_file_range(hashlib.sha1(), path, 0, row[1]) if row and row[1] <= size else None
+        if digest is not None and digest.hexdigest() == row[2]:
+            if row[1] == size:
+                return 0
+            source_id, start, total = row[0], row[1], row[3]  # Appended to since the last import: index the tail only
+        else:
+            with conn:
+                if row:
+                    engine_log.info(f"{path} changed since it was imported; replacing its games")
+                    conn.execute("DELETE FROM moves WHERE source_id = ?", (row[0],))
+                    conn.execute("DELETE FROM sources WHERE id = ?", (row[0],))
+                digest = hashlib.sha1()
+                source_id = conn.execute("INSERT INTO sources (path, size, digest, games) VALUES (?, 0, ?, 0)", (key, digest.hexdigest())).lastrowid
+            start, total = 0, 0
+        hashed = start
+        visitor = ExplorerVisitor(max_plies)
+        stats = {}
+        games = 0
+        with open(path, encoding="utf-8", errors="replace") as f:
+            f.seek(start)
+            while True:
+                parsed = chess.pgn.read_game(f, Visitor=lambda: visitor)
+                if parsed is None:
+                    break
+                headers, positions = parsed
+                if positions:
+                    result = headers["Result"]
+                    for turn, zobrist, move in positions:
+                        entry = stats.setdefault((zobrist, move), [0, 0, 0, 0, 0])
+                        entry[0] += 1
+                        if result == "1/2-1/2":
+                            entry[2] += 1
+                        elif (result == "1-0") == (turn == chess.WHITE):
+                            entry[1] += 1
+                        elo = headers.get("WhiteElo" if turn == chess.WHITE else "BlackElo", "")
+                        if elo.isdigit():
+                            entry[3] += int(elo)
+                            entry[4] += 1
+                    games += 1
+                if games and games % self.BATCH_GAMES == 0 and stats:
+                    offset = f.tell()
+                    hash_file_range(digest, path, hashed, offset)
+                    hashed = offset
+                    self.flush(stats, source_id, offset, digest.hexdigest(), total + games)
+                    stats = {}
+                    if progress:
+                        progress(games)
+            offset = f.tell()
+            hash_file_range(digest, path, hashed, offset)
+            self.flush(stats, source_id, offset, digest.hexdigest(), total + games)
+        engine_log.info(f"Opening explorer imported {games} games from {path}")
+        return games
+
+    def flush(self, stats, source_id, offset, digest, games):
+        # Counts and the resume offset commit together, so an interrupted import picks up where it stopped
+        conn = self.connection()
+        with conn:
+            conn.executemany("INSERT INTO moves VALUES (?, ?, ?, ?, ?, ?, ?, ?) ON CONFLICT (hash, move, source_id) DO UPDATE SET games = games + excluded.games, wins = wins + excluded.wins, "
+                             "draws = draws + excluded.draws, elo_sum = elo_sum + excluded.elo_sum, elo_games = elo_games + excluded.elo_games",
+                             [key + (source_id,) + tuple(entry) for key, entry in stats.items()])
+            conn.execute("UPDATE sources SET size = ?, digest = ?, games = ? WHERE id = ?", (offset, digest, games, source_id))
+
+    def lookup(self, board):
+        rows = self.connection().execute("SELECT move, SUM(games), SUM(wins), SUM(draws), SUM(elo_sum), SUM(elo_games) FROM moves WHERE hash = ? GROUP BY move ORDER BY 2 DESC",
+                                         (signed_hash(chess.polyglot.zobrist_hash(board)),)).fetchall()
+        entries = []
+        for key, games, wins, draws, elo_sum, elo_games in rows:
+            move = explorer_move(board, key)
+            if not board.is_legal(move):
+                continue  # Hash collision
+            entries.append({"move": move, "games": games, "wins": wins, "draws": draws, "losses": games - wins - draws,
+                            "score": (wins + draws / 2) / games, "elo": elo_sum / elo_games if elo_games else None})
+        return entries
+
+    def choose_move(self, board, min_games=EXPLORER_MIN_GAMES):
+        entries = [entry for entry in self.lookup(board) if entry["games"] >= min_games and entry["score"] > 0]
+        if not entries:
+            return None
+        return random.choices([entry["move"] for entry in entries], weights=[entry["games"] * entry["score"] for entry in entries])[0]
+
+    def polyglot_entries(self, min_games=EXPLORER_MIN_GAMES):
+        # Book files are sorted by unsigned key: non-negative signed hashes first
+        conn = self.connection()
+        for clause in ("hash >= 0", "hash < 0"):
+            position, moves = None, []
+            for zobrist, move, wins, draws in conn.execute(f"SELECT hash, move, SUM(wins), SUM(draws) FROM moves WHERE {clause} GROUP BY hash, move HAVING SUM(games) >= ? ORDER BY hash, move", (min_games,)):
+                if zobrist != position:
+                    yield from self.polyglot_position(position, moves)
+                    position, moves = zobrist, []
+                moves.append((move, 2 * wins + draws))
+            yield from self.polyglot_position(position, moves)
+
+    def polyglot_position(self, zobrist, moves):
+        if zobrist is None:
+            return
+        for move, weight in polyglot_weights(moves):
+            yield zobrist & 0xFFFFFFFFFFFFFFFF, move, weight
+
+    def export_polyglot(self, path, min_games=EXPLORER_MIN_GAMES):
+        count = 0
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            for zobrist, move, weight in self.polyglot_entries(min_games):
+                f.write(struct.pack(">QHHI", zobrist, move, weight, 0))
+                count += 1
+        os.replace(tmp_path, path)
+        engine_log.info(f"Exported {count} book entries to {path}")
+        return count
+
+def verify_polyglot(explorer, path, min_games=EXPLORER_MIN_GAMES, max_positions=1000):
+    # Walks the explorer tree from the start position and compares each position with the book as read by python-chess
+    checked, mismatches = 0, []
+    pending = deque([chess.Board()])
+    with chess.polyglot.open_reader(path) as reader:
+        while pending and checked < max_positions:
+            board = pending.popleft()
+            moves = [(entry["move"], 2 * entry["wins"] + entry["draws"]) for entry in explorer.lookup(board) if entry["games"] >= min_games]
+            expected = dict(polyglot_weights(moves)) if moves else {}
+            found = {entry.move: entry.weight for entry in reader.find_all(board)}
+            checked += 1
+            if expected != found:
+                mismatches.append((board.fen(), sorted(f"{m.uci()}:{w}" for m, w in expected.items()), sorted(f"{m.uci()}:{w}" for m, w in found.items())))
+            for move in expected:
+                child = board.copy(stack=False)
+                child.push(move)
+                pending.append(child)
+    return checked, mismatches
+
+OPENING_EXPLORER = None
+
+def get_opening_explorer():
+    global OPENING_EXPLORER
+    if OPENING_EXPLORER is None:
+        OPENING_EXPLORER = OpeningExplorer()
+    return OPENING_EXPLORER
+
+# --- GAME DATABASE ---
+MATERIAL_LETTERS = "PNBRQ"
+
+def material_signature(board):
+    # Four bits per piece count: White's P N B R Q, then Black's
+    signature = 0
+    for color_index, color in enumerate((chess.WHITE, chess.BLACK)):
+        for piece_type in range(chess.PAWN, chess.KING):
+            count = min(15, chess.popcount(board.pieces_mask(piece_type, color)))
+            signature |= count << (color_index * 5 + piece_type - 1) * 4
+    return signature
+
+def parse_material(pattern):
+    # "KRPvKR": White's pieces, then Black's; kings are implied
+    sides = pattern.upper().replace(" ", "").split("V")
+    if len(sides) != 2:
+        raise ValueError(f"Material pattern {pattern!r} must look like KRPvKR")
+    signature = 0
+    for color_index, side in enumerate(sides):
+        for letter in side.replace("K", ""):
+            if letter not in MATERIAL_LETTERS:
+                raise ValueError(f"Unknown piece {letter!r} in {pattern!r}")
+            signature += 1 << (color_index * 5 + MATERIAL_LETTERS.index(letter)) * 4
+    return signature
+
+class GameRecordVisitor(chess.pgn.BaseVisitor):
+    # Mainline moves plus the first ply at which each position and material balance occurs
+    def begin_game(self):
+        self.headers = {}
+        self.moves = []
+        self.positions = {}
+        self.materials = {}
+        self.material_changed = True
+
+    def visit_header(self, tagname, tagvalue):
+        self.headers[tagname] = tagvalue
+
+    def begin_variation(self):
+        return chess.pgn.SKIP
+
+    def handle_error(self, error):
+        engine_log.warning(f"PGN error in {self.headers.get('White', '?')} - {self.headers.get('Black', '?')}: {error}")
+
+    def visit_move(self, board, move):
+        self.moves.append(move.uci())
+        self.material_changed = board.is_capture(move) or move.promotion is not None
+
+    def visit_board(self, board):
+        ply = len(self.moves)
+        self.positions.setdefault(signed_hash(chess.polyglot.zobrist_hash(board)), ply)
+        if self.material_changed:
+            self.materials.setdefault(material_signature(board), ply)
+            self.material_changed = False
+
+    def result(self):
+        return self
+
+class GameDatabase:
+    BATCH_GAMES = 1000
+
+    def __init__(self, path=GAME_DB):
+        self.path = path
+        self.local = threading.local()
+        conn = self.connection()
+        with conn:
+            columns = [row[1] for row in conn.execute("PRAGMA table_info(games)")]
+            if columns and "source_id" not in columns:
+                # Games from before they were tied to a source could not be replaced when their file changes
+                for table in ("material", "positions", "games", "sources"):
+                    conn.execute(f"DROP TABLE IF EXISTS {table}")
+                engine_log.warning(f"{path} predates per-source games; import the PGN files again")
+            # sha1 of the first size bytes, as in the opening explorer
+            conn.execute("CREATE TABLE IF NOT EXISTS sources (id INTEGER PRIMARY KEY, path TEXT UNIQUE NOT NULL, size INTEGER NOT NULL, digest TEXT NOT NULL, games INTEGER NOT NULL)")
+            conn.execute("CREATE TABLE IF NOT EXISTS games (id INTEGER PRIMARY KEY, source_id INTEGER NOT NULL, white TEXT, black TEXT, result TEXT, date TEXT, white_elo INTEGER, black_elo INTEGER, "
+                         "headers TEXT NOT NULL, moves TEXT NOT NULL)")
+            conn.execute("CREATE INDEX IF NOT EXISTS games_source ON games (source_id)")
+            # Hashes and signatures lead the primary keys: a query is one index range scan
+            conn.execute("CREATE TABLE IF NOT EXISTS positions (hash INTEGER NOT NULL, game_id INTEGER NOT NULL, ply INTEGER NOT NULL, PRIMARY KEY (hash, game_id)) WITHOUT ROWID")
+            conn.execute("CREATE TABLE IF NOT EXISTS material (signature INTEGER NOT NULL, game_id INTEGER NOT NULL, ply INTEGER NOT NULL, PRIMARY KEY (signature, game_id)) WITHOUT ROWID")
+
+    def connection(self):
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = self.local.conn = open_db(self.path)
+        return conn
+
+    def import_pgn(self, path, progress=None):
+        conn = self.connection()
+        size = os.path.getsize(path)
+        key = os.path.abspath(path)
+        row = conn.execute("SELECT id, size, digest, games FROM sources WHERE path = ?", (key,)).fetchone()
+        digest = hash_file_range(hashlib.sha1(), path, 0, row[1]) if row and row[1] <= size else None
+        if digest is not None and digest.hexdigest() == row[2]:
+            if row[1] == size:
+                return 0
+            source_id, start, total = row[0], row[1], row[3]  # Appended to since the last import: index the tail only
+        else:
+            with conn:
+                if row:
+                    engine_log.info(f"{path} changed since it was imported; replacing its games")
+                    for table in ("positions", "material"):
+                        conn.execute(f"DELETE FROM {table} WHERE game_id IN (SELECT id FROM games WHERE source_id = ?)", (row[0],))
+                    conn.execute("DELETE FROM games WHERE source_id = ?", (row[0],))
+                    conn.execute("DELETE FROM sources WHERE id = ?", (row[0],))
+                digest = hashlib.sha1()
+                source_id = conn.execute("INSERT INTO sources (path, size, digest, games) VALUES (?, 0, ?, 0)", (key, digest.hexdigest())).lastrowid
+            start, total = 0, 0
+        hashed = start
+        batch = []
+        games = 0
+        with open(path, encoding="utf-8", errors="replace") as f:
+            f.seek(start)
+            while True:
+                record = chess.pgn.read_game(f, Visitor=GameRecordVisitor)
+                if record is None:
+                    break
+                if record.moves:
+                    batch.append(record)
+                    games += 1
+                if len(batch) >= self.BATCH_GAMES:
+                    offset = f.tell()
+                    hash_file_range(digest, path, hashed, offset)
+                    hashed = offset
+                    self.insert_batch(batch, source_id, offset, digest.hexdigest(), total + games)
+                    batch = []
+                    if progress:
+                        progress(games)
+            offset = f.tell()
+            hash_file_range(digest, path, hashed, offset)
+            self.insert_batch(batch, source_id, offset, digest.hexdigest(), total + games)
+        engine_log.info(f"Game database imported {games} games from {path}")
+        return games
+
+    def insert_batch(self, batch, source_id, offset, digest, games):
+        conn = self.connection()
+        with conn:
+            for record in batch:
+                headers = record.headers
+                elos = [int(headers[tag]) if headers.get(tag, "").isdigit() else None for tag in ("WhiteElo", "BlackElo")]
+                game_id = conn.execute("INSERT INTO games (source_id, white, black, result, date, white_elo, black_elo, headers, moves) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                                       (source_id, headers.get("White"), headers.get("Black"), headers.get("Result", "*"), headers.get("Date"), elos[0], elos[1],
+                                        json.dumps(headers), " ".join(record.moves))).lastrowid
+                conn.executemany("INSERT INTO positions VALUES (?, ?, ?)", [(zobrist, game_id, ply) for zobrist, ply in record.positions.items()])
+                conn.executemany("INSERT INTO material VALUES (?, ?, ?)", [(signature, game_id, ply) for signature, ply in record.materials.items()])
+            conn.execute("UPDATE sources SET size = ?, digest = ?, games = ? WHERE id = ?", (offset, digest, games, source_id))
+
+    def search_position(self, board, limit=GAME_DB_SEARCH_LIMIT):
+        # 64-bit hashes: collisions are not worth replaying every hit to rule out
+        return self.search("positions", "hash", signed_hash(chess.polyglot.zobrist_hash(board)), limit)
+
+    def search_material(self, pattern, limit=GAME_DB_SEARCH_LIMIT):
+        return self.search("material", "signature", parse_material(pattern), limit)
+
+    def search(self, table, column, key, limit):
+        conn = self.connection()
+        # Counting stops past GAME_DB_COUNT_LIMIT so a common position costs no more than a rare one
+        total = conn.execute(f"SELECT COUNT(*) FROM (SELECT 1 FROM {table} WHERE {column} = ? LIMIT ?)", (key, GAME_DB_COUNT_LIMIT + 1)).fetchone()[0]
+        total = f"{GAME_DB_COUNT_LIMIT}+" if total > GAME_DB_COUNT_LIMIT else str(total)
+        rows = conn.execute(f"SELECT g.id, x.ply, g.white, g.black, g.result, g.date, g.white_elo, g.black_elo FROM {table} x JOIN games g ON g.id = x.game_id "
+                            f"WHERE x.{column} = ? ORDER BY x.game_id LIMIT ?", (key, limit)).fetchall()
+        return total, rows
+
+    def load(self, game_id):
+        headers, moves = self.connection().execute("SELECT headers, moves FROM games WHERE id = ?", (game_id,)).fetchone()
+        game = chess.pgn.Game(json.loads(headers))
+        node = game
+        board = game.board()
+        for uci in moves.split():
+            move = chess.Move.from_uci(uci)
+            node = node.add_variation(move)
+            board.push(move)
+        return game
+
+GAME_DATABASE = None
+
+def get_game_database():
+    global GAME_DATABASE
+    if GAME_DATABASE is None:
+        GAME_DATABASE = GameDatabase()
+    return GAME_DATABASE
+
+# --- REPLAY ---
+class ReplayIndex:
+    # A game record with board snapshots every `interval` plies and the SAN of every move
+    def __init__(self, start, moves=(), interval=REPLAY_SNAPSHOT_INTERVAL):
+        self.interval = interval
+        self.moves = []
+        self.sans = []
+        self.snapshots = [start.copy(stack=False)]
+        self.tip = start.copy(stack=False)
+        for move in moves:
+            self.append(move)
+
+    def append(self, move):
+        self.sans.append(self.tip.san(move))
+        self.tip.push(move)
+        self.moves.append(move)
+        if len(self.moves) % self.interval == 0:
+            self.snapshots.append(self.tip.copy(stack=False))
+
+    def truncate(self, ply):
+        del self.moves[ply:]
+        del self.sans[ply:]
+        del self.snapshots[ply // self.interval + 1:]
+        self.tip = self.position(ply)
+
+    def position(self, ply):
+        board = self.snapshots[ply // self.interval].copy(stack=False)
+        for move in self.moves[ply - ply % self.interval:ply]:
+            board.push(move)
+        return board
+
+# --- MEMORY AND DISK BUDGETS ---
+def append_capped(path, text, max_bytes):
+    # Once the file outgrows max_bytes, whole entries are dropped from the front down to half of it
+    with open(path, "a", encoding="utf-8") as f:
+        f.write(text)
+    if os.path.getsize(path) <= max_bytes:
+        return
+    with open(path, encoding="utf-8") as f:
+        content = f.read()
+    kept = content[-(max_bytes // 2):]
+    boundary = kept.find("\n\n")
+    kept = kept[boundary + 2:] if boundary >= 0 else kept
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(kept)
+    os.replace(tmp_path, path)
+
+def prune_directory(path, keep, suffix):
+    entries = sorted((entry for entry in os.scandir(path) if entry.name.endswith(suffix)), key=lambda entry: entry.stat().st_mtime)
+    for entry in entries[:max(0, len(entries) - keep)]:
+        os.remove(entry.path)
+
+def current_rss():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return None  # Not Linux
+
+def cache_report():
+    rss = current_rss()
+    return [f"RSS: {rss / 1e6:.1f} MB" if rss else "RSS: unavailable",
+            f"Evaluation cache: {EVAL_CACHE.stats()['size']}/{EVAL_CACHE.max_size}",
+            f"Tablebase cache: {TB_CACHE.stats()['size']}/{TB_CACHE.max_size}",
+            f"Transposition table: {TRANSPOSITION_TABLE.filled}/{TRANSPOSITION_TABLE.size} slots",
+            f"Evaluation tables: {len(EVAL_TABLES)}"]
+
+def dump_memory(previous=None, path=MEMORY_DUMP_FILE, extra=()):
+    # The first call starts tracing (PYTHONTRACEMALLOC=1 traces from launch); later calls also list growth since the previous dump
+    lines = cache_report() + list(extra)
+    if not tracemalloc.is_tracing():
+        tracemalloc.start()
+        lines.append("\ntracemalloc started: dump again later to see what grows")
+    snapshot = tracemalloc.take_snapshot().filter_traces([tracemalloc.Filter(False, tracemalloc.__file__)])
+    current, peak = tracemalloc.get_traced_memory()
+    lines.append(f"\nTraced: {current / 1e6:.1f} MB (peak {peak / 1e6:.1f} MB)")
+    lines.append(f"\nTop {MEMORY_DUMP_TOP} allocation sites:")
+    lines += [str(stat) for stat in snapshot.statistics("lineno")[:MEMORY_DUMP_TOP]]
+    if previous is not None:
+        lines.append("\nGrowth since the previous dump:")
+        lines += [str(stat) for stat in snapshot.compare_to(previous, "lineno")[:MEMORY_DUMP_TOP]]
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(f"Memory dump - {datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n" + "\n".join(lines) + "\n")
+    return snapshot
+
+# --- PUZZLES ---
 PUZZLES = [
-    {"fen": "rnbqkb1r/pppp1ppp/5n2/5p2/5P2/5N2/PPPP1PPP/RNBQKB1R w KQkq - 1 2", "move": "e4", "solution": "e5"},
-    {"fen": "rnbqkbnr/pppp1ppp/5n2/5p2/4P3/5N2/PPPP1PPP/RNBQKB1R b KQkq - 1 2", "move": "e5", "solution": "Nf3"}
+    {"fen": "6k1/5ppp/8/8/8/8/5PPP/3R2K1 w - - 0 1", "solution": ["d1d8"], "rating": 800, "themes": ["mateIn1", "backRankMate"]},
+    {"fen": "r1bqkb1r/pppp1ppp/2n2n2/4p2Q/2B1P3/8/PPPP1PPP/RNB1K1NR w KQkq - 4 4", "solution": ["h5f7"], "rating": 700, "themes": ["mateIn1", "opening"]}
 ]
 
+LICHESS_PUZZLE_COLUMNS = ["PuzzleId", "FEN", "Moves", "Rating", "RatingDeviation", "Popularity", "NbPlays", "Themes", "GameUrl", "OpeningTags"]
+
+def parse_puzzle_line(line):
+    # Both formats list the opponent's setup move first, then the solution line
+    line = line.strip()
+    if not line or line.startswith("PuzzleId"):
+        return None
+    if line.startswith("{"):
+        data = json.loads(line)
+        moves = data["moves"].split() if isinstance(data["moves"], str) else list(data["moves"])
+        themes = data.get("themes", [])
+        return {"id": str(data.get("id", "")), "fen": data["fen"], "moves": moves, "rating": int(data.get("rating", 1500)),
+                "themes": themes.split() if isinstance(themes, str) else list(themes)}
+    row = dict(zip(LICHESS_PUZZLE_COLUMNS, next(csv.reader([line]))))
+    return {"id": row["PuzzleId"], "fen": row["FEN"], "moves": row["Moves"].split(), "rating": int(row["Rating"]), "themes": row.get("Themes", "").split()}
+
+def puzzle_from_record(record):
+    board = chess.Board(record["fen"])
+    board.push_uci(record["moves"][0])
+    return {"id": record["id"], "fen": board.fen(), "solution": record["moves"][1:], "rating": record["rating"], "themes": record["themes"]}
+
+class PuzzleStore:
+    BATCH_SIZE = 10000
+
+    def __init__(self, path=PUZZLE_DB, sources=PUZZLE_SOURCES):
+        self.path = path
+        self.sources = sources
+        self.local = threading.local()
+        self.ready = threading.Event()  # Set once ensure_indexed has run over every source
+        self.progress = 0  # Puzzles indexed since the store was opened
+        conn = self.connection()
+        with conn:
+            columns = [row[1] for row in conn.execute("PRAGMA table_info(sources)")]
+            if columns and "digest" not in columns:
+                # The index is rebuilt from the corpus files, so nothing is lost by starting over
+                conn.execute("DROP TABLE IF EXISTS puzzle_themes")
+                conn.execute("DROP TABLE IF EXISTS puzzles")
+                conn.execute("DROP TABLE sources")
+            # sha1 of the first size bytes: a rewritten file is told apart from an appended one by content
+            conn.execute("CREATE TABLE IF NOT EXISTS sources (id INTEGER PRIMARY KEY, path TEXT UNIQUE NOT NULL, size INTEGER NOT NULL, mtime REAL NOT NULL, digest TEXT NOT NULL)")
+            conn.execute("CREATE TABLE IF NOT EXISTS puzzles (id INTEGER PRIMARY KEY, source_id INTEGER NOT NULL, offset INTEGER NOT NULL, rating INTEGER NOT NULL, length INTEGER NOT NULL, rand INTEGER NOT NULL)")
+            conn.execute("CREATE INDEX IF NOT EXISTS puzzles_rating ON puzzles (rating, rand)")
+            conn.execute("CREATE TABLE IF NOT EXISTS puzzle_themes (theme TEXT NOT NULL, rating INTEGER NOT NULL, rand INTEGER NOT NULL, puzzle_id INTEGER NOT NULL, PRIMARY KEY (theme, rating, rand, puzzle_id)) WITHOUT ROWID")
+
+    def connection(self):
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = self.local.conn = open_db(self.path)
+        return conn
+
+    def ensure_indexed(self):
+        try:
+            for path in self.sources:
+                if os.path.exists(path):
+                    self.index_source(path)
+        finally:
+            self.ready.set()
+
+    def start_indexing(self):
+        def run():
+            try:
+                self.ensure_indexed()
+            except Exception as e:
+                engine_log.error(f"Puzzle indexing failed: {e}")
+
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        return thread
+
+    def index_source(self, path):
+        conn = self.connection()
+        stat = os.stat(path)
+        row = conn.execute("SELECT id, size, mtime, digest FROM sources WHERE path = ?", (path,)).fetchone()
+        if row and row[1] == stat.st_size and row[2] == stat.st_mtime:
+            return 0
+        digest = hash_file_range(hashlib.sha1(), path, 0, row[1]) if row and row[1] <= stat.st_size else None
+        if digest is not None and digest.hexdigest() == row[3]:
+            source_id, start = row[0], row[1]  # File was appended to (or only touched): index the tail only
+        else:
+            with conn:
+                if row:
+                    engine_log.info(f"{path} changed since it was indexed; rebuilding its puzzles")
+                    conn.execute("DELETE FROM puzzle_themes WHERE puzzle_id IN (SELECT id FROM puzzles WHERE source_id = ?)", (row[0],))
+                    conn.execute("DELETE FROM puzzles WHERE source_id = ?", (row[0],))
+                    conn.execute("DELETE FROM sources WHERE id = ?", (row[0],))
+                digest = hashlib.sha1()
+                source_id = conn.execute("INSERT INTO sources (path, size, mtime, digest) VALUES (?, 0, 0, ?)", (path, digest.hexdigest())).lastrowid
+            start = 0
+        count = 0
+        batch = []
+        with open(path, "rb") as f:
+            f.seek(start)
+            offset = start
+            for raw in iter(f.readline, b""):
+                digest.update(raw)
+                try:
+                    record = parse_puzzle_line(raw.decode("utf-8"))
+                except Exception as e:
+                    engine_log.warning(f"Skipping malformed puzzle at {path}:{offset}: {e}")
+                    record = None
+                if record and len(record["moves"]) >= 2:
+                    batch.append((offset, record["rating"], len(record["moves"]) - 1, record["themes"]))
+                offset += len(raw)
+                if len(batch) >= self.BATCH_SIZE:
+                    count += self.insert_batch(source_id, batch)
+                    batch = []
+            count += self.insert_batch(source_id, batch)
+        with conn:
+            conn.execute("UPDATE sources SET size = ?, mtime = ?, digest = ? WHERE id = ?", (offset, stat.st_mtime, digest.hexdigest(), source_id))
+        engine_log.info(f"Indexed {count} puzzles from {path}")
+        return count
+
+    def insert_batch(self, source_id, batch):
+        conn = self.connection()
+        with conn:
+            for offset, rating, length, themes in batch:
+                rand = random.getrandbits(31)
+                puzzle_id = conn.execute("INSERT INTO puzzles (source_id, offset, rating, length, rand) VALUES (?, ?, ?, ?, ?)", (source_id, offset, rating, length, rand)).lastrowid
+                conn.executemany("INSERT OR IGNORE INTO puzzle_themes VALUES (?, ?, ?, ?)", [(theme, rating, rand, puzzle_id) for theme in themes])
+        self.progress += len(batch)
+        return len(batch)
+
+    def count(self):
+        return self.connection().execute("SELECT COUNT(*) FROM puzzles").fetchone()[0]
+
+    def random_puzzle(self, rating=None, window=PUZZLE_RATING_WINDOW, theme=None, length=None):
+        # Index seek to a random (rating, rand) point: no scan over the corpus
+        conn = self.connection()
+        if rating is not None:
+            low, high = rating - window, rating + window
+        else:
+            # Uniform over the ratings actually present, not from the bottom of the index
+            if theme:
+                low, high = conn.execute("SELECT MIN(rating), MAX(rating) FROM puzzle_themes WHERE theme = ?", (theme,)).fetchone()
+            else:
+                low, high = conn.execute("SELECT MIN(rating), MAX(rating) FROM puzzles").fetchone()
+            if low is None:
+                return None
+        pivot = (random.randint(low, high), random.getrandbits(31))
+        length_clause = " AND p.length = ?" if length is not None else ""
+        extra = (length,) if length is not None else ()
+        if theme:
+            query = ("SELECT p.id FROM puzzle_themes t JOIN puzzles p ON p.id = t.puzzle_id WHERE t.theme = ? AND (t.rating, t.rand) {op} (?, ?) AND t.rating {bound} ?"
+                     + length_clause + " ORDER BY t.rating {order}, t.rand {order} LIMIT 1")
+            prefix = (theme,)
+        else:
+            query = ("SELECT p.id FROM puzzles p WHERE (p.rating, p.rand) {op} (?, ?) AND p.rating {bound} ?"
+                     + length_clause + " ORDER BY p.rating {order}, p.rand {order} LIMIT 1")
+            prefix = ()
+        row = conn.execute(query.format(op=">=", bound="<=", order="ASC"), prefix + pivot + (high,) + extra).fetchone()
+        if row is None:
+            row = conn.execute(query.format(op="<", bound=">=", order="DESC"), prefix + pivot + (low,) + extra).fetchone()
+        return self.load(row[0]) if row else None
+
+    def load(self, puzzle_id):
+        # None when the line at the indexed offset no longer holds a puzzle, e.g. the file changed since indexing
+        row = self.connection().execute("SELECT s.path, p.offset FROM puzzles p JOIN sources s ON s.id = p.source_id WHERE p.id = ?", (puzzle_id,)).fetchone()
+        if row is None:
+            return None
+        path, offset = row
+        try:
+            with open(path, "rb") as f:
+                f.seek(offset)
+                record = parse_puzzle_line(f.readline().decode("utf-8"))
+            if record and len(record["moves"]) >= 2:
+                return puzzle_from_record(record)
+        except Exception as e:
+            engine_log.warning(f"Reading puzzle {puzzle_id} at {path}:{offset} failed: {e}")
+            return None
+        engine_log.warning(f"No puzzle at {path}:{offset} for puzzle {puzzle_id}")
+        return None
+
+PUZZLE_STORE = None
+
+def get_puzzle_store():
+    global PUZZLE_STORE
+    if PUZZLE_STORE is None:
+        PUZZLE_STORE = PuzzleStore()
+    return PUZZLE_STORE
+
+# --- PUZZLE GENERATION ---
+def rank_moves(board, depth, learning_data=None):
+    # Every legal move with its score from the mover's point of view, best first
+    sign = 1 if board.turn == chess.WHITE else -1
+    ranked = []
+    for move in board.legal_moves:
+        board.push(move)
+        pv = []
+        if board.is_checkmate():
+            score = 99999
+        else:
+            score = sign * alpha_beta(board, depth - 1, -float('inf'), float('inf'), board.turn == chess.WHITE, learning_data, pv=pv)[0]
+        board.pop()
+        ranked.append((score, move, [move] + pv))
+    ranked.sort(key=lambda entry: entry[0], reverse=True)
+    return ranked
+
+def is_unique_best(ranked, min_swing=PUZZLE_MIN_SWING):
+    if not ranked:
+        return False
+    if len(ranked) == 1:
+        return True
+    return ranked[0][0] - ranked[1][0] >= min_swing
+
+def validate_puzzle(puzzle, depth=PUZZLE_SEARCH_DEPTH, min_swing=PUZZLE_MIN_SWING):
+    # Checks that every solver move in the solution is legal and the unique best move
+    try:
+        board = chess.Board(puzzle["fen"])
+        for step, uci in enumerate(puzzle["solution"]):
+            move = chess.Move.from_uci(uci)
+            if not board.is_legal(move):
+                return False, f"step {step + 1}: {uci} is illegal"
+            if step % 2 == 0:
+                ranked = rank_moves(board, depth)
+                if ranked[0][1] != move:
+                    return False, f"step {step + 1}: engine prefers {ranked[0][1].uci()} over {uci}"
+                if not is_unique_best(ranked, min_swing):
+                    return False, f"step {step + 1}: {uci} is not unique"
+            board.push(move)
+        return True, "ok"
+    except Exception as e:
+        return False, str(e)
+
+def find_puzzles_in_game(game, game_key, depth=PUZZLE_SEARCH_DEPTH, min_swing=PUZZLE_MIN_SWING):
+    puzzles = []
+    board = game.board()
+    for node in game.mainline():
+        setup = node.move
+        before_setup = board.copy(stack=False)
+        board.push(setup)
+        if board.is_game_over():
+            break
+        sign = 1 if board.turn == chess.WHITE else -1
+        static = sign * evaluate(board)
+        ranked = rank_moves(board, depth)
+        best_score, best_move, best_pv = ranked[0]
+        if best_score - static < min_swing or not is_unique_best(ranked, min_swing):
+            continue
+        if board.is_capture(setup) and best_move.to_square == setup.to_square and best_score < 99999:
+            continue  # Plain recapture
+        solution = [best_move]
+        line = board.copy()
+        line.push(best_move)
+        for reply_index in range(1, PUZZLE_MAX_PLIES, 2):
+            if line.is_game_over() or reply_index + 1 >= len(best_pv):
+                break
+            reply = best_pv[reply_index]
+            line.push(reply)
+            follow_up = rank_moves(line, max(1, depth - 1))
+            if not follow_up or follow_up[0][1] != best_pv[reply_index + 1] or not is_unique_best(follow_up, min_swing):
+                line.pop()
+                break
+            solution += [reply, follow_up[0][1]]
+            line.push(follow_up[0][1])
+        themes = ["generated", "mate" if line.is_checkmate() else "advantage", "short" if len(solution) <= 3 else "long"]
+        puzzles.append({"id": f"{game_key}-{len(board.move_stack)}", "fen": before_setup.fen(), "moves": [setup.uci()] + [m.uci() for m in solution],
+                        "rating": int(min(2800, 1000 + 150 * len(solution) + min(best_score - static, 1000) // 4)), "themes": themes})
+    return puzzles
+
+def puzzle_worker(task):
+    path, offset, depth, min_swing = task
+    try:
+        with open(path, encoding="utf-8", errors="replace") as f:
+            f.seek(offset)
+            game = chess.pgn.read_game(f)
+        if game is None:
+            return offset, []
+        return offset, find_puzzles_in_game(game, f"{os.path.basename(path)}:{offset}", depth, min_swing)
+    except Exception as e:
+        engine_log.error(f"Puzzle scan failed at {path}:{offset}: {e}")
+        return offset, []
+
+def pgn_game_offsets(path, start=0):
+    with open(path, encoding="utf-8", errors="replace") as f:
+        f.seek(start)
+        while True:
+            offset = f.tell()
+            if chess.pgn.read_headers(f) is None:
+                break
+            yield offset
+
+def write_json_atomic(path, data):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(data, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+def generate_puzzles(pgn_paths, output="puzzles.jsonl", checkpoint="puzzles_checkpoint.json", workers=None, depth=PUZZLE_SEARCH_DEPTH, min_swing=PUZZLE_MIN_SWING):
+    state = {}
+    if os.path.exists(checkpoint):
+        with open(checkpoint) as f:
+            state = json.load(f)
+    known_ids = set()
+    if os.path.exists(output):
+        with open(output, encoding="utf-8") as f:
+            for line in f:
+                record = parse_puzzle_line(line)
+                if record:
+                    known_ids.add(record["id"])
+    workers = workers or os.cpu_count() or 1
+    started = time.time()
+    total_games = total_puzzles = 0
+    with multiprocessing.Pool(workers) as pool, open(output, "a", encoding="utf-8") as out:
+        for path in pgn_paths:
+            progress = state.setdefault(path, {"next_offset": 0, "games": 0, "puzzles": 0})
+            offsets = pgn_game_offsets(path, progress["next_offset"])
+            while True:
+                chunk = [(path, offset, depth, min_swing) for offset in itertools.islice(offsets, workers * 16)]
+                if not chunk:
+                    break
+                for offset, puzzles in pool.imap(puzzle_worker, chunk):
+                    for puzzle in puzzles:
+                        if puzzle["id"] not in known_ids:
+                            known_ids.add(puzzle["id"])
+                            out.write(json.dumps(puzzle) + "\n")
+                            progress["puzzles"] += 1
+                            total_puzzles += 1
+                    progress["games"] += 1
+                    total_games += 1
+                out.flush()
+                os.fsync(out.fileno())
+                # Resume after the last game of this chunk
+                with open(path, encoding="utf-8", errors="replace") as f:
+                    f.seek(chunk[-1][1])
+                    chess.pgn.skip_game(f)
+                    progress["next_offset"] = f.tell()
+                write_json_atomic(checkpoint, state)
+                elapsed = time.time() - started
+                print(f"{path}: {progress['games']} games, {progress['puzzles']} puzzles | {total_games / elapsed:.1f} games/s", flush=True)
+    if os.path.abspath(output) in [os.path.abspath(source) for source in PUZZLE_SOURCES]:
+        get_puzzle_store().index_source(output)
+    print(f"Done: {total_games} games scanned, {total_puzzles} new puzzles written to {output}")
+    return total_puzzles
+
+# --- WEIGHT TUNING ---
+TUNE_SKIP_PLIES = 8  # Opening book territory
+
+def position_features(board):
+    pieces = [(piece.piece_type, square if piece.color == chess.WHITE else 63 - square, 1 if piece.color == chess.WHITE else -1)
+              for square, piece in board.piece_map().items()]
+    mobility = board.legal_moves.count() * 5 * (1 if board.turn == chess.WHITE else -1)
+    return pieces, mobility
+
+def labeled_positions(games):
+    # Quiet positions labelled with the final result from White's point of view
+    for result, moves in games:
+        score = {"1-0": 1.0, "0-1": 0.0, "1/2-1/2": 0.5}.get(result)
+        if score is None:
+            continue
+        board = chess.Board()
+        for ply, move in enumerate(moves):
+            quiet = not board.is_capture(move)
+            board.push(move)
+            if ply + 1 >= TUNE_SKIP_PLIES and quiet and not board.is_check() and not board.is_game_over():
+                yield position_features(board), score
+
+def history_games():
+    for _, result, moves in get_history().iter_games():
+        yield result, [chess.Move.from_uci(uci) for uci in moves]
+
+def pgn_games(paths):
+    for path in paths:
+        with open(path, encoding="utf-8", errors="replace") as f:
+            while True:
+                game = chess.pgn.read_game(f)
+                if game is None:
+                    break
+                yield game.headers.get("Result", "*"), list(game.mainline_moves())
+
+class TexelTuner:
+    # Only parameters the data can tell apart are fitted. The pawn value fixes the centipawn scale that K would
+    # otherwise trade against every value; the king value cancels out. The pawn and king multipliers only rescale
+    # their own tables, so they stay at 1.0 and the tables are fitted instead.
+    VALUE_TYPES = (chess.KNIGHT, chess.BISHOP, chess.ROOK, chess.QUEEN)
+    PAWN_VALUE = 100.0
+
+    def __init__(self, positions, weights=None):
+        self.positions = positions
+        self.values = {pt: float(PIECE_VALUES[pt]) for pt in self.VALUE_TYPES}
+        self.values[chess.PAWN] = self.PAWN_VALUE
+        self.psqt = {pt: [float(v) for v in PIECE_SQUARE_TABLES[pt]] for pt in PIECE_SQUARE_TABLES}
+        self.weights = {"pawn": 1.0, "king": 1.0, "mobility": float((weights or {}).get("mobility", 1.0))}
+        self.k = 1.0
+        # Flat parameter layout shared by the gradient and Adam state
+        self.layout = [("value", pt, None) for pt in self.VALUE_TYPES] + [("psqt", pt, i) for pt in self.psqt for i in range(64)] + [("weight", "mobility", None)]
+        self.index = {entry: i for i, entry in enumerate(self.layout)}
+        self.adam_m = [0.0] * len(self.layout)
+        self.adam_v = [0.0] * len(self.layout)
+        self.steps = 0
+        self.anchor_tables()
+
+    def anchor_tables(self):
+        # A table's mean is a constant added to every placement of the piece: it is moved into the piece value.
+        # Pawn tables (value pinned) and king tables (value cancels) are kept centred instead.
+        for piece_type, table in self.psqt.items():
+            squares = range(8, 56) if piece_type == chess.PAWN else range(64)  # Pawns never stand on the back ranks
+            mean = sum(table[i] for i in squares) / len(squares)
+            for i in squares:
+                table[i] -= mean
+            if piece_type in self.VALUE_TYPES:
+                self.values[piece_type] += mean
+
+    def evaluate(self, features):
+        pieces, mobility = features
+        score = mobility * self.weights["mobility"]
+        for piece_type, idx, sign in pieces:
+            score += sign * (self.values.get(piece_type, PIECE_VALUES[piece_type]) + self.psqt[piece_type][idx])
+        return score
+
+    def sigmoid(self, score, k=None):
+        exponent = max(-50.0, min(50.0, -(k or self.k) * score / 400))
+        return 1 / (1 + 10 ** exponent)
+
+    def loss(self, positions=None, k=None):
+        positions = positions if positions is not None else self.positions
+        return sum((result - self.sigmoid(self.evaluate(features), k)) ** 2 for features, result in positions) / max(1, len(positions))
+
+    def fit_k(self):
+        best = min((self.loss(k=k / 10), k / 10) for k in range(2, 31))
+        self.k = best[1]
+        return self.k
+
+    def gradient(self, batch):
+        grad = [0.0] * len(self.layout)
+        scale = math.log(10) * self.k / 400
+        for features, result in batch:
+            pieces, mobility = features
+            predicted = self.sigmoid(self.evaluate(features))
+            d_score = -2 * (result - predicted) * predicted * (1 - predicted) * scale
+            grad[self.index[("weight", "mobility", None)]] += d_score * mobility
+            for piece_type, idx, sign in pieces:
+                if piece_type in self.VALUE_TYPES:
+                    grad[self.index[("value", piece_type, None)]] += d_score * sign
+                grad[self.index[("psqt", piece_type, idx)]] += d_score * sign
+        return [g / len(batch) for g in grad]
+
+    def step(self, batch, learning_rate, beta1=0.9, beta2=0.999, epsilon=1e-8):
+        grad = self.gradient(batch)
+        self.steps += 1
+        for i, (kind, key, idx) in enumerate(self.layout):
+            self.adam_m[i] = beta1 * self.adam_m[i] + (1 - beta1) * grad[i]
+            self.adam_v[i] = beta2 * self.adam_v[i] + (1 - beta2) * grad[i] ** 2
+            m_hat = self.adam_m[i] / (1 - beta1 ** self.steps)
+            v_hat = self.adam_v[i] / (1 - beta2 ** self.steps)
+            # Weights are multipliers around 1.0, values and tables are centipawns
+            rate = learning_rate / 100 if kind == "weight" else learning_rate
+            delta = rate * m_hat / (math.sqrt(v_hat) + epsilon)
+            if kind == "value":
+                self.values[key] -= delta
+            elif kind == "psqt":
+                self.psqt[key][idx] -= delta
+            else:
+                self.weights[key] = max(0.1, min(2.0, self.weights[key] - delta))
+        self.anchor_tables()
+
+    def train(self, epochs=10, batch_size=1024, learning_rate=1.0, report=None):
+        for epoch in range(epochs):
+            random.shuffle(self.positions)
+            for start in range(0, len(self.positions), batch_size):
+                self.step(self.positions[start:start + batch_size], learning_rate)
+            if report:
+                report(epoch + 1, self.loss())
+
+    def export(self, path=TUNED_WEIGHTS_FILE):
+        previous = 0
+        if os.path.exists(path):
+            with open(path) as f:
+                previous = json.load(f).get("version", 0)
+        tuned = {
+            "version": previous + 1,
+            "created": datetime.datetime.now().isoformat(timespec="seconds"),
+            "positions": len(self.positions),
+            "k": self.k,
+            "loss": self.loss(),
+            "piece_values": {str(pt): round(self.values.get(pt, PIECE_VALUES[pt]), 2) for pt in PIECE_VALUES},
+            "piece_square_tables": {str(pt): [round(v, 2) for v in table] for pt, table in self.psqt.items()},
+            "weights": {group: round(value, 4) for group, value in self.weights.items()},
+        }
+        write_json_atomic(path, tuned)
+        return tuned
+
+# --- MULTIPLAYER PROTOCOL ---
+# Newline-delimited JSON: {"type": "move", "uci", "ply", "hash"} where hash is the Zobrist key after the move.
+# The host's GameState is authoritative: anything it cannot apply is answered with a full "sync",
+# and a guest that cannot apply a host message asks for one with "resync". Until the guest acks
+# the latest sync, the host drops its moves: they were made on a position the sync replaces.
+def position_hash(board):
+    return f"{chess.polyglot.zobrist_hash(board):016x}"
+
+class GameState:
+    def __init__(self, color):
+        self.color = color
+        self.board = chess.Board()
+        self.lock = threading.Lock()
+        self.awaiting_sync = False
+        self.sync_id = 0
+        self.pending_sync = None
+        self.stats = {"moves": 0, "desyncs": 0, "syncs": 0, "dropped": 0}
+
+    def snapshot(self):
+        return {"type": "sync", "id": self.sync_id, "fen": self.board.root().fen(), "moves": [move.uci() for move in self.board.move_stack], "hash": position_hash(self.board)}
+
+    def new_sync(self):
+        self.sync_id += 1
+        self.pending_sync = self.sync_id
+        self.stats["syncs"] += 1
+        return self.snapshot()
+
+    def local_move(self, move):
+        with self.lock:
+            if self.awaiting_sync:
+                raise ValueError("Waiting for the host to resync")
+            if self.board.turn != self.color or not self.board.is_legal(move):
+                raise ValueError(f"Illegal local move {move.uci()}")
+            self.board.push(move)
+            self.stats["moves"] += 1
+            return {"type": "move", "uci": move.uci(), "ply": len(self.board.move_stack), "hash": position_hash(self.board)}
+
+    def check_remote_move(self, message):
+        try:
+            move = chess.Move.from_uci(message["uci"])
+        except (KeyError, TypeError, ValueError):
+            return None, "malformed move"
+        if message.get("ply") != len(self.board.move_stack) + 1:
+            return None, f"ply {message.get('ply')} does not follow {len(self.board.move_stack)}"
+        if self.board.turn == self.color:
+            return None, f"{move.uci()} played out of turn"
+        if not self.board.is_legal(move):
+            return None, f"illegal move {move.uci()}"
+        self.board.push(move)
+        if position_hash(self.board) != message.get("hash"):
+            self.board.pop()
+            return None, f"position hash mismatch after {move.uci()}"
+        return move, None
+
+    def receive(self, message, is_host):
+        # Returns (event for the UI, reply for the peer); either may be None
+        with self.lock:
+            kind = message.get("type") if isinstance(message, dict) else None
+            if kind == "move":
+                if self.awaiting_sync or (is_host and self.pending_sync):
+                    self.stats["dropped"] += 1
+                    return None, None  # Superseded by the sync already on its way
+                move, problem = self.check_remote_move(message)
+                if move:
+                    self.stats["moves"] += 1
+                    return ("move", move), None
+                return self.desync(problem, is_host)
+            if kind == "ack" and is_host:
+                if message.get("id") == self.pending_sync:
+                    self.pending_sync = None
+                return None, None
+            if kind == "resync" and is_host:
+                return ("desync", f"peer requested resync: {message.get('reason')}"), self.new_sync()
+            if kind == "sync" and not is_host:
+                try:
+                    board = chess.Board(message["fen"])
+                    for uci in message["moves"]:
+                        board.push(chess.Move.from_uci(uci))
+                except (KeyError, TypeError, ValueError):
+                    return self.desync("malformed sync", is_host)
+                if position_hash(board) != message.get("hash"):
+                    return self.desync("sync hash mismatch", is_host)
+                self.board = board
+                self.awaiting_sync = False
+                self.stats["syncs"] += 1
+                return ("sync", self.snapshot()), {"type": "ack", "id": message.get("id")}
+            return self.desync(f"unexpected message {kind!r}", is_host)
+
+    def desync(self, reason, is_host):
+        self.stats["desyncs"] += 1
+        net_log.warning("Desync detected: %s", reason)
+        if is_host:
+            return ("desync", reason), self.new_sync()
+        self.awaiting_sync = True
+        return ("desync", reason), {"type": "resync", "reason": reason}
+
+class MultiplayerPeer:
+    # Owns the socket and the GameState; the UI only sees events through self.events
+    def __init__(self, sock, is_host):
+        self.sock = sock
+        self.sock.settimeout(None)  # The opponent may think for as long as their clock allows
+        self.is_host = is_host
+        self.state = GameState(chess.WHITE if is_host else chess.BLACK)
+        self.events = queue.Queue()
+        self.send_lock = threading.RLock()  # Held across state change + send so the wire order matches the state order
+        self.closed = False
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def send(self, message):
+        data = (json.dumps(message, separators=(",", ":")) + "\n").encode()
+        with self.send_lock:
+            self.sock.sendall(data)
+
+    def send_move(self, move):
+        with self.send_lock:
+            self.send(self.state.local_move(move))
+
+    def handle_line(self, line):
+        try:
+            message = json.loads(line)
+        except ValueError:
+            message = None
+        with self.send_lock:
+            event, reply = self.state.receive(message, self.is_host)
+            if reply:
+                self.send(reply)
+        if event:
+            self.events.put(event)
+
+    def run(self):
+        pending = b""
+        try:
+            while not self.closed:
+                data = self.sock.recv(65536)
+                if not data:
+                    break
+                *lines, pending = (pending + data).split(b"\n")
+                for line in lines:
+                    if line.strip():
+                        self.handle_line(line)
+        except OSError as e:
+            if not self.closed:
+                net_log.error(f"Connection lost: {e}")
+        if not self.closed:
+            self.events.put(("disconnected", None))
+
+    def close(self):
+        self.closed = True
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.sock.close()
+
+# --- SPECTATOR BROADCAST ---
+# Newline-delimited JSON. Each update is serialized once and appended to every viewer's buffer;
+# a single thread drains the buffers with non-blocking sends, so a slow viewer never blocks the game.
+class Broadcaster:
+    def __init__(self, port=0, host="0.0.0.0", max_buffer=SPECTATOR_BUFFER_BYTES):
+        self.max_buffer = max_buffer
+        self.lock = threading.Lock()
+        self.clients = {}  # socket -> {"buffer", "resyncs", "addr"}
+        self.start_fen = chess.STARTING_FEN
+        self.moves = []
+        self.clocks = {}
+        self.eval = None
+        self.seq = 0
+        self.stats = {"updates": 0, "joins": 0, "resyncs": 0, "drops": 0, "bytes": 0}
+        self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server_socket.bind((host, port))
+        self.server_socket.listen(SPECTATOR_MAX_CLIENTS)
+        self.server_socket.setblocking(False)
+        self.port = self.server_socket.getsockname()[1]
+        self.wake_reader, self.wake_writer = socket.socketpair()  # Lets publish() interrupt the select() wait
+        self.wake_reader.setblocking(False)
+        self.wake_writer.setblocking(False)
+        self.running = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def snapshot(self):
+        return {"type": "snapshot", "seq": self.seq, "fen": self.start_fen, "moves": list(self.moves), "clocks": self.clocks, "eval": self.eval}
+
+    def encode(self, message):
+        return (json.dumps(message, separators=(",", ":")) + "\n").encode()
+
+    def publish(self, message):
+        with self.lock:
+            self.seq += 1
+            message["seq"] = self.seq
+            data = self.encode(message)
+            self.stats["updates"] += 1
+            snapshot = None
+            for client, state in list(self.clients.items()):
+                buffer = state["buffer"]
+                if len(buffer) + len(data) <= self.max_buffer:
+                    buffer += data
+                    continue
+                state["resyncs"] += 1
+                if state["resyncs"] > SPECTATOR_MAX_RESYNCS:
+                    net_log.warning("Dropping slow spectator %s", state["addr"])
+                    self.stats["drops"] += 1
+                    self.remove(client)
+                    continue
+                # Pending deltas are useless once a snapshot supersedes them
+                snapshot = snapshot or self.encode(self.snapshot())
+                state["buffer"] = bytearray(snapshot)
+                self.stats["resyncs"] += 1
+        self.wake()
+
+    def wake(self):
+        try:
+            self.wake_writer.send(b"\0")
+        except OSError:
+            pass  # Already pending, or shutting down
+
+    def reset(self, board, clocks=None, evaluation=None):
+        root = board.root()
+        with self.lock:
+            self.start_fen = root.fen()
+            self.moves = [move.uci() for move in board.move_stack]
+            self.clocks = clocks or {}
+            self.eval = evaluation
+        self.publish(self.snapshot())
+
+    def move(self, move, clocks=None, evaluation=None):
+        with self.lock:
+            self.moves.append(move.uci())
+            self.clocks = clocks or self.clocks
+            self.eval = evaluation
+            ply = len(self.moves)
+        self.publish({"type": "move", "uci": move.uci(), "ply": ply, "clocks": self.clocks, "eval": evaluation})
+
+    def clock(self, clocks):
+        with self.lock:
+            self.clocks = clocks
+        self.publish({"type": "clock", "clocks": clocks})
+
+    def client_count(self):
+        with self.lock:
+            return len(self.clients)
+
+    def remove(self, client):
+        self.clients.pop(client, None)
+        try:
+            client.close()
+        except OSError:
+            pass
+
+    def accept(self):
+        while True:
+            try:
+                client, addr = self.server_socket.accept()
+            except (BlockingIOError, OSError):
+                return
+            if len(self.clients) >= SPECTATOR_MAX_CLIENTS:
+                client.close()
+                continue
+            client.setblocking(False)
+            # Keep the kernel from hiding a stalled viewer behind megabytes of socket buffer
+            client.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, self.max_buffer)
+            with self.lock:
+                self.clients[client] = {"buffer": bytearray(self.encode(self.snapshot())), "resyncs": 0, "addr": addr}
+                self.stats["joins"] += 1
+            net_log.info("Spectator joined from %s (%d watching)", addr, len(self.clients))
+
+    def run(self):
+        while self.running:
+            with self.lock:
+                clients = list(self.clients)
+                writers = [client for client in clients if self.clients[client]["buffer"]]
+            try:
+                readable, writable, _ = select.select([self.server_socket, self.wake_reader] + clients, writers, [], SPECTATOR_POLL)
+            except (OSError, ValueError):
+                if not self.running:
+                    break
+                continue
+            for sock in readable:
+                if sock is self.server_socket:
+                    self.accept()
+                    continue
+                if sock is self.wake_reader:
+                    try:
+                        sock.recv(4096)
+                    except OSError:
+                        pass
+                    continue
+                # Viewers are read-only: anything readable is either noise or a disconnect
+                try:
+                    if not sock.recv(4096):
+                        raise ConnectionError
+                except BlockingIOError:
+                    pass
+                except OSError:
+                    with self.lock:
+                        self.remove(sock)
+            for sock in writable:
+                with self.lock:
+                    state = self.clients.get(sock)
+                    if not state:
+                        continue
+                    try:
+                        sent = sock.send(state["buffer"])
+                        del state["buffer"][:sent]
+                        self.stats["bytes"] += sent
+                    except BlockingIOError:
+                        pass
+                    except OSError:
+                        self.remove(sock)
+
+    def stop(self):
+        self.running = False
+        self.wake()
+        self.thread.join(timeout=1)
+        with self.lock:
+            for client in list(self.clients):
+                self.remove(client)
+        self.server_socket.close()
+        self.wake_reader.close()
+        self.wake_writer.close()
+
+def apply_spectator_message(board, message):
+    # Returns the board to show, or None when a delta does not follow the current position
+    kind = message.get("type")
+    if kind == "snapshot":
+        board = chess.Board(message["fen"])
+        for uci in message["moves"]:
+            board.push(chess.Move.from_uci(uci))
+        return board
+    if kind == "move":
+        if message["ply"] != len(board.move_stack) + 1:
+            return None
+        move = chess.Move.from_uci(message["uci"])
+        if not board.is_legal(move):
+            return None
+        board.push(move)
+    return board
+
+def read_json_lines(sock, pending):
+    data = sock.recv(65536)
+    if not data:
+        raise ConnectionError("Broadcast closed")
+    pending += data
+    *lines, rest = pending.split(b"\n")
+    return [json.loads(line) for line in lines if line], rest
+
+# --- COMMAND LINE ---
+def command_generate_puzzles(args):
+    generate_puzzles(args.pgn, args.output, args.checkpoint, args.workers, args.depth, args.min_swing)
+
+def command_validate_puzzles(args):
+    puzzles = [dict(puzzle, id=f"builtin-{i}") for i, puzzle in enumerate(PUZZLES)]
+    if args.file:
+        with open(args.file, encoding="utf-8") as f:
+            for line in f:
+                record = parse_puzzle_line(line)
+                if record:
+                    puzzles.append(puzzle_from_record(record))
+                if args.limit and len(puzzles) >= args.limit:
+                    break
+    failures = 0
+    for puzzle in puzzles:
+        ok, reason = validate_puzzle(puzzle, args.depth)
+        if not ok:
+            failures += 1
+            print(f"{puzzle['id'] or puzzle['fen']}: {reason}")
+    print(f"{len(puzzles) - failures}/{len(puzzles)} puzzles valid")
+    return 1 if failures else 0
+
+def command_tune(args):
+    games = pgn_games(args.pgn) if args.pgn else history_games()
+    positions = list(labeled_positions(games))
+    if args.max_positions:
+        random.shuffle(positions)
+        positions = positions[:args.max_positions]
+    if not positions:
+        print("No labelled positions found")
+        return 1
+    snapshot = get_history().latest_snapshot() if not args.pgn else None
+    tuner = TexelTuner(positions, snapshot["weights"] if snapshot else None)
+    print(f"{len(positions)} positions | K = {tuner.fit_k():.1f} | initial loss {tuner.loss():.6f}")
+    tuner.train(args.epochs, args.batch_size, args.learning_rate, report=lambda epoch, loss: print(f"epoch {epoch}: loss {loss:.6f}", flush=True))
+    tuned = tuner.export(args.output)
+    print(f"Wrote version {tuned['version']} to {args.output}")
+
+BENCH_FENS = [
+    "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1",
+    "r1bqkb1r/pppp1ppp/2n2n2/4p3/2B1P3/5N2/PPPP1PPP/RNBQK2R w KQkq - 4 4",
+    "r2q1rk1/pp2bppp/2n1pn2/3p4/3P4/2NBPN2/PP3PPP/R2Q1RK1 b - - 0 10",
+    "r1b2rk1/2q1bppp/p2p1n2/np2p3/3PP3/5N1P/PPBN1PP1/R1BQR1K1 w - - 1 13",
+    "8/5pk1/6p1/8/3R4/6P1/5PK1/3r4 w - - 0 40",
+    "6k1/5ppp/8/8/8/8/5PPP/3R2K1 w - - 0 1",
+]
+
+# Verified with "bench-search --verify": the listed move is the unique best under a full-width search
+TACTICS = [
+    ("r1bqkb1r/pppp1ppp/2n2n2/4p2Q/2B1P3/8/PPPP1PPP/RNB1K1NR w KQkq - 4 4", "h5f7", "scholar's mate"),
+    ("6k1/5ppp/8/8/8/8/5PPP/3R2K1 w - - 0 1", "d1d8", "back-rank mate"),
+    ("6rk/6pp/8/6N1/8/8/8/6K1 w - - 0 1", "g5f7", "smothered mate"),
+    ("3q2k1/5ppp/8/8/8/8/5PPP/3Q2K1 w - - 0 1", "d1d8", "trade into back-rank mate"),
+    ("4r1k1/5ppp/8/8/8/8/5PPP/1B2R1K1 w - - 0 1", "e1e8", "back-rank mate"),
+    ("rnb1kbnr/pppp1ppp/8/4p3/4P2q/5N2/PPPP1PPP/RNBQKB1R w KQkq - 2 3", "f3h4", "win the queen"),
+    ("6k1/5ppp/8/8/1q6/8/5PPP/1R4K1 w - - 0 1", "b1b4", "win the queen"),
+    ("r1bqk2r/pppp1ppp/2n5/2b1p3/2BnP3/5N2/PPPP1PPP/RNBQ1RK1 w kq - 0 6", "f3d4", "recapture the knight"),
+    ("kbK5/pp6/1P6/8/8/8/8/R7 w - - 0 1", "a1a6", "mate in 2"),
+    ("r2qk2r/pb4pp/1n2Pb2/2B2Q2/p1p5/2P5/2B2PPP/RN2R1K1 w - - 1 1", "f5g6", "mate in 2"),
+]
+TACTIC_VERIFY_DEPTH = 4  # Plies, enough for every mate in 2 above
+TACTIC_MIN_MARGIN = 100
+
+def time_per_call(func, repeat):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - started) / repeat
+
+def command_bench_eval(args):
+    boards = [chess.Board(fen) for fen in BENCH_FENS]
+    learning_data = {"weights": {"pawn": 1.0, "king": 1.0, "mobility": 1.0}}
+    get_eval_tables(learning_data)
+    per_eval = time_per_call(lambda: [evaluate_uncached(board, learning_data) for board in boards], args.repeat) / len(boards)
+    tables = get_eval_tables(learning_data)
+
+    def table_material(board):
+        score = 0
+        for base, piece_type, color in EVAL_TABLE_LAYOUT:
+            for square in chess.scan_forward(board.pieces_mask(piece_type, color)):
+                score += tables[base + square]
+        return score
+
+    def per_piece_material(board):
+        # The per-piece lookup evaluate() used before the tables, for comparison
+        score = 0
+        for square in chess.SQUARES:
+            piece = board.piece_at(square)
+            if piece:
+                value = PIECE_VALUES[piece.piece_type] + PIECE_SQUARE_TABLES[piece.piece_type][square if piece.color == chess.WHITE else 63 - square]
+                weight = learning_data["weights"].get(weight_group(piece.piece_type), 1.0)
+                score += value * weight if piece.color == chess.WHITE else -value * weight
+        return score
+
+    per_table = time_per_call(lambda: [table_material(board) for board in boards], args.repeat) / len(boards)
+    per_piece = time_per_call(lambda: [per_piece_material(board) for board in boards], args.repeat) / len(boards)
+    build = time_per_call(lambda: build_eval_tables(learning_data["weights"]), 100)
+    load = time_per_call(lambda: load_eval_tables(learning_data["weights"]), 100)
+    print(f"evaluate (uncached): {per_eval * 1e6:.1f} us/position")
+    print(f"material + psqt: {per_piece * 1e6:.1f} us/position per-piece lookup -> {per_table * 1e6:.1f} us/position with tables")
+    print(f"table build: {build * 1e3:.3f} ms | table load from {EVAL_TABLES_FILE}: {load * 1e3:.3f} ms")
+
+def spectator_viewer(port, results, index, stall, deadline):
+    result = {"board": None, "latencies": [], "snapshots": 0, "error": None}
+    results[index] = result
+    try:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        if stall:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+        sock.connect(("127.0.0.1", port))
+        sock.settimeout(0.5)
+        if stall:
+            time.sleep(stall)
+        board, pending = chess.Board(), b""
+        while time.perf_counter() < deadline:
+            try:
+                messages, pending = read_json_lines(sock, pending)
+            except socket.timeout:
+                continue
+            for message in messages:
+                if message["type"] == "snapshot":
+                    result["snapshots"] += 1
+                updated = apply_spectator_message(board, message)
+                if updated is None:
+                    result["error"] = f"out of order delta at ply {message.get('ply')}"
+                    continue
+                board = updated
+                if message["type"] == "move" and "sent" in message:
+                    result["latencies"].append(time.perf_counter() - message["sent"])
+            result["board"] = board
+    except (OSError, ConnectionError):
+        pass
+    except Exception as e:
+        result["error"] = str(e)
+    finally:
+        sock.close()
+
+def command_spectator_loadtest(args):
+    broadcaster = Broadcaster(host="127.0.0.1", max_buffer=args.buffer)
+    results = {}
+    deadline = time.perf_counter() + args.moves * args.interval + args.stall + 10
+    threads = []
+
+    def spawn(index, stall):
+        thread = threading.Thread(target=spectator_viewer, args=(broadcaster.port, results, index, stall, deadline), daemon=True)
+        thread.start()
+        threads.append(thread)
+
+    for index in range(args.clients):
+        spawn(index, args.stall if index < args.slow else 0)
+    time.sleep(0.5)
+    board = chess.Board()
+    broadcaster.reset(board, {"white": 600, "black": 600}, 0)
+    publish_times = []
+    for ply in range(args.moves):
+        if board.is_game_over():
+            board = chess.Board()
+            broadcaster.reset(board, {"white": 600, "black": 600}, 0)
+        if ply == args.moves // 2:
+            for index in range(args.clients, args.clients + args.late):
+                spawn(index, 0)
+        move = random.choice(list(board.legal_moves))
+        board.push(move)
+        started = time.perf_counter()
+        # "sent" lets viewers measure delivery latency; the game itself does not send it
+        with broadcaster.lock:
+            broadcaster.moves.append(move.uci())
+            ply_number = len(broadcaster.moves)
+        broadcaster.publish({"type": "move", "uci": move.uci(), "ply": ply_number, "clocks": {"white": 600, "black": 600}, "eval": 0, "sent": started})
+        publish_times.append(time.perf_counter() - started)
+        time.sleep(args.interval)
+
+    final_fen = board.fen()
+    settle = time.perf_counter() + 5
+    fast = [index for index in range(args.clients + args.late) if index >= args.slow]
+    while time.perf_counter() < settle:
+        if all(results.get(index, {}).get("board") is not None and results[index]["board"].fen() == final_fen for index in fast):
+            break
+        time.sleep(0.05)
+    stats = dict(broadcaster.stats)
+    broadcaster.stop()
+    for thread in threads:
+        thread.join(timeout=1)
+
+    in_sync = sum(1 for index in fast if results.get(index, {}).get("board") is not None and results[index]["board"].fen() == final_fen)
+    latencies = sorted(latency for index in fast for latency in results.get(index, {}).get("latencies", []))
+    publish_times.sort()
+    errors = [result["error"] for result in results.values() if result.get("error")]
+    print(f"{args.clients} viewers ({args.slow} stalled {args.stall}s) + {args.late} late joiners, {args.moves} moves")
+    print(f"publish: median {publish_times[len(publish_times) // 2] * 1e6:.0f} us, max {publish_times[-1] * 1e6:.0f} us")
+    if latencies:
+        print(f"delivery: median {latencies[len(latencies) // 2] * 1e3:.2f} ms, p95 {latencies[int(len(latencies) * 0.95)] * 1e3:.2f} ms")
+    print(f"in sync: {in_sync}/{len(fast)} responsive viewers | resyncs {stats['resyncs']} | drops {stats['drops']} | {stats['bytes']} bytes sent")
+    for error in errors[:5]:
+        print(f"viewer error: {error}")
+    return 0 if in_sync == len(fast) and not errors else 1
+
+def fuzz_fault(peer, mirror, rng):
+    # A message the receiving peer must reject; sent raw, so the sender's own state is untouched
+    ply = len(mirror.move_stack) + 1
+    legal = list(mirror.legal_moves)
+    kind = rng.choice(["garbage", "illegal", "ply", "hash", "out_of_turn"])
+    if kind == "garbage":
+        peer.sock.sendall(b"{not json\n")
+        return kind
+    if kind == "illegal":
+        move = chess.Move(rng.randrange(64), rng.randrange(64))
+        while mirror.is_legal(move):
+            move = chess.Move(rng.randrange(64), rng.randrange(64))
+        message = {"type": "move", "uci": move.uci(), "ply": ply, "hash": "0" * 16}
+    elif kind == "ply":
+        message = {"type": "move", "uci": rng.choice(legal).uci(), "ply": ply + rng.choice([-1, 1, 5]), "hash": "0" * 16}
+    elif kind == "hash":
+        message = {"type": "move", "uci": rng.choice(legal).uci(), "ply": ply, "hash": f"{rng.getrandbits(64):016x}"}
+    else:
+        mirror = mirror.copy()
+        mirror.push(rng.choice(legal))
+        replies = list(mirror.legal_moves)
+        if not replies:
+            return None
+        reply = rng.choice(replies)
+        mirror.push(reply)
+        message = {"type": "move", "uci": reply.uci(), "ply": ply + 1, "hash": position_hash(mirror)}
+    peer.send(message)
+    return kind
+
+def fuzz_driver(peer, rng, fault_rate, max_plies, report, done):
+    # Plays like the UI would: a mirror board fed only by peer events
+    mirror = chess.Board()
+    while not done.is_set():
+        try:
+            while True:
+                event = peer.events.get_nowait()
+                if event[0] == "move":
+                    mirror.push(event[1])
+                elif event[0] == "sync":
+                    mirror = chess.Board(event[1]["fen"])
+                    for uci in event[1]["moves"]:
+                        mirror.push(chess.Move.from_uci(uci))
+                elif event[0] == "disconnected":
+                    return
+        except queue.Empty:
+            pass
+        report["mirror"] = mirror
+        if mirror.turn != peer.state.color or mirror.is_game_over() or len(mirror.move_stack) >= max_plies:
+            time.sleep(0.0005)
+            continue
+        if rng.random() < fault_rate:
+            kind = fuzz_fault(peer, mirror, rng)
+            if kind:
+                report["faults"][kind] = report["faults"].get(kind, 0) + 1
+        try:
+            move = rng.choice(list(mirror.legal_moves))
+            peer.send_move(move)
+            mirror.push(move)
+        except ValueError:
+            time.sleep(0.001)  # Mirror is behind the state (sync in flight); catch up first
+
+def command_fuzz_multiplayer(args):
+    rng = random.Random(args.seed)
+    totals = {"games": 0, "plies": 0, "faults": 0, "desyncs": 0, "failures": 0}
+    for game in range(args.games):
+        listener = socket.create_server(("127.0.0.1", 0))
+        guest_sock = socket.create_connection(listener.getsockname())
+        host_sock, _ = listener.accept()
+        listener.close()
+        host, guest = MultiplayerPeer(host_sock, True).start(), MultiplayerPeer(guest_sock, False).start()
+        reports = [{"faults": {}, "mirror": None}, {"faults": {}, "mirror": None}]
+        done = threading.Event()
+        drivers = [threading.Thread(target=fuzz_driver, args=(peer, random.Random(rng.getrandbits(64)), args.fault_rate, args.plies, report, done), daemon=True)
+                   for peer, report in zip((host, guest), reports)]
+        for driver in drivers:
+            driver.start()
+        deadline = time.perf_counter() + args.timeout
+
+        def settled():
+            mirrors = [report["mirror"] for report in reports]
+            if any(mirror is None for mirror in mirrors) or guest.state.awaiting_sync or host.state.pending_sync:
+                return False
+            finished = mirrors[0].is_game_over() or len(mirrors[0].move_stack) >= args.plies
+            keys = {position_hash(host.state.board), position_hash(guest.state.board)} | {position_hash(mirror) for mirror in mirrors}
+            return finished and len(keys) == 1 and host.events.empty() and guest.events.empty()
+
+        while time.perf_counter() < deadline and not settled():
+            time.sleep(0.01)
+        ok = settled()
+        done.set()
+        for driver in drivers:
+            driver.join(timeout=1)
+        host.close()
+        guest.close()
+        faults = sum(sum(report["faults"].values()) for report in reports)
+        desyncs = host.state.stats["desyncs"] + guest.state.stats["desyncs"]
+        rejected = desyncs + host.state.stats["dropped"] + guest.state.stats["dropped"]
+        # Every injected fault must be caught by the receiver, or discarded while a sync was pending
+        if not ok or rejected < faults:
+            totals["failures"] += 1
+            print(f"game {game}: FAILED (settled={ok}, faults={faults}, desyncs={desyncs}, host ply {len(host.state.board.move_stack)}, guest ply {len(guest.state.board.move_stack)})")
+        totals["games"] += 1
+        totals["plies"] += len(host.state.board.move_stack)
+        totals["faults"] += faults
+        totals["desyncs"] += desyncs
+    print(f"{totals['games']} games, {totals['plies']} plies, {totals['faults']} injected faults, {totals['desyncs']} desyncs detected, {totals['failures']} failures")
+    return 1 if totals["failures"] else 0
+
+def verify_tactics(learning_data):
+    failures = 0
+    for fen, expected, theme in TACTICS:
+        board = chess.Board(fen)
+        scores = []
+        for move in board.legal_moves:
+            board.push(move)
+            score = alpha_beta(board, TACTIC_VERIFY_DEPTH - 1, -float('inf'), float('inf'), board.turn == chess.WHITE, learning_data)[0]
+            board.pop()
+            scores.append((score if board.turn == chess.WHITE else -score, move.uci()))
+        scores.sort(reverse=True)
+        margin = scores[0][0] - scores[1][0] if len(scores) > 1 else float('inf')
+        if scores[0][1] != expected or margin < TACTIC_MIN_MARGIN:
+            failures += 1
+            print(f"unverified: {fen} ({theme}) expected {expected}, full width prefers {scores[:2]}")
+    print(f"{len(TACTICS) - failures}/{len(TACTICS)} suite positions verified")
+    return failures
+
+def command_bench_search(args):
+    learning_data = {"weights": {group: 1.0 for group in WEIGHT_GROUPS}, "games": 0}
+    if args.verify and verify_tactics(learning_data):
+        return 1
+    configs = [("plain", SearchConfig(**{name: False for name in SEARCH_TECHNIQUES})), ("all", SearchConfig())]
+    if args.ablation:
+        configs += [(f"no {name}", SearchConfig(**{name: False})) for name in SEARCH_TECHNIQUES]
+    for label, config in configs:
+        reached, nodes, elapsed = [], 0, 0.0
+        for fen in BENCH_FENS:
+            TRANSPOSITION_TABLE.clear()
+            board = chess.Board(fen)
+            started = time.perf_counter()
+            ctx = SearchContext(deadline=started + args.time)
+            search_root(board, args.max_depth, learning_data, ctx, config=config)
+            elapsed += time.perf_counter() - started
+            reached.append(ctx.depth)
+            nodes += ctx.nodes
+        solved = 0
+        for fen, expected, _ in TACTICS:
+            TRANSPOSITION_TABLE.clear()
+            ctx = SearchContext(deadline=time.perf_counter() + args.tactic_time)
+            _, move = search_root(chess.Board(fen), args.max_depth, learning_data, ctx, config=config)
+            solved += move is not None and move.uci() == expected
+        depth = sum(reached) / len(reached)
+        print(f"{label:<14} depth {depth:.2f} in {args.time:g}s ({depth / args.time:.2f} plies/s, max {max(reached)}) | "
+              f"{nodes / elapsed:.0f} nodes/s | tactics {solved}/{len(TACTICS)} in {args.tactic_time:g}s", flush=True)
+
+def bench_positions(plies, seed=1):
+    # Benchmark positions with a played history behind them, as the search sees them mid-game
+    rng = random.Random(seed)
+    boards = []
+    for fen in BENCH_FENS:
+        board = chess.Board(fen)
+        for _ in range(plies):
+            moves = list(board.legal_moves)
+            if not moves or board.is_game_over():
+                break
+            board.push(rng.choice(moves))
+        if not board.is_game_over():
+            boards.append(board)
+    return boards
+
+def command_bench_nodes(args):
+    learning_data = {"weights": {group: 1.0 for group in WEIGHT_GROUPS}, "games": 0}
+    boards = bench_positions(args.plies)
+    contexts = []
+    for board in boards:
+        ctx = SearchContext()
+        ctx.prepare(learning_data)
+        ctx.set_root(board)
+        ctx.path.append(chess.polyglot.zobrist_hash(board))
+        contexts.append(ctx)
+    keys = [chess.polyglot.zobrist_hash(board) for board in boards]
+
+    def interior_before():
+        for board in boards:
+            if not board.is_game_over():
+                list(board.legal_moves)
+
+    def interior_after():
+        for board, ctx, key in zip(boards, contexts, keys):
+            if not (board.halfmove_clock >= 100 or ctx.is_repetition(key, board.halfmove_clock)):
+                if list(board.legal_moves) and not board.is_insufficient_material():
+                    pass
+
+    def leaf_before():
+        # The terminal checks and mobility count evaluate_uncached used to make
+        for board in boards:
+            if not board.is_checkmate() and not (board.is_stalemate() or board.is_insufficient_material()):
+                len(list(board.legal_moves))
+
+    def leaf_after():
+        for board in boards:
+            if board.legal_moves.count() or board.is_check():
+                board.is_insufficient_material()
+
+    for label, before, after in (("interior node checks", interior_before, interior_after), ("leaf terminal + mobility", leaf_before, leaf_after)):
+        old = time_per_call(before, args.repeat) / len(boards)
+        new = time_per_call(after, args.repeat) / len(boards)
+        print(f"{label}: {old * 1e6:.1f} -> {new * 1e6:.1f} us/node")
+
+    for fast_terminal in (False, True):
+        config = SearchConfig(fast_terminal=fast_terminal)
+        nodes, elapsed = 0, 0.0
+        for board in boards:
+            TRANSPOSITION_TABLE.clear()
+            EVAL_CACHE.clear()
+            ctx = SearchContext()
+            started = time.perf_counter()
+            search_root(board, args.depth, learning_data, ctx, config=config)
+            elapsed += time.perf_counter() - started
+            nodes += ctx.nodes
+        print(f"depth {args.depth} search, fast_terminal={fast_terminal}: {nodes} nodes in {elapsed:.2f}s, {elapsed / nodes * 1e6:.1f} us/node")
+
+# FEN, WDL, DTZ, accepted tablebase moves (None: any), score from White's view at ply 0
+KNOWN_TABLEBASE_POSITIONS = [
+    # From the python-chess Syzygy test suite
+    ("8/5p2/6k1/K7/8/8/8/8 w - - 0 1", -2, -2, None, -TB_WIN_SCORE),
+    ("8/8/8/2K5/5kp1/8/8/8 b - - 0 1", 2, 1, {"g4g3"}, -TB_WIN_SCORE),  # Only the pawn push zeroes at once
+    ("8/8/8/2R5/1K6/8/5k2/8 w - - 0 1", 2, 21, None, TB_WIN_SCORE),
+    ("8/3k4/8/8/8/8/4P3/3K4 w - - 0 1", 0, 0, None, 0),
+    # Root move choice
+    ("k7/8/1K6/8/8/8/8/2Q5 w - - 0 1", 2, 1, {"c1c8"}, TB_WIN_SCORE),  # Qc7 stalemates
+    ("7k/8/6K1/8/8/8/8/R7 w - - 0 1", 2, 1, {"a1a8"}, TB_WIN_SCORE),
+    ("8/8/8/8/8/k7/4P3/4K3 w - - 0 1", 2, 1, {"e2e3", "e2e4"}, TB_WIN_SCORE),
+    # 50-move rule: the win must be converted before the halfmove clock reaches 100
+    ("8/8/8/2R5/1K6/8/5k2/8 w - - 79 80", 2, 21, None, TB_WIN_SCORE),
+    ("8/8/8/2R5/1K6/8/5k2/8 w - - 80 80", 2, 21, None, 0),
+    ("8/5p2/6k1/K7/8/8/8/8 w - - 99 80", -2, -2, None, 0),
+    ("7k/8/6K1/8/8/8/8/R7 w - - 99 80", 2, 1, {"a1a8"}, TB_WIN_SCORE),  # Mate on the 100th ply still counts
+]
+
+def random_tablebase_board(rng, material, turn):
+    while True:
+        board = chess.Board(None)
+        white, black = material.split("v")
+        squares = rng.sample(chess.SQUARES, len(white) + len(black))
+        for color, pieces in ((chess.WHITE, white), (chess.BLACK, black)):
+            for symbol in pieces:
+                board.set_piece_at(squares.pop(), chess.Piece.from_symbol(symbol if color else symbol.lower()))
+        board.turn = turn
+        if board.is_valid() and any(board.generate_legal_moves()):
+            return board
+
+def command_check_tablebases(args):
+    paths = args.path or [SYZYGY_BUNDLED_PATH]
+    tablebase = set_syzygy_paths(paths)
+    if tablebase is None:
+        print(f"No Syzygy tables found in {os.pathsep.join(paths)}")
+        return 1
+    missing = [f"{name}.{ext}" for name in ("KQvK", "KRvK", "KPvK") for ext, tables in (("rtbw", tablebase.wdl), ("rtbz", tablebase.dtz)) if name not in tables]
+    if missing:
+        print(f"Missing tables: {', '.join(missing)}")
+        return 1
+    rng = random.Random(args.seed)
+    failures = []
+    print(f"{len(tablebase.wdl)} WDL tables, up to {TABLEBASE_MAX_PIECES} pieces")
+
+    # Known results: probing, root move choice and the 50-move rule
+    for fen, wdl, dtz, moves, score in KNOWN_TABLEBASE_POSITIONS:
+        board = chess.Board(fen)
+        found = (tablebase.probe_wdl(board), tablebase.probe_dtz(board))
+        if found != (wdl, dtz):
+            failures.append(f"known: {fen} probed (WDL, DTZ) {found} instead of {(wdl, dtz)}")
+        move = tablebase_move(board)
+        if move is None or (moves is not None and move.uci() not in moves):
+            failures.append(f"known: {fen} played {move} instead of {' or '.join(sorted(moves or ['a move']))}")
+        if tablebase_score(board) != score:
+            failures.append(f"known: {fen} scored {tablebase_score(board)} instead of {score}")
+    for wdl in (1, -1):
+        if tablebase_value(wdl) != 0:
+            failures.append(f"cursed: WDL {wdl} scored {tablebase_value(wdl)} instead of a draw")
+    print(f"{len(KNOWN_TABLEBASE_POSITIONS)} known positions checked")
+
+    # Piece-count cutoff and castling rights
+    largest = max((name for name in tablebase.wdl), key=len)
+    covered = random_tablebase_board(rng, largest, chess.WHITE)
+    if not tablebase_eligible(covered):
+        failures.append(f"cutoff: {covered.fen()} ({largest}) should be probed")
+    extra = covered.copy()
+    extra.set_piece_at(next(square for square in chess.SQUARES if extra.piece_at(square) is None and chess.square_rank(square) not in (0, 7)), chess.Piece(chess.PAWN, chess.WHITE))
+    if tablebase_eligible(extra):
+        failures.append(f"cutoff: {extra.fen()} has {TABLEBASE_MAX_PIECES + 1} pieces and should not be probed")
+    castling = chess.Board("4k3/8/8/8/8/8/8/4K2R w K - 0 1")
+    if tablebase_eligible(castling):
+        failures.append(f"cutoff: {castling.fen()} has castling rights and should not be probed")
+
+    # WDL to score mapping, from White's point of view at any ply
+    seen = set()
+    for material in (name for name in tablebase.wdl if len(name) <= 5):
+        for _ in range(args.positions):
+            board = random_tablebase_board(rng, material, rng.choice(chess.COLORS))
+            wdl = tablebase.probe_wdl(board)
+            ply = rng.randint(0, 20)
+            expected = {2: TB_WIN_SCORE - ply, -2: -(TB_WIN_SCORE - ply)}.get(wdl, 0)
+            expected = expected if board.turn == chess.WHITE else -expected
+            score = tablebase_score(board, ply)
+            seen.add((wdl, board.turn))
+            if score != expected:
+                failures.append(f"wdl: {board.fen()} has WDL {wdl}, scored {score} instead of {expected}")
+    print(f"WDL mapping checked for (wdl, side to move): {sorted((wdl, 'white' if turn else 'black') for wdl, turn in seen)}")
+
+    # DTZ move choice: the winning side picks a move with the shortest DTZ and mates within it
+    for material in ("KQvK", "KRvK"):
+        checked = 0
+        while checked < args.positions:
+            board = random_tablebase_board(rng, material, chess.WHITE)
+            if tablebase.probe_wdl(board) != 2:
+                continue
+            checked += 1
+            start, dtz, plies = board.fen(), tablebase.probe_dtz(board), 0
+            while not board.is_game_over() and plies <= dtz + 1:
+                options = {}
+                for candidate in board.legal_moves:
+                    board.push(candidate)
+                    # After the move: (WDL, plies to zeroing) for the side now to move
+                    options[candidate] = (-3, 0) if board.is_checkmate() else (tablebase.probe_wdl(board), abs(tablebase.probe_dtz(board)))
+                    board.pop()
+                if board.turn == chess.WHITE:
+                    move = tablebase_move(board)
+                    shortest = min(options.values())
+                    if move is None or options[move] != shortest:
+                        failures.append(f"dtz: {board.fen()} played {move} {options.get(move)} instead of a {shortest} move")
+                        break
+                else:
+                    # The defender holds out as long as possible
+                    move = max(options, key=lambda candidate: (-options[candidate][0], options[candidate][1]))
+                board.push(move)
+                plies += 1
+            if not board.is_checkmate():
+                failures.append(f"dtz: {material} from {start} (DTZ {dtz}) not mated after {plies} plies")
+    print(f"DTZ play checked from {args.positions} KQvK and {args.positions} KRvK wins")
+
+    for failure in failures:
+        print(failure)
+    print("PASS" if not failures else f"FAIL: {len(failures)} problems")
+    return 1 if failures else 0
+
+def command_explorer_import(args):
+    explorer = OpeningExplorer(args.db)
+    started = time.time()
+    for path in args.pgn:
+        games = explorer.import_pgn(path, args.max_plies, progress=lambda games: print(f"{path}: {games} games | {games / (time.time() - started):.0f} games/s", flush=True))
+        print(f"{path}: {games} new games indexed")
+    positions, moves = explorer.connection().execute("SELECT COUNT(DISTINCT hash), COUNT(*) FROM (SELECT DISTINCT hash, move FROM moves)").fetchone()
+    print(f"{args.db}: {positions} positions, {moves} moves, {time.time() - started:.1f}s")
+
+def command_explorer_export(args):
+    explorer = OpeningExplorer(args.db)
+    count = explorer.export_polyglot(args.output, args.min_games)
+    print(f"Wrote {count} entries to {args.output}")
+    if args.verify:
+        checked, mismatches = verify_polyglot(explorer, args.output, args.min_games, args.verify)
+        for fen, expected, found in mismatches[:10]:
+            print(f"MISMATCH {fen}: index {expected}, book {found}")
+        print(f"Verified {checked} positions against the python-chess reader: {len(mismatches)} mismatches")
+        return 1 if mismatches else 0
+
+def command_db_import(args):
+    database = GameDatabase(args.db)
+    started = time.time()
+    for path in args.pgn:
+        games = database.import_pgn(path, progress=lambda games: print(f"{path}: {games} games | {games / (time.time() - started):.0f} games/s", flush=True))
+        print(f"{path}: {games} new games imported")
+    conn = database.connection()
+    games = conn.execute("SELECT COUNT(*) FROM games").fetchone()[0]
+    positions = conn.execute("SELECT COUNT(*) FROM positions").fetchone()[0]
+    print(f"{args.db}: {games} games, {positions} indexed positions, {time.time() - started:.1f}s")
+
+def command_db_search(args):
+    database = GameDatabase(args.db)
+    started = time.perf_counter()
+    if args.material:
+        total, rows = database.search_material(args.material, args.limit)
+    else:
+        board = chess.Board(args.fen) if args.fen else chess.Board()
+        for san in args.moves or []:
+            board.push_san(san)
+        total, rows = database.search_position(board, args.limit)
+    elapsed = (time.perf_counter() - started) * 1000
+    for game_id, ply, white, black, result, date, white_elo, black_elo in rows:
+        print(f"#{game_id} ply {ply}: {white} ({white_elo or '?'}) - {black} ({black_elo or '?'}) {result} {date or ''}")
+    print(f"{total} matching games, {len(rows)} listed, {elapsed:.1f} ms")
+
+def soak_game(session, rng, depth, max_plies):
+    # One kiosk game through the same GameSession calls the GUI makes: new game, moves, history list, report
+    session.reset_game()
+    board = session.board
+    while not board.is_game_over(claim_draw=True) and len(board.move_stack) < max_plies:
+        if rng.random() < 0.2:
+            move = rng.choice(list(board.legal_moves))  # Keeps games apart
+        else:
+            move = get_bot_move(board, session.difficulty, session.learning_data, SearchContext(), depth=depth, use_book=False)
+        position_before, _, _ = session.make_move(move)
+        session.record_move(move, position_before)
+        session.replay_index()
+    session.finish_game()
+    session.build_deep_analysis()
+    session.save_deep_analysis()
+    return board.result(claim_draw=True)
+
+def command_soak(args):
+    workdir = tempfile.mkdtemp(prefix="chess_soak_")
+    os.chdir(workdir)  # Stores, analysis reports and dumps stay out of the real working directory
+    set_log_file(os.path.join(workdir, os.path.basename(LOG_FILE)))  # The handler resolved its path before the chdir
+    rng = random.Random(args.seed)
+    session = GameSession()
+    session.difficulty = args.difficulty
+    history = get_history()
+    warmup = max(1, int(args.games * args.warmup))
+    baseline = peak = None
+    snapshot = dump_memory() if args.trace else None
+    started = time.time()
+    print(f"Soak in {workdir}: {args.games} games at depth {args.depth}, baseline after {warmup} games", flush=True)
+    for game_number in range(1, args.games + 1):
+        soak_game(session, rng, args.depth, args.max_plies)
+        rss = current_rss()
+        if game_number == warmup:
+            baseline = rss
+        if baseline is not None and rss is not None:
+            peak = max(peak or rss, rss)
+        if game_number % args.report_every == 0 or game_number == args.games:
+            elapsed = time.time() - started
+            print(f"game {game_number}: {' | '.join(cache_report())} | {game_number / elapsed:.2f} games/s", flush=True)
+            if args.trace:
+                snapshot = dump_memory(snapshot)
+    snapshots = history.connection().execute("SELECT COUNT(*) FROM snapshots").fetchone()[0]
+    analysis_size = os.path.getsize(ANALYSIS_FILE)
+    print(f"Snapshots kept: {snapshots}/{HISTORY_SNAPSHOTS_KEPT} | {ANALYSIS_FILE}: {analysis_size} bytes (cap {ANALYSIS_FILE_MAX_BYTES})")
+    failures = []
+    if snapshots > HISTORY_SNAPSHOTS_KEPT:
+        failures.append("snapshot budget exceeded")
+    if analysis_size > ANALYSIS_FILE_MAX_BYTES:
+        failures.append("analysis file budget exceeded")
+    if baseline is None or peak is None:
+        print("RSS unavailable on this platform: growth not checked")
+    else:
+        growth = (peak - baseline) / 1e6
+        print(f"RSS after warmup {baseline / 1e6:.1f} MB, peak {peak / 1e6:.1f} MB, growth {growth:.1f} MB (limit {args.max_growth_mb} MB)")
+        if growth > args.max_growth_mb:
+            failures.append(f"RSS grew {growth:.1f} MB")
+    print("FAIL: " + ", ".join(failures) if failures else "PASS")
+    return 1 if failures else 0
+
+def run_command(argv):
+    parser = argparse.ArgumentParser(prog="chess_game.py", description="Offline tools. Run without arguments to start the game.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    generate = commands.add_parser("generate-puzzles", help="Mine tactical puzzles from PGN collections")
+    generate.add_argument("pgn", nargs="+")
+    generate.add_argument("--output", default="puzzles.jsonl")
+    generate.add_argument("--checkpoint", default="puzzles_checkpoint.json")
+    generate.add_argument("--workers", type=int, default=None)
+    generate.add_argument("--depth", type=int, default=PUZZLE_SEARCH_DEPTH)
+    generate.add_argument("--min-swing", type=int, default=PUZZLE_MIN_SWING)
+    generate.set_defaults(func=command_generate_puzzles)
+
+    validate = commands.add_parser("validate-puzzles", help="Check built-in (and optionally corpus) puzzle solutions")
+    validate.add_argument("--file")
+    validate.add_argument("--limit", type=int, default=0)
+    validate.add_argument("--depth", type=int, default=PUZZLE_SEARCH_DEPTH)
+    validate.set_defaults(func=command_validate_puzzles)
+
+    tune = commands.add_parser("tune", help="Fit evaluation weights to stored game results (Texel method)")
+    tune.add_argument("--pgn", nargs="*", help="Use these PGN files instead of the game history")
+    tune.add_argument("--epochs", type=int, default=10)
+    tune.add_argument("--batch-size", type=int, default=1024)
+    tune.add_argument("--learning-rate", type=float, default=1.0)
+    tune.add_argument("--max-positions", type=int, default=0)
+    tune.add_argument("--output", default=TUNED_WEIGHTS_FILE)
+    tune.set_defaults(func=command_tune)
+
+    bench_eval = commands.add_parser("bench-eval", help="Microbenchmark the static evaluation")
+    bench_eval.add_argument("--repeat", type=int, default=2000)
+    bench_eval.set_defaults(func=command_bench_eval)
+
+    bench_search = commands.add_parser("bench-search", help="Depth reached per second and tactical solve rate per search configuration")
+    bench_search.add_argument("--time", type=float, default=3.0, help="Seconds per benchmark position")
+    bench_search.add_argument("--tactic-time", type=float, default=2.0, help="Seconds per suite position")
+    bench_search.add_argument("--max-depth", type=int, default=20)
+    bench_search.add_argument("--ablation", action="store_true", help="Also run with each technique disabled in turn")
+    bench_search.add_argument("--verify", action="store_true", help="Check the tactical suite with a full-width search first")
+    bench_search.set_defaults(func=command_bench_search)
+
+    bench_nodes = commands.add_parser("bench-nodes", help="Per-node cost of terminal detection in the search")
+    bench_nodes.add_argument("--plies", type=int, default=30, help="Random plies played from each benchmark position first")
+    bench_nodes.add_argument("--depth", type=int, default=4)
+    bench_nodes.add_argument("--repeat", type=int, default=500)
+    bench_nodes.set_defaults(func=command_bench_nodes)
+
+    check_tb = commands.add_parser("check-tablebases", help="Check tablebase probing and move choice against real Syzygy tables")
+    check_tb.add_argument("--path", nargs="*", help="Table directories (default: the bundled syzygy directory)")
+    check_tb.add_argument("--positions", type=int, default=50, help="Random positions per table and per DTZ ending")
+    check_tb.add_argument("--seed", type=int, default=None)
+    check_tb.set_defaults(func=command_check_tablebases)
+
+    explorer_import = commands.add_parser("explorer-import", help="Add PGN collections to the opening explorer index")
+    explorer_import.add_argument("pgn", nargs="+")
+    explorer_import.add_argument("--db", default=EXPLORER_DB)
+    explorer_import.add_argument("--max-plies", type=int, default=EXPLORER_MAX_PLIES)
+    explorer_import.set_defaults(func=command_explorer_import)
+
+    explorer_export = commands.add_parser("explorer-export", help="Write the opening explorer index as a polyglot book")
+    explorer_export.add_argument("output")
+    explorer_export.add_argument("--db", default=EXPLORER_DB)
+    explorer_export.add_argument("--min-games", type=int, default=EXPLORER_MIN_GAMES)
+    explorer_export.add_argument("--verify", type=int, default=1000, help="Positions to read back and compare (0 to skip)")
+    explorer_export.set_defaults(func=command_explorer_export)
+
+    db_import = commands.add_parser("db-import", help="Add PGN collections to the searchable game database")
+    db_import.add_argument("pgn", nargs="+")
+    db_import.add_argument("--db", default=GAME_DB)
+    db_import.set_defaults(func=command_db_import)
+
+    db_search = commands.add_parser("db-search", help="Find games that reached a position or material balance")
+    db_search.add_argument("--db", default=GAME_DB)
+    db_search.add_argument("--fen", help="Position to find (default: the start position)")
+    db_search.add_argument("--moves", nargs="*", help="SAN moves played from --fen first")
+    db_search.add_argument("--material", help="Material balance such as KRPvKR")
+    db_search.add_argument("--limit", type=int, default=20)
+    db_search.set_defaults(func=command_db_search)
+
+    soak = commands.add_parser("soak", help="Play bot games headlessly and check that memory and disk use stay flat")
+    soak.add_argument("--games", type=int, default=2000)
+    soak.add_argument("--depth", type=int, default=1)
+    soak.add_argument("--difficulty", type=int, default=1, help="Per-move analysis of White's moves runs at difficulty + 1")
+    soak.add_argument("--max-plies", type=int, default=200)
+    soak.add_argument("--warmup", type=float, default=0.25, help="Fraction of games played before the RSS baseline is taken")
+    soak.add_argument("--max-growth-mb", type=float, default=16.0)
+    soak.add_argument("--report-every", type=int, default=50)
+    soak.add_argument("--trace", action="store_true", help="Also write a tracemalloc dump at every report")
+    soak.add_argument("--seed", type=int, default=None)
+    soak.set_defaults(func=command_soak)
+
+    loadtest = commands.add_parser("spectator-loadtest", help="Broadcast a random game to many local spectators")
+    loadtest.add_argument("--clients", type=int, default=50)
+    loadtest.add_argument("--slow", type=int, default=5, help="Viewers that stall before reading")
+    loadtest.add_argument("--stall", type=float, default=3.0)
+    loadtest.add_argument("--late", type=int, default=10, help="Viewers joining halfway through")
+    loadtest.add_argument("--moves", type=int, default=200)
+    loadtest.add_argument("--interval", type=float, default=0.02)
+    loadtest.add_argument("--buffer", type=int, default=SPECTATOR_BUFFER_BYTES)
+    loadtest.set_defaults(func=command_spectator_loadtest)
+
+    fuzz = commands.add_parser("fuzz-multiplayer", help="Drive random and corrupted move streams through two peers on loopback")
+    fuzz.add_argument("--games", type=int, default=20)
+    fuzz.add_argument("--plies", type=int, default=120)
+    fuzz.add_argument("--fault-rate", type=float, default=0.05)
+    fuzz.add_argument("--timeout", type=float, default=30.0)
+    fuzz.add_argument("--seed", type=int, default=None)
+    fuzz.set_defaults(func=command_fuzz_multiplayer)
+
+    args = parser.parse_args(argv)
+    return args.func(args) or 0
+
+# --- GAME SESSION ---
+class GameSession:
+    # The game record and its bookkeeping without widgets: ChessApp builds on it and the soak drives it headlessly
+    def __init__(self):
+        self.board = chess.Board()
+        self.move_index = None  # from_square -> to_square -> [moves], rebuilt lazily once per ply
+        self.move_history = []
+        self.replay = None  # ReplayIndex following move_history
+        self.replay_record = None
+        self.view_ply = None  # Ply shown while scrubbing through the record; None follows the live game
+        self.captured_pieces = {chess.WHITE: [], chess.BLACK: []}
+        self.timer = {"white": 600, "black": 600}
+        self.difficulty = 3
+        self.game = chess.pgn.Game()
+        self.evaluations = []
+        self.puzzle_mode = False
+        self.current_puzzle = None
+        self.best_moves = []
+        self.player_moves = []
+        self.game_recorded = False
+        self.last_deep_analysis = None
+        self.learning_data = {"weights": {"pawn": 1.0, "king": 1.0, "mobility": 1.0}, "games": 0, "performance": 0.5, "elo": 1500}
+        self.multiplayer_mode = False
+        self.player_color = chess.WHITE
+
+    def reset_game(self):
+        TRANSPOSITION_TABLE.clear()  # Left alone, entries from earlier games fill all TT_SIZE slots over a long session
+        self.board.reset()
+        self.move_index = None
+        self.move_history = []
+        self.captured_pieces = {chess.WHITE: [], chess.BLACK: []}
+        self.evaluations = []
+        self.best_moves = []
+        self.player_moves = []
+        self.game_recorded = False
+        self.last_deep_analysis = None
+        self.timer = {"white": 600, "black": 600}
+        self.game = chess.pgn.Game()
+        self.puzzle_mode = False
+        self.current_puzzle = None
+
+    def push_move(self, move):
+        self.board.push(move)
+        self.move_index = None
+        self.view_ply = None
+
+    def pop_move(self):
+        move = self.board.pop()
+        self.move_index = None
+        self.view_ply = None
+        if self.replay and len(self.replay.moves) > len(self.board.move_stack):
+            self.replay.truncate(len(self.board.move_stack))
+        return move
+
+    def make_move(self, move):
+        position_before = self.board.copy()
+        captured_piece = self.board.piece_at(move.to_square)
+        if captured_piece:
+            self.captured_pieces[self.board.turn].append(captured_piece.piece_type)
+        san = self.board.san(move)
+        self.push_move(move)
+        return position_before, san, captured_piece
+
+    def record_move(self, move, position_before):
+        if not self.multiplayer_mode and not self.puzzle_mode:
+            if position_before.turn == self.player_color:
+                best_score, best_move = analyze_position(position_before, self.difficulty + 1, self.learning_data)
+                self.best_moves.append((best_move, best_score))
+            else:
+                self.best_moves.append(None)  # Bot moves are analysed by complete_best_moves, not while a premove waits
+            self.player_moves.append(move)
+        before_eval = evaluate(position_before, self.learning_data)
+        after_eval = evaluate(self.board, self.learning_data)
+        self.evaluations.append(before_eval - after_eval if self.board.turn == chess.BLACK else after_eval - before_eval)
+        self.move_history.append(move)
+        return after_eval
+
+    def replay_index(self):
+        # Undo and new moves only touch the end of the record; a new record list means a new game
+        record = self.move_history
+        if self.replay is None or self.replay_record is not record:
+            self.replay = ReplayIndex(self.board.root(), record)
+            self.replay_record = record
+            self.view_ply = None
+            return self.replay
+        replay = self.replay
+        common = min(len(replay.moves), len(record))
+        while common and replay.moves[common - 1] != record[common - 1]:
+            common -= 1
+        if common < len(replay.moves):
+            replay.truncate(common)
+        for move in record[common:]:
+            replay.append(move)
+        return replay
+
+    def complete_best_moves(self):
+        temp_board = chess.Board()
+        for i, move in enumerate(self.player_moves):
+            if i < len(self.best_moves) and self.best_moves[i] is None:
+                best_score, best_move = analyze_position(temp_board, self.difficulty + 1, self.learning_data)
+                self.best_moves[i] = (best_move, best_score)
+            temp_board.push(move)
+
+    def finish_game(self):
+        self.game_recorded = True
+        self.complete_best_moves()
+
+        total_moves = len(self.player_moves)
+        accurate_moves = 0
+        blunders = []
+        temp_board = chess.Board()
+        for i, (player_move, (best_move, best_score)) in enumerate(zip(self.player_moves, self.best_moves)):
+            if player_move == best_move:
+                accurate_moves += 1
+            else:
+                temp_board.push(player_move)
+                player_score = evaluate(temp_board, self.learning_data)
+                temp_board.pop()
+                temp_board.push(best_move)
+                best_score = evaluate(temp_board, self.learning_data)
+                temp_board.pop()
+                eval_diff = abs(player_score - best_score) / 100.0
+                if eval_diff > 3:
+                    blunders.append((i + 1, temp_board.san(player_move), temp_board.san(best_move), eval_diff))
+            temp_board.push(player_move)
+
+        accuracy = (accurate_moves / total_moves * 100) if total_moves > 0 else 0
+        result = {"1-0": 1, "0-1": 0, "1/2-1/2": 0.5}.get(self.board.result(), 0)
+        expected_score = 1 / (1 + 10 ** ((self.learning_data["elo"] - 1500) / 400))
+        performance = result - expected_score
+        self.learning_data["elo"] = min(max(self.learning_data["elo"] + 20 * performance, 800), 2800)
+        self.adjust_learning_weights(result)
+
+        analysis = []
+        analysis.append(f"Game Analysis - {datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+        analysis.append(f"Result: {self.board.result()}")
+        analysis.append(f"Estimated Elo: {int(self.learning_data['elo'])}")
+        analysis.append(f"Accuracy: {accuracy:.1f}%")
+        analysis.append(f"Accurate Moves: {accurate_moves}/{total_moves}")
+        if blunders:
+            analysis.append("\nMajor Blunders:")
+            for move_num, played, best, diff in blunders:
+                analysis.append(f"Move {move_num}: Played {played}, Best was {best} (Eval diff: {diff:.1f})")
+        else:
+            analysis.append("\nNo major blunders! Well played.")
+
+        analysis.append("\nSuggestions for Improvement:")
+        if accuracy < 60:
+            analysis.append("- Focus on finding the best moves by evaluating positions carefully.")
+        if blunders:
+            analysis.append("- Avoid blunders by double-checking moves that significantly change the evaluation.")
+        if self.timer["white"] < 60 or self.timer["black"] < 60:
+            analysis.append("- Manage your time better to avoid time pressure mistakes.")
+        analysis.append("- Practice tactical puzzles to improve your calculation skills.")
+
+        game_record = {
+            "played_at": time.time(),
+            "result": self.board.result(),
+            "score": result,
+            "elo": self.learning_data["elo"],
+            "accuracy": accuracy,
+            "accurate_moves": accurate_moves,
+            "total_moves": total_moves,
+            "blunders": len(blunders),
+            "time_white": 600 - self.timer["white"],
+            "time_black": 600 - self.timer["black"],
+            "difficulty": self.difficulty,
+            "opening": opening_name(self.move_history),
+            "moves": " ".join(move.uci() for move in self.move_history),
+            "report": "\n".join(analysis),
+        }
+        game_id = get_history().record_game(game_record, self.learning_data)
+        return game_id, accuracy
+
+    def build_deep_analysis(self):
+        self.complete_best_moves()
+        total_moves = len(self.player_moves)
+        accurate_moves = 0
+        blunders = []
+        missed_opportunities = []
+        temp_board = chess.Board()
+        for i, (player_move, (best_move, best_score)) in enumerate(zip(self.player_moves, self.best_moves)):
+            if player_move == best_move:
+                accurate_moves += 1
+            else:
+                temp_board.push(player_move)
+                player_score = evaluate(temp_board, self.learning_data)
+                temp_board.pop()
+                temp_board.push(best_move)
+                best_score = evaluate(temp_board, self.learning_data)
+                temp_board.pop()
+                eval_diff = abs(player_score - best_score) / 100.0
+                if eval_diff > 3:
+                    blunders.append((i + 1, temp_board.san(player_move), temp_board.san(best_move), eval_diff))
+                if eval_diff > 1:
+                    missed_opportunities.append((i + 1, temp_board.san(player_move), temp_board.san(best_move), eval_diff))
+            temp_board.push(player_move)
+
+        accuracy = (accurate_moves / total_moves * 100) if total_moves > 0 else 0
+        result = {"1-0": 1, "0-1": 0, "1/2-1/2": 0.5}.get(self.board.result(), 0)
+        elo = 800 + (accuracy * 10) + (result * 200) + (self.difficulty * 50)
+        elo = min(max(int(elo), 800), 2800)
+
+        analysis = []
+        analysis.append(f"Detailed Game Analysis - {datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+        analysis.append(f"Result: {self.board.result()}")
+        analysis.append(f"Estimated Elo: {elo}")
+        analysis.append(f"Accuracy: {accuracy:.1f}%")
+        analysis.append(f"Accurate Moves: {accurate_moves}/{total_moves}")
+        if blunders:
+            analysis.append("\nMajor Blunders:")
+            for move_num, played, best, diff in blunders:
+                analysis.append(f"Move {move_num}: Played {played}, Best was {best} (Eval diff: {diff:.1f})")
+        if missed_opportunities:
+            analysis.append("\nMissed Opportunities:")
+            for move_num, played, best, diff in missed_opportunities:
+                analysis.append(f"Move {move_num}: Played {played}, Best was {best} (Eval diff: {diff:.1f})")
+        analysis.append("\nMove-by-Move Evaluation:")
+        temp_board = self.board.root()
+        for i, move in enumerate(self.move_history):
+            san = temp_board.san(move)
+            temp_board.push(move)
+            eval_score = evaluate(temp_board, self.learning_data) / 100.0
+            analysis.append(f"Move {i+1}: {san} (Eval: {eval_score:+.1f})")
+
+        self.last_deep_analysis = analysis
+        return analysis
+
+    def save_deep_analysis(self):
+        append_capped(ANALYSIS_FILE, "\n".join(self.last_deep_analysis) + "\n\n", ANALYSIS_FILE_MAX_BYTES)
+        self.last_deep_analysis = None
+
+    def adjust_learning_weights(self, result):
+        try:
+            expected = 1 / (1 + 10 ** ((self.learning_data["elo"] - 1500) / 400))
+            error = result - expected
+            for key in self.learning_data["weights"]:
+                self.learning_data["weights"][key] += 0.01 * error
+                self.learning_data["weights"][key] = max(0.1, min(2.0, self.learning_data["weights"][key]))
+            EVAL_CACHE.invalidate()
+            self.learning_data["games"] += 1
+            self.learning_data["performance"] = (self.learning_data["performance"] * (self.learning_data["games"] - 1) + result) / self.learning_data["games"]
+        except Exception as e:
+            ui_log.error(f"Adjust learning weights failed: {e}")
+
 # --- GUI ---
-class ChessApp:
+class ChessApp(GameSession):
     def __init__(self, root):
         try:
+            super().__init__()
             self.root = root
             self.root.title("Chess by Maxence - Inspired by Chess.com")
-            self.board = chess.Board()
             self.selected_square = None
             self.possible_moves = []
-            self.move_history = []
-            self.captured_pieces = {chess.WHITE: [], chess.BLACK: []}
+            self.drag = None
+            self.premoves = []  # (from_square, to_square) queued while the opponent is to move
+            self.premove_from = None
+            self.bot_pending = False
+            self.input_time = None
+            self.input_latencies = deque(maxlen=LATENCY_SAMPLES)
             self.current_theme = "Chess.com"
-            self.timer = {"white": 600, "black": 600}
             self.timer_running = False
             self.timer_id = None  # To track timer after calls
-            self.difficulty = 3
-            self.game = chess.pgn.Game()
             self.board_flipped = False
-            self.evaluations = []
-            self.puzzle_mode = False
-            self.current_puzzle = None
-            self.best_moves = []
-            self.player_moves = []
+            self.puzzle_index = None
+            self.puzzle_step = 0
             self.animations_enabled = True
-            self.learning_data = {"weights": {"pawn": 1.0, "king": 1.0, "mobility": 1.0}, "games": 0, "performance": 0.5, "elo": 1500}
-            self.multiplayer_mode = False
+            self.ponder_enabled = PONDER_ENABLED
+            self.ponder = None
+            self.ponder_stats = {"hits": 0, "misses": 0}
             self.is_host = False
-            self.player_color = chess.WHITE
             self.server_socket = None
             self.client_socket = None
             self.opponent_socket = None
             self.server_thread = None
             self.listen_thread = None
+            self.peer = None  # MultiplayerPeer: owns the socket and the authoritative GameState
+            self.net_poll_id = None
             self.game_port = None
             self.ngrok_url = None
             self.thread_lock = threading.Lock()  # For thread safety
+            self.analysis_enabled = False
+            self.analysis = None  # {"key", "ctx", "board"} of the running infinite analysis
+            self.analysis_updates = queue.Queue()
+            self.analysis_poll_id = None
+            self.explorer_window = None
+            self.explorer_import = None  # Background PGN import thread
+            self.database_window = None
+            self.database_import = None
+            self.dialogs = {}  # One live Toplevel per kind
+            self.memory_snapshot = None
+            self.engine_match = None
+            self.engine_results = queue.Queue()
+            self.render_id = None
+            self.last_render = 0
+            self.broadcaster = None
+            self.last_clock_broadcast = 0
+            self.spectator_mode = False
+            self.spectator_socket = None
+            self.spectator_address = None
 
             self.main_frame = tk.Frame(root, bg=THEMES[self.current_theme]["bg"], padx=10, pady=10)
             self.main_frame.pack(fill="both", expand=True)
 
             self.canvas = tk.Canvas(self.main_frame, width=BOARD_SIZE+40, height=BOARD_SIZE+40, bg=THEMES[self.current_theme]["border"], highlightthickness=2, highlightbackground=THEMES[self.current_theme]["text"])
             self.canvas.pack(side="left", padx=10, pady=10)
-            self.canvas.bind("<Button-1>", self.on_click)
+            self.canvas.bind("<ButtonPress-1>", self.on_press)
+            self.canvas.bind("<B1-Motion>", self.on_drag)
+            self.canvas.bind("<ButtonRelease-1>", self.on_release)
 
             self.sidebar = tk.Frame(self.main_frame, bg=THEMES[self.current_theme]["bg"], width=300, padx=5, pady=5)
             self.sidebar.pack(side="right", fill="y", padx=10, pady=10)
@@ -177,8 +3490,12 @@ class ChessApp:
 
             tk.Label(self.sidebar, text="Move History", bg=THEMES[self.current_theme]["bg"], fg=THEMES[self.current_theme]["text"], font=("Arial", 10, "bold")).pack(pady=(5, 0))
             ttk.Separator(self.sidebar, orient="horizontal").pack(fill="x", pady=2)
-            self.move_listbox = tk.Listbox(self.sidebar, height=10, width=30, font=("Arial", 9), bg="#333333", fg=THEMES[self.current_theme]["text"], highlightthickness=0)
+            self.move_listbox = tk.Listbox(self.sidebar, height=10, width=30, font=("Arial", 9), bg="#333333", fg=THEMES[self.current_theme]["text"], highlightthickness=0, exportselection=False)
             self.move_listbox.pack(pady=(0, 5))
+            self.move_listbox.bind("<<ListboxSelect>>", self.on_history_select)
+            for key, command in (("<Left>", self.step_back), ("<Right>", self.step_forward), ("<Home>", self.view_start), ("<End>", self.view_live)):
+                self.root.bind(key, command)
+            self.root.bind("<Control-m>", self.dump_memory)
 
             tk.Label(self.sidebar, text="Captured Pieces", bg=THEMES[self.current_theme]["bg"], fg=THEMES[self.current_theme]["text"], font=("Arial", 10, "bold")).pack(pady=(5, 0))
             ttk.Separator(self.sidebar, orient="horizontal").pack(fill="x", pady=2)
@@ -194,11 +3511,22 @@ class ChessApp:
 
             self.eval_label = tk.Label(self.sidebar, text="Evaluation: 0.0", bg=THEMES[self.current_theme]["bg"], fg=THEMES[self.current_theme]["text"], font=("Arial", 10))
             self.eval_label.pack(pady=5)
+            self.eval_bar = tk.Canvas(self.sidebar, width=200, height=12, bg="#000000", highlightthickness=0)
+            self.eval_bar.pack(pady=2)
+            self.analysis_label = tk.Label(self.sidebar, text="", justify="left", anchor="w", wraplength=280, bg=THEMES[self.current_theme]["bg"], fg=THEMES[self.current_theme]["text"], font=("Courier", 8))
+            self.analysis_label.pack(fill="x", pady=2)
+
+            self.latency_label = tk.Label(self.sidebar, text="Input latency: -", bg=THEMES[self.current_theme]["bg"], fg=THEMES[self.current_theme]["text"], font=("Arial", 9))
+            self.latency_label.pack(pady=2)
+            self.puzzle_status = tk.Label(self.sidebar, text="", bg=THEMES[self.current_theme]["bg"], fg=THEMES[self.current_theme]["text"], font=("Arial", 9))
+            self.puzzle_status.pack(pady=2)
 
             controls = [
                 ("New Game", self.new_game, "Start a new game"),
                 ("Host Multiplayer", self.host_multiplayer, "Host a multiplayer game"),
                 ("Join Multiplayer", self.join_multiplayer, "Join a multiplayer game"),
+                ("Start Broadcast", self.toggle_broadcast, "Stream this game to spectators"),
+                ("Spectate", self.spectate, "Watch a broadcast game"),
                 ("Undo Move", self.undo_move, "Undo the last move"),
                 ("Get Hint", self.get_hint, "Get a suggested move"),
                 ("Resign", self.resign, "Resign the game"),
@@ -210,7 +3538,13 @@ class ChessApp:
                 ("Analyze Game", self.analyze_game, "Analyze the current game"),
                 ("Deep Analysis", self.deep_analysis, "Perform a detailed analysis"),
                 ("Save Analysis", self.save_analysis, "Save detailed analysis to file"),
-                ("Toggle Animation", self.toggle_animation, "Enable/Disable animations")
+                ("Infinite Analysis", self.toggle_analysis, "Keep analysing the current position"),
+                ("Opening Explorer", self.open_explorer, "Move statistics from imported games"),
+                ("Game Database", self.open_database, "Find games by position or material"),
+                ("Progress", self.show_progress, "Show rating and accuracy history"),
+                ("Toggle Animation", self.toggle_animation, "Enable/Disable animations"),
+                ("Toggle Pondering", self.toggle_pondering, "Let the bot think on your time"),
+                ("Engine Match", self.engine_match_dialog, "Watch the engine play itself")
             ]
             for text, cmd, _ in controls:
                 btn = tk.Button(self.sidebar, text=text, command=cmd, width=20, bg=THEMES[self.current_theme]["button"], fg="#FFFFFF", font=("Arial", 9), relief="flat", bd=1)
@@ -224,12 +3558,13 @@ class ChessApp:
             self.difficulty_var.trace("w", self.change_difficulty)
 
             self.load_learning_data()
-            logging.info("--- New Game Started ---")
+            ui_log.info("--- New Game Started ---")
             self.draw_board()
             self.update_pieces()
             self.update_timer()
+            self.start_puzzle_indexing()
         except Exception as e:
-            logging.error(f"Initialization failed: {e}")
+            ui_log.error(f"Initialization failed: {e}")
             messagebox.showerror("Error", f"Initialization failed: {e}")
 
     def host_multiplayer(self):
@@ -260,7 +3595,7 @@ class ChessApp:
                     self.ngrok_url = public_url.public_url
                     link = self.ngrok_url.replace("tcp://", "http://")
                 except Exception as e:
-                    logging.error(f"ngrok failed: {e}")
+                    net_log.error(f"ngrok failed: {e}")
                     messagebox.showerror("Error", "Failed to create ngrok link. Using local IP instead.")
                     host_ip = socket.gethostbyname(socket.gethostname())
                     link = f"http://{host_ip}:{self.game_port}"
@@ -272,28 +3607,26 @@ class ChessApp:
             self.server_thread = threading.Thread(target=self.accept_connection)
             self.server_thread.daemon = True
             self.server_thread.start()
-            logging.info(f"Hosting game on {link}")
+            net_log.info(f"Hosting game on {link}")
 
         except Exception as e:
-            logging.error(f"Host multiplayer failed: {e}")
+            net_log.error(f"Host multiplayer failed: {e}")
             messagebox.showerror("Error", f"Host multiplayer failed: {e}")
             self.cleanup_multiplayer()
 
     def accept_connection(self):
         try:
             self.opponent_socket, addr = self.server_socket.accept()
-            self.opponent_socket.settimeout(SOCKET_TIMEOUT)
-            logging.info(f"Opponent connected from {addr}")
+            net_log.info(f"Opponent connected from {addr}")
+            self.peer = MultiplayerPeer(self.opponent_socket, True).start()
             self.root.after(0, lambda: self.status_label.config(text="Opponent connected! Your turn as White."))
-            self.listen_thread = threading.Thread(target=self.listen_for_moves)
-            self.listen_thread.daemon = True
-            self.listen_thread.start()
+            self.root.after(0, self.poll_network)
         except socket.timeout:
-            logging.error("Accept connection timed out")
+            net_log.error("Accept connection timed out")
             self.root.after(0, lambda: messagebox.showerror("Error", "Connection timed out while waiting for opponent"))
             self.root.after(0, self.cleanup_multiplayer)
         except Exception as e:
-            logging.error(f"Accept connection failed: {e}")
+            net_log.error(f"Accept connection failed: {e}")
             self.root.after(0, lambda: messagebox.showerror("Error", f"Accept connection failed: {e}"))
             self.root.after(0, self.cleanup_multiplayer)
 
@@ -303,10 +3636,10 @@ class ChessApp:
                 messagebox.showwarning("Warning", "Already in a multiplayer game!")
                 return
 
-            dialog = tk.Toplevel(self.root)
-            dialog.title("Join Multiplayer Game")
+            dialog = self.open_dialog("join", "Join Multiplayer Game")
+            if dialog is None:
+                return
             dialog.geometry("300x150")
-            dialog.config(bg=THEMES[self.current_theme]["bg"])
 
             tk.Label(dialog, text="Enter Game Link:", bg=THEMES[self.current_theme]["bg"], fg=THEMES[self.current_theme]["text"]).pack(pady=5)
             link_entry = tk.Entry(dialog, width=40)
@@ -336,84 +3669,113 @@ class ChessApp:
                     self.new_game()
                     dialog.destroy()
                     self.status_label.config(text="Connected! Waiting for White's move.")
-                    self.listen_thread = threading.Thread(target=self.listen_for_moves)
-                    self.listen_thread.daemon = True
-                    self.listen_thread.start()
+                    self.peer = MultiplayerPeer(self.client_socket, False).start()
+                    self.poll_network()
                 except socket.timeout:
-                    logging.error("Connection timed out")
+                    net_log.error("Connection timed out")
                     messagebox.showerror("Error", "Connection timed out while joining game")
                     self.cleanup_multiplayer()
                 except Exception as e:
-                    logging.error(f"Join game failed: {e}")
+                    net_log.error(f"Join game failed: {e}")
                     messagebox.showerror("Error", f"Join game failed: {e}")
                     self.cleanup_multiplayer()
 
             tk.Button(dialog, text="Join Game", command=join_game, bg=THEMES[self.current_theme]["button"], fg="#FFFFFF").pack(pady=10)
         except Exception as e:
-            logging.error(f"Join multiplayer failed: {e}")
+            net_log.error(f"Join multiplayer failed: {e}")
             messagebox.showerror("Error", f"Join multiplayer failed: {e}")
 
-    def listen_for_moves(self):
+    def poll_network(self):
+        # The peer thread validates against its own GameState; only this Tk callback touches self.board
+        self.net_poll_id = None
+        peer = self.peer
+        if not self.multiplayer_mode or peer is None:
+            return
         try:
-            while self.multiplayer_mode:
-                with self.thread_lock:
-                    socket_to_use = self.opponent_socket if self.is_host else self.client_socket
-                    if socket_to_use is None:
-                        break
-                data = socket_to_use.recv(1024)
-                if not data:
-                    self.root.after(0, lambda: messagebox.showinfo("Disconnected", "Opponent disconnected!"))
-                    self.root.after(0, self.cleanup_multiplayer)
-                    break
-                try:
-                    move = pickle.loads(data)
-                    if not isinstance(move, chess.Move) or not self.board.is_legal(move):
-                        logging.error("Invalid move received")
-                        continue
-                    self.root.after(0, lambda: self.receive_move(move))
-                except pickle.PickleError as e:
-                    logging.error(f"Invalid data received: {e}")
-                    self.root.after(0, lambda: messagebox.showerror("Error", "Invalid move data received"))
-        except socket.timeout:
-            logging.error("Listen for moves timed out")
-            self.root.after(0, lambda: messagebox.showerror("Error", "Connection timed out"))
-            self.root.after(0, self.cleanup_multiplayer)
+            while True:
+                event = peer.events.get_nowait()
+                if event[0] == "move":
+                    if self.board.is_legal(event[1]):
+                        self.receive_move(event[1])
+                    else:
+                        self.resync_from_state()
+                elif event[0] == "sync":
+                    self.apply_sync(event[1])
+                elif event[0] == "desync":
+                    net_log.warning(f"Position desync: {event[1]}")
+                    self.status_label.config(text="Resynchronizing with host..." if not self.is_host else "Opponent resynchronized")
+                elif event[0] == "disconnected":
+                    messagebox.showinfo("Disconnected", "Opponent disconnected!")
+                    self.cleanup_multiplayer()
+                    return
+        except queue.Empty:
+            pass
         except Exception as e:
-            logging.error(f"Listen for moves failed: {e}")
-            self.root.after(0, lambda: messagebox.showerror("Error", f"Listen for moves failed: {e}"))
-            self.root.after(0, self.cleanup_multiplayer)
+            net_log.error(f"Network event failed: {e}")
+        self.net_poll_id = self.root.after(NET_POLL_MS, self.poll_network)
+
+    def resync_from_state(self):
+        with self.peer.state.lock:
+            snapshot = self.peer.state.snapshot()
+        self.apply_sync(snapshot)
+
+    def apply_sync(self, snapshot):
+        board = chess.Board(snapshot["fen"])
+        self.captured_pieces = {chess.WHITE: [], chess.BLACK: []}
+        for uci in snapshot["moves"]:
+            move = chess.Move.from_uci(uci)
+            captured = board.piece_at(move.to_square)
+            if captured:
+                self.captured_pieces[board.turn].append(captured.piece_type)
+            board.push(move)
+        kept = 0
+        while kept < min(len(self.move_history), len(board.move_stack)) and self.move_history[kept] == board.move_stack[kept]:
+            kept += 1
+        self.board = board
+        self.move_index = None
+        self.move_history = list(board.move_stack)
+        del self.evaluations[kept:]
+        self.clear_premoves()
+        self.selected_square = None
+        self.possible_moves = []
+        self.update_pieces()
+        self.broadcast_reset()
+        net_log.info(f"Resynchronized to {len(board.move_stack)} plies ({snapshot['hash']})")
 
     def receive_move(self, move):
         try:
             captured_piece = self.board.piece_at(move.to_square)
             if captured_piece:
                 self.captured_pieces[self.board.turn].append(captured_piece.piece_type)
-            self.animate_move(move.from_square, move.to_square)
+            if not self.premoves:
+                self.animate_move(move.from_square, move.to_square)
             san = self.board.san(move)
-            self.board.push(move)
+            self.push_move(move)
             self.move_history.append(move)
+            self.broadcast_move(move)
+            if self.apply_premove():
+                return
             self.update_pieces()
-            logging.info(f"Received move: {san}")
+            net_log.info(f"Received move: {san}")
             self.status_label.config(text="Your turn!" if self.board.turn == self.player_color else "Waiting for opponent's move...")
             if self.board.is_game_over():
                 self.status_label.config(text=f"Game Over: {self.board.result()}")
         except Exception as e:
-            logging.error(f"Receive move failed: {e}")
+            net_log.error(f"Receive move failed: {e}")
             messagebox.showerror("Error", f"Receive move failed: {e}")
 
     def send_move(self, move):
         try:
-            socket_to_use = self.opponent_socket if self.is_host else self.client_socket
-            if socket_to_use:
-                socket_to_use.send(pickle.dumps(move))
-                logging.info(f"Sent move: {move.uci()}")
+            if self.peer:
+                self.peer.send_move(move)
+                net_log.info(f"Sent move: {move.uci()}")
                 self.status_label.config(text="Waiting for opponent's move...")
-        except socket.timeout:
-            logging.error("Send move timed out")
-            messagebox.showerror("Error", "Connection timed out while sending move")
-            self.cleanup_multiplayer()
+        except ValueError as e:
+            # The authoritative state disagrees with the board shown: take the state's position
+            net_log.warning(f"Move rejected locally: {e}")
+            self.resync_from_state()
         except Exception as e:
-            logging.error(f"Send move failed: {e}")
+            net_log.error(f"Send move failed: {e}")
             messagebox.showerror("Error", f"Send move failed: {e}")
             self.cleanup_multiplayer()
 
@@ -423,6 +3785,14 @@ class ChessApp:
                 self.multiplayer_mode = False
                 self.is_host = False
                 self.player_color = chess.WHITE
+                if self.net_poll_id:
+                    self.root.after_cancel(self.net_poll_id)
+                    self.net_poll_id = None
+                if self.peer:
+                    self.peer.close()
+                    self.peer = None
+                    self.opponent_socket = None
+                    self.client_socket = None
                 if self.server_socket:
                     self.server_socket.close()
                     self.server_socket = None
@@ -442,7 +3812,149 @@ class ChessApp:
                 self.listen_thread = None
             self.new_game()
         except Exception as e:
-            logging.error(f"Cleanup multiplayer failed: {e}")
+            net_log.error(f"Cleanup multiplayer failed: {e}")
+
+    def broadcast_clocks(self):
+        return {"white": round(max(0, self.timer["white"]), 1), "black": round(max(0, self.timer["black"]), 1)}
+
+    def broadcast_move(self, move, evaluation=None):
+        if self.broadcaster:
+            if evaluation is None:
+                evaluation = evaluate(self.board, self.learning_data)
+            self.broadcaster.move(move, self.broadcast_clocks(), evaluation)
+
+    def broadcast_reset(self):
+        if self.broadcaster:
+            self.broadcaster.reset(self.board, self.broadcast_clocks(), evaluate(self.board, self.learning_data))
+
+    def toggle_broadcast(self):
+        try:
+            if self.broadcaster:
+                viewers = self.broadcaster.client_count()
+                self.broadcaster.stop()
+                self.broadcaster = None
+                net_log.info(f"Broadcast stopped ({viewers} spectators)")
+                messagebox.showinfo("Broadcast", "Broadcast stopped.")
+                return
+            self.broadcaster = Broadcaster(port=6000 + random.randint(0, 1000))
+            self.broadcast_reset()
+            host_ip = socket.gethostbyname(socket.gethostname())
+            link = f"http://{host_ip}:{self.broadcaster.port}"
+            messagebox.showinfo("Broadcast", f"Spectators can watch at:\n{link}")
+            net_log.info(f"Broadcasting on {link}")
+        except Exception as e:
+            net_log.error(f"Start broadcast failed: {e}")
+            messagebox.showerror("Error", f"Start broadcast failed: {e}")
+            self.broadcaster = None
+
+    def spectate(self):
+        try:
+            if self.multiplayer_mode or self.spectator_mode:
+                messagebox.showwarning("Warning", "Already in a game!")
+                return
+            dialog = self.open_dialog("spectate", "Spectate Game")
+            if dialog is None:
+                return
+            dialog.geometry("300x150")
+
+            tk.Label(dialog, text="Enter Broadcast Link:", bg=THEMES[self.current_theme]["bg"], fg=THEMES[self.current_theme]["text"]).pack(pady=5)
+            link_entry = tk.Entry(dialog, width=40)
+            link_entry.pack(pady=5)
+            link_entry.insert(0, "http://localhost:6000")
+
+            def watch():
+                import re
+                match = re.search(r'http://([\w\.-]+):(\d+)', link_entry.get().strip())
+                if not match:
+                    messagebox.showerror("Error", "Invalid link format! Expected http://<host>:<port>")
+                    return
+                host, port = match.groups()
+                self.new_game()
+                dialog.destroy()
+                self.spectator_mode = True
+                self.connect_spectator((host, int(port)))
+
+            tk.Button(dialog, text="Watch", command=watch, bg=THEMES[self.current_theme]["button"], fg="#FFFFFF").pack(pady=10)
+        except Exception as e:
+            net_log.error(f"Spectate failed: {e}")
+            messagebox.showerror("Error", f"Spectate failed: {e}")
+
+    def connect_spectator(self, address):
+        try:
+            sock = socket.create_connection(address, timeout=SOCKET_TIMEOUT)
+            sock.settimeout(None)  # Quiet games are normal; wait for the next update
+            self.spectator_socket = sock
+            self.spectator_address = address
+            self.status_label.config(text="Spectating...")
+            threading.Thread(target=self.listen_for_broadcast, args=(sock,), daemon=True).start()
+            net_log.info(f"Spectating {address[0]}:{address[1]}")
+        except Exception as e:
+            net_log.error(f"Spectator connection failed: {e}")
+            messagebox.showerror("Error", f"Spectator connection failed: {e}")
+            self.stop_spectating()
+
+    def listen_for_broadcast(self, sock):
+        pending = b""
+        try:
+            while self.spectator_socket is sock:
+                messages, pending = read_json_lines(sock, pending)
+                if messages:
+                    self.root.after(0, lambda messages=messages: self.receive_broadcast(sock, messages))
+        except Exception as e:
+            if self.spectator_socket is sock:
+                net_log.error(f"Broadcast connection lost: {e}")
+                self.root.after(0, lambda: messagebox.showinfo("Disconnected", "Broadcast ended."))
+                self.root.after(0, self.stop_spectating)
+
+    def receive_broadcast(self, sock, messages):
+        try:
+            if self.spectator_socket is not sock:
+                return
+            board = self.board
+            evaluation = None
+            for message in messages:
+                board = apply_spectator_message(board, message)
+                if board is None:
+                    # Missed a delta: reconnecting yields a fresh snapshot
+                    net_log.warning("Spectator out of sync, reconnecting")
+                    self.spectator_socket = None
+                    sock.close()
+                    self.connect_spectator(self.spectator_address)
+                    return
+                if message.get("clocks"):
+                    self.timer = dict(self.timer, **message["clocks"])
+                if message.get("eval") is not None:
+                    evaluation = message["eval"]
+            self.board = board
+            self.move_index = None
+            self.move_history = list(board.move_stack)
+            self.evaluations = []
+            self.game_recorded = True  # Someone else's game: never rated or stored here
+            self.captured_pieces = {chess.WHITE: [], chess.BLACK: []}
+            replay = board.root()
+            for move in board.move_stack:
+                captured = replay.piece_at(move.to_square)
+                if captured:
+                    self.captured_pieces[replay.turn].append(captured.piece_type)
+                replay.push(move)
+            self.timer_label.config(
+                text=f"White: {int(self.timer['white']//60)}:{int(self.timer['white']%60):02d} | Black: {int(self.timer['black']//60)}:{int(self.timer['black']%60):02d}"
+            )
+            self.update_pieces()
+            if evaluation is not None:
+                self.eval_label.config(text=f"Evaluation: {evaluation / 100:+.1f}")
+            self.status_label.config(text=f"Spectating - {'White' if board.turn == chess.WHITE else 'Black'} to move" if not board.is_game_over() else f"Spectating - Game Over: {board.result()}")
+        except Exception as e:
+            net_log.error(f"Broadcast update failed: {e}")
+
+    def stop_spectating(self):
+        self.spectator_mode = False
+        sock, self.spectator_socket = self.spectator_socket, None
+        if sock:
+            try:
+                sock.close()
+            except OSError:
+                pass
 
     def draw_board(self):
         try:
@@ -464,13 +3976,12 @@ class ChessApp:
                 self.canvas.create_text(10, i*SQUARE_SIZE + SQUARE_SIZE//2 + 20, text=row_label, font=("Arial", 12, "bold"), fill=THEMES[self.current_theme]["text"])
                 self.canvas.create_text(i*SQUARE_SIZE + SQUARE_SIZE//2 + 20, BOARD_SIZE + 30, text=col_label, font=("Arial", 12, "bold"), fill=THEMES[self.current_theme]["text"])
         except Exception as e:
-            logging.error(f"Draw board failed: {e}")
+            ui_log.error(f"Draw board failed: {e}")
             messagebox.showerror("Error", f"Draw board failed: {e}")
 
     def animate_move(self, from_square, to_square):
         try:
             if not self.animations_enabled:
-                self.update_pieces()
                 return
 
             from_row = 7 - (from_square // 8) if not self.board_flipped else (from_square // 8)
@@ -484,7 +3995,7 @@ class ChessApp:
 
             piece = self.board.piece_at(from_square)
             if not piece:
-                logging.error(f"No piece found at from_square {from_square}")
+                ui_log.error(f"No piece found at from_square {from_square}")
                 return
             symbol = PIECES_UNICODE.get(piece.symbol(), "♟")
             x, y = from_col * SQUARE_SIZE + SQUARE_SIZE//2 + 20, from_row * SQUARE_SIZE + SQUARE_SIZE//2 + 20
@@ -494,45 +4005,124 @@ class ChessApp:
                 self.root.update()
                 time.sleep(ANIMATION_SPEED / 1000)
             self.canvas.delete("moving_piece")
-            self.update_pieces()
         except Exception as e:
-            logging.error(f"Animate move failed: {e}")
+            ui_log.error(f"Animate move failed: {e}")
             messagebox.showerror("Error", f"Animate move failed: {e}")
 
     def update_pieces(self):
         try:
-            self.canvas.delete("piece")
             self.canvas.delete("highlight")
             self.canvas.delete("moving_piece")
+            self.draw_pieces(self.display_board())
 
-            for square in chess.SQUARES:
-                piece = self.board.piece_at(square)
-                if piece:
-                    row = 7 - (square // 8) if not self.board_flipped else (square // 8)
-                    col = square % 8 if not self.board_flipped else 7 - (square % 8)
-                    symbol = PIECES_UNICODE.get(piece.symbol(), "♟")
-                    x, y = col*SQUARE_SIZE + SQUARE_SIZE//2 + 20, row*SQUARE_SIZE + SQUARE_SIZE//2 + 20
-                    self.canvas.create_text(x, y, text=symbol, font=("Arial", 40), tags="piece")
-
-            if self.selected_square is not None and self.possible_moves:
-                for move in self.possible_moves:
-                    to_sq = move.to_square
-                    row = 7 - (to_sq // 8) if not self.board_flipped else (to_sq // 8)
-                    col = to_sq % 8 if not self.board_flipped else 7 - (to_sq % 8)
-                    x = col*SQUARE_SIZE + SQUARE_SIZE//2 + 20
-                    y = row*SQUARE_SIZE + SQUARE_SIZE//2 + 20
-                    self.canvas.create_oval(
-                        x-16, y-16, x+16, y+16, fill=THEMES[self.current_theme]["highlight"], outline="", tags="highlight"
-                    )
+            self.draw_highlights()
+            self.draw_premoves()
 
             self.update_captured_pieces()
             self.update_move_history()
             self.update_status()
             self.update_evaluation()
+            if self.analysis_enabled:
+                self.restart_analysis()
+            self.refresh_explorer()
         except Exception as e:
-            logging.error(f"Update pieces failed: {e}")
+            ui_log.error(f"Update pieces failed: {e}")
             messagebox.showerror("Error", f"Update pieces failed: {e}")
 
+    def draw_pieces(self, board):
+        self.canvas.delete("piece")
+        for square, piece in board.piece_map().items():
+            x, y = self.square_center(square)
+            self.canvas.create_text(x, y, text=PIECES_UNICODE.get(piece.symbol(), "♟"), font=("Arial", 40), tags="piece")
+
+    def display_board(self):
+        replay = self.replay_index()
+        if self.view_ply is not None and self.view_ply >= len(replay.moves):
+            self.view_ply = None
+        return self.board if self.view_ply is None else replay.position(self.view_ply)
+
+    def show_ply(self, ply):
+        try:
+            replay = self.replay_index()
+            self.view_ply = None if ply is None or ply >= len(replay.moves) else max(0, ply)
+            board = self.display_board()
+            self.selected_square = None
+            self.possible_moves = []
+            self.draw_pieces(board)
+            self.draw_highlights()
+            self.select_history_row()
+            if self.view_ply is None:
+                self.update_status()
+            else:
+                self.status_label.config(text=f"Viewing ply {self.view_ply} of {len(replay.moves)} (End returns to the game)", fg=THEMES[self.current_theme]["text"])
+            if not self.analysis_enabled:
+                self.update_evaluation()
+        except Exception as e:
+            ui_log.error(f"Show ply failed: {e}")
+
+    def step_back(self, event=None):
+        ply = len(self.replay_index().moves) if self.view_ply is None else self.view_ply
+        if ply > 0:
+            self.show_ply(ply - 1)
+
+    def step_forward(self, event=None):
+        if self.view_ply is not None:
+            self.show_ply(self.view_ply + 1)
+
+    def view_start(self, event=None):
+        self.show_ply(0)
+
+    def view_live(self, event=None):
+        if self.view_ply is not None:
+            self.show_ply(None)
+
+    def on_history_select(self, event):
+        selection = self.move_listbox.curselection()
+        if selection:
+            self.show_ply(selection[0] + 1)  # Row i shows the position after move i
+
+    def select_history_row(self):
+        self.move_listbox.selection_clear(0, tk.END)
+        row = (len(self.replay.moves) if self.view_ply is None else self.view_ply) - 1
+        if row >= 0:
+            self.move_listbox.selection_set(row)
+            self.move_listbox.see(row)
+
+    def square_center(self, square):
+        row = 7 - (square // 8) if not self.board_flipped else (square // 8)
+        col = square % 8 if not self.board_flipped else 7 - (square % 8)
+        return col*SQUARE_SIZE + SQUARE_SIZE//2 + 20, row*SQUARE_SIZE + SQUARE_SIZE//2 + 20
+
+    def board_square(self, x, y):
+        col = (x - 20) // SQUARE_SIZE
+        row = (y - 20) // SQUARE_SIZE
+        if not (0 <= col < 8 and 0 <= row < 8):
+            return None
+        board_row = 7 - row if not self.board_flipped else row
+        board_col = col if not self.board_flipped else 7 - col
+        return board_row * 8 + board_col
+
+    def draw_highlights(self):
+        # Selection feedback only: no piece redraw, evaluation or status update
+        self.canvas.delete("highlight")
+        if self.selected_square is not None and self.possible_moves:
+            for move in self.possible_moves:
+                x, y = self.square_center(move.to_square)
+                self.canvas.create_oval(
+                    x-16, y-16, x+16, y+16, fill=THEMES[self.current_theme]["highlight"], outline="", tags="highlight"
+                )
+
+    def draw_premoves(self):
+        self.canvas.delete("premove")
+        squares = [square for premove in self.premoves for square in premove]
+        if self.premove_from is not None:
+            squares.append(self.premove_from)
+        for square in squares:
+            x, y = self.square_center(square)
+            self.canvas.create_rectangle(x - SQUARE_SIZE//2 + 2, y - SQUARE_SIZE//2 + 2, x + SQUARE_SIZE//2 - 2, y + SQUARE_SIZE//2 - 2,
+                                         outline="#D32F2F", width=3, tags="premove")
+        self.canvas.tag_lower("premove", "piece")
+
     def update_captured_pieces(self):
         try:
             white_captured = "".join(PIECES_UNICODE.get(chess.piece_symbol(p).upper(), "♟") for p in sorted(self.captured_pieces[chess.WHITE], reverse=True))
@@ -540,39 +4130,305 @@ class ChessApp:
             self.captured_white.config(text=f"White Captures: {white_captured}")
             self.captured_black.config(text=f"Black Captures: {black_captured}")
         except Exception as e:
-            logging.error(f"Update captured pieces failed: {e}")
+            ui_log.error(f"Update captured pieces failed: {e}")
             messagebox.showerror("Error", f"Update captured pieces failed: {e}")
 
     def update_move_history(self):
         try:
             self.move_listbox.delete(0, tk.END)
-            temp_board = chess.Board()
             move_number = 1
-            for i, move in enumerate(self.move_history):
-                san = temp_board.san(move)
+            for i, san in enumerate(self.replay_index().sans):
                 eval_text = f" ({self.evaluations[i]/100:+.1f})" if i < len(self.evaluations) else ""
                 if move_number % 2 == 1:
                     self.move_listbox.insert(tk.END, f"{move_number//2 + 1}. {san}{eval_text}")
                 else:
                     self.move_listbox.insert(tk.END, f"   {san}{eval_text}")
-                temp_board.push(move)
                 move_number += 1
+            self.select_history_row()
         except Exception as e:
-            logging.error(f"Update move history failed: {e}")
+            ui_log.error(f"Update move history failed: {e}")
             messagebox.showerror("Error", f"Update move history failed: {e}")
 
     def update_evaluation(self):
         try:
-            score = evaluate(self.board, self.learning_data)
+            score = evaluate(self.display_board(), self.learning_data)
             if score is not None:
+                self.draw_eval_bar(score)
                 score = score / 100.0
                 self.eval_label.config(text=f"Evaluation: {score:+.1f}")
             else:
                 self.eval_label.config(text="Evaluation: N/A")
         except Exception as e:
-            logging.error(f"Evaluation update failed: {e}")
+            ui_log.error(f"Evaluation update failed: {e}")
             self.eval_label.config(text="Evaluation: N/A")
 
+    def draw_eval_bar(self, score):
+        if abs(score) >= MATE_SCORE - 1000:
+            white_share = 1.0 if score > 0 else 0.0
+        else:
+            white_share = 1 / (1 + 10 ** (-score / 400))
+        self.eval_bar.delete("all")
+        self.eval_bar.create_rectangle(0, 0, int(200 * white_share), 12, fill="#FFFFFF", outline="")
+
+    def toggle_analysis(self):
+        try:
+            self.analysis_enabled = not self.analysis_enabled
+            if self.analysis_enabled:
+                self.restart_analysis()
+                ui_log.info("Infinite analysis started")
+            else:
+                self.stop_analysis()
+                self.analysis_label.config(text="")
+                self.update_evaluation()
+                ui_log.info("Infinite analysis stopped")
+        except Exception as e:
+            ui_log.error(f"Toggle analysis failed: {e}")
+            messagebox.showerror("Error", f"Toggle analysis failed: {e}")
+
+    def restart_analysis(self):
+        key = (chess.polyglot.zobrist_hash(self.board), len(self.board.move_stack))
+        if self.analysis and self.analysis["key"] == key:
+            return
+        self.stop_analysis()
+        # The old search stops at its next node; the new one starts from the shared transposition table
+        board = self.board.copy()
+        ctx = SearchContext()
+        self.analysis = {"key": key, "ctx": ctx, "board": board.copy()}
+        learning_data = self.learning_data
+
+        def run():
+            try:
+                multipv_search(board, ANALYSIS_MAX_DEPTH, ANALYSIS_LINES, learning_data, ctx,
+                               report=lambda depth, lines: self.analysis_updates.put((ctx, depth, lines, ctx.nodes)))
+            except Exception as e:
+                engine_log.error(f"Infinite analysis failed: {e}")
+
+        threading.Thread(target=run, daemon=True).start()
+        self.analysis_label.config(text="Analysing...")
+        if self.analysis_poll_id is None:
+            self.analysis_poll_id = self.root.after(ANALYSIS_REFRESH_MS, self.poll_analysis)
+
+    def stop_analysis(self):
+        if self.analysis:
+            self.analysis["ctx"].stop_event.set()
+            self.analysis = None
+
+    def poll_analysis(self):
+        self.analysis_poll_id = None
+        latest = None
+        try:
+            while True:
+                update = self.analysis_updates.get_nowait()
+                if self.analysis and update[0] is self.analysis["ctx"]:
+                    latest = update
+        except queue.Empty:
+            pass
+        try:
+            if latest:
+                self.show_analysis(*latest[1:])
+        except Exception as e:
+            ui_log.error(f"Analysis update failed: {e}")
+        if self.analysis_enabled:
+            self.analysis_poll_id = self.root.after(ANALYSIS_REFRESH_MS, self.poll_analysis)
+
+    def show_analysis(self, depth, lines, nodes):
+        board = self.analysis["board"]
+        if not lines:
+            self.analysis_label.config(text=f"Game over: {board.result()}")
+            return
+        rows = []
+        for score, pv in lines:
+            if abs(score) >= MATE_SCORE - 1000:
+                moves_to_mate = (MATE_SCORE - abs(score) + 1) // 2
+                score_text = f"#{moves_to_mate}" if score > 0 else f"#-{moves_to_mate}"
+            else:
+                score_text = f"{score / 100:+.2f}"
+            rows.append(f"{score_text:>7} {board.variation_san(pv)}")
+        self.analysis_label.config(text=f"Depth {depth} | {nodes} nodes\n" + "\n".join(rows))
+        self.eval_label.config(text=f"Evaluation: {lines[0][0] / 100:+.1f} (depth {depth})" if abs(lines[0][0]) < MATE_SCORE - 1000 else f"Evaluation: {rows[0].split()[0]}")
+        self.draw_eval_bar(lines[0][0])
+
+    def open_explorer(self):
+        try:
+            window = self.open_dialog("explorer", "Opening Explorer")
+            if window is None:
+                return
+            tree = ttk.Treeview(window, columns=("move", "games", "white", "draws", "black", "elo"), show="headings", height=12)
+            for column, heading in (("move", "Move"), ("games", "Games"), ("white", "White %"), ("draws", "Draw %"), ("black", "Black %"), ("elo", "Avg Elo")):
+                tree.heading(column, text=heading)
+                tree.column(column, width=70, anchor="center")
+            tree.pack(fill="both", expand=True, padx=5, pady=5)
+            tree.bind("<Double-1>", self.play_explorer_move)
+            self.explorer_status = tk.Label(window, text="", bg=THEMES[self.current_theme]["bg"], fg=THEMES[self.current_theme]["text"], font=("Arial", 9))
+            self.explorer_status.pack(pady=2)
+            tk.Button(window, text="Import PGN...", command=self.import_explorer_pgn, bg=THEMES[self.current_theme]["button"], fg="#FFFFFF").pack(pady=5)
+            self.explorer_window = window
+            self.explorer_tree = tree
+            self.refresh_explorer()
+        except Exception as e:
+            ui_log.error(f"Open explorer failed: {e}")
+            messagebox.showerror("Error", f"Open explorer failed: {e}")
+
+    def refresh_explorer(self):
+        try:
+            if not (self.explorer_window and self.explorer_window.winfo_exists()):
+                return
+            started = time.perf_counter()
+            entries = get_opening_explorer().lookup(self.board)
+            elapsed = (time.perf_counter() - started) * 1000
+            self.explorer_tree.delete(*self.explorer_tree.get_children())
+            total = sum(entry["games"] for entry in entries)
+            for entry in entries:
+                white, black = (entry["wins"], entry["losses"]) if self.board.turn == chess.WHITE else (entry["losses"], entry["wins"])
+                games = entry["games"]
+                self.explorer_tree.insert("", "end", iid=entry["move"].uci(), values=(
+                    self.board.san(entry["move"]), games, f"{100 * white / games:.0f}", f"{100 * entry['draws'] / games:.0f}", f"{100 * black / games:.0f}",
+                    int(entry["elo"]) if entry["elo"] else "-"))
+            importing = " | importing..." if self.explorer_import else ""
+            self.explorer_status.config(text=f"{total} games in this position ({elapsed:.2f} ms){importing}")
+        except Exception as e:
+            ui_log.error(f"Refresh explorer failed: {e}")
+
+    def play_explorer_move(self, event):
+        try:
+            selection = self.explorer_tree.selection()
+            if not selection or self.spectator_mode or self.engine_match or self.puzzle_mode or self.awaiting_opponent() or self.board.is_game_over():
+                return
+            move = chess.Move.from_uci(selection[0])
+            if self.board.is_legal(move):
+                self.input_time = time.perf_counter()
+                self.handle_move(move)
+        except Exception as e:
+            ui_log.error(f"Play explorer move failed: {e}")
+            messagebox.showerror("Error", f"Play explorer move failed: {e}")
+
+    def import_explorer_pgn(self):
+        try:
+            if self.explorer_import:
+                messagebox.showinfo("Info", "An import is already running")
+                return
+            paths = filedialog.askopenfilenames(filetypes=[("PGN files", "*.pgn")])
+            if not paths:
+                return
+
+            def run():
+                for path in paths:
+                    try:
+                        get_opening_explorer().import_pgn(path)
+                    except Exception as e:
+                        ui_log.error(f"Explorer import of {path} failed: {e}")
+
+            self.explorer_import = threading.Thread(target=run, daemon=True)
+            self.explorer_import.start()
+            self.refresh_explorer()
+            self.root.after(500, self.poll_explorer_import)
+        except Exception as e:
+            ui_log.error(f"Explorer import failed: {e}")
+            messagebox.showerror("Error", f"Explorer import failed: {e}")
+
+    def poll_explorer_import(self):
+        if self.explorer_import and self.explorer_import.is_alive():
+            self.root.after(500, self.poll_explorer_import)
+            return
+        self.explorer_import = None
+        self.refresh_explorer()
+
+    def open_database(self):
+        try:
+            window = self.open_dialog("database", "Game Database")
+            if window is None:
+                return
+            controls = tk.Frame(window, bg=THEMES[self.current_theme]["bg"])
+            controls.pack(fill="x", padx=5, pady=5)
+            tk.Button(controls, text="Import PGN...", command=self.import_database_pgn, bg=THEMES[self.current_theme]["button"], fg="#FFFFFF").pack(side="left", padx=2)
+            tk.Button(controls, text="This Position", command=self.search_database_position, bg=THEMES[self.current_theme]["button"], fg="#FFFFFF").pack(side="left", padx=2)
+            self.material_entry = tk.Entry(controls, width=12)
+            self.material_entry.insert(0, "KRPvKR")
+            self.material_entry.pack(side="left", padx=2)
+            tk.Button(controls, text="Material", command=self.search_database_material, bg=THEMES[self.current_theme]["button"], fg="#FFFFFF").pack(side="left", padx=2)
+            tree = ttk.Treeview(window, columns=("white", "black", "result", "date", "ply"), show="headings", height=15)
+            for column, heading, width in (("white", "White", 140), ("black", "Black", 140), ("result", "Result", 60), ("date", "Date", 90), ("ply", "Ply", 40)):
+                tree.heading(column, text=heading)
+                tree.column(column, width=width, anchor="center")
+            tree.pack(fill="both", expand=True, padx=5, pady=5)
+            tree.bind("<Double-1>", self.open_database_game)
+            self.database_status = tk.Label(window, text="", bg=THEMES[self.current_theme]["bg"], fg=THEMES[self.current_theme]["text"], font=("Arial", 9))
+            self.database_status.pack(pady=2)
+            self.database_window = window
+            self.database_tree = tree
+        except Exception as e:
+            ui_log.error(f"Open database failed: {e}")
+            messagebox.showerror("Error", f"Open database failed: {e}")
+
+    def search_database_position(self):
+        self.show_database_results(lambda database: database.search_position(self.board))
+
+    def search_database_material(self):
+        self.show_database_results(lambda database: database.search_material(self.material_entry.get()))
+
+    def show_database_results(self, query):
+        try:
+            started = time.perf_counter()
+            total, rows = query(get_game_database())
+            elapsed = (time.perf_counter() - started) * 1000
+            self.database_tree.delete(*self.database_tree.get_children())
+            for game_id, ply, white, black, result, date, white_elo, black_elo in rows:
+                self.database_tree.insert("", "end", iid=f"{game_id}:{ply}", values=(
+                    f"{white or '?'} ({white_elo or '?'})", f"{black or '?'} ({black_elo or '?'})", result, date or "", ply))
+            importing = " | importing..." if self.database_import else ""
+            self.database_status.config(text=f"{total} games, {len(rows)} shown ({elapsed:.1f} ms){importing}")
+        except ValueError as e:
+            messagebox.showerror("Error", str(e))
+        except Exception as e:
+            ui_log.error(f"Database search failed: {e}")
+            messagebox.showerror("Error", f"Database search failed: {e}")
+
+    def open_database_game(self, event):
+        try:
+            selection = self.database_tree.selection()
+            if not selection:
+                return
+            if self.multiplayer_mode or self.spectator_mode:
+                messagebox.showwarning("Warning", "Leave the current online game first!")
+                return
+            game_id, ply = map(int, selection[0].split(":"))
+            self.open_game(get_game_database().load(game_id), f"game database #{game_id}", ply)
+        except Exception as e:
+            ui_log.error(f"Open database game failed: {e}")
+            messagebox.showerror("Error", f"Open database game failed: {e}")
+
+    def import_database_pgn(self):
+        try:
+            if self.database_import:
+                messagebox.showinfo("Info", "An import is already running")
+                return
+            paths = filedialog.askopenfilenames(filetypes=[("PGN files", "*.pgn")])
+            if not paths:
+                return
+
+            def run():
+                for path in paths:
+                    try:
+                        get_game_database().import_pgn(path)
+                    except Exception as e:
+                        ui_log.error(f"Database import of {path} failed: {e}")
+
+            self.database_import = threading.Thread(target=run, daemon=True)
+            self.database_import.start()
+            self.database_status.config(text="Importing...")
+            self.root.after(500, self.poll_database_import)
+        except Exception as e:
+            ui_log.error(f"Database import failed: {e}")
+            messagebox.showerror("Error", f"Database import failed: {e}")
+
+    def poll_database_import(self):
+        if self.database_import and self.database_import.is_alive():
+            self.root.after(500, self.poll_database_import)
+            return
+        self.database_import = None
+        if self.database_window and self.database_window.winfo_exists():
+            self.database_status.config(text="Import finished")
+
     def update_status(self):
         try:
             if self.board.is_game_over():
@@ -589,7 +4445,7 @@ class ChessApp:
                 else:
                     self.status_label.config(text=f"{turn}'s turn{state}", fg="#D32F2F" if self.board.is_check() else THEMES[self.current_theme]["text"])
         except Exception as e:
-            logging.error(f"Update status failed: {e}")
+            ui_log.error(f"Update status failed: {e}")
             messagebox.showerror("Error", f"Update status failed: {e}")
 
     def update_timer(self):
@@ -604,15 +4460,18 @@ class ChessApp:
                 self.timer_label.config(
                     text=f"White: {int(white_time//60)}:{int(white_time%60):02d} | Black: {int(black_time//60)}:{int(black_time%60):02d}"
                 )
+                if self.broadcaster and time.monotonic() - self.last_clock_broadcast >= SPECTATOR_CLOCK_INTERVAL:
+                    self.last_clock_broadcast = time.monotonic()
+                    self.broadcaster.clock(self.broadcast_clocks())
                 if white_time <= 0 or black_time <= 0:
                     winner = "Black" if white_time <= 0 else "White"
                     messagebox.showinfo("Time Out", f"{winner} wins on time!")
                     self.new_game()
-                    logging.info(f"Game ended: {winner} wins on time")
+                    ui_log.info(f"Game ended: {winner} wins on time")
                 else:
                     self.timer_id = self.root.after(100, self.update_timer)
         except Exception as e:
-            logging.error(f"Update timer failed: {e}")
+            ui_log.error(f"Update timer failed: {e}")
             messagebox.showerror("Error", f"Update timer failed: {e}")
 
     def stop_timer(self):
@@ -623,73 +4482,199 @@ class ChessApp:
 
     def on_click(self, event):
         try:
-            if self.board.is_game_over() or self.puzzle_mode:
-                messagebox.showinfo("Info", "Game Over or Puzzle Mode active" if self.board.is_game_over() else "Solve the puzzle first")
-                logging.info(f"Click ignored: Game Over or Puzzle Mode")
+            if self.board.is_game_over() or (self.puzzle_mode and self.puzzle_step % 2 == 1):
+                messagebox.showinfo("Info", "Game Over" if self.board.is_game_over() else "Wait for the puzzle reply")
+                ui_log.debug("Click ignored: Game Over or Puzzle reply pending")
                 return
 
             if self.multiplayer_mode and self.board.turn != self.player_color:
                 messagebox.showinfo("Info", "It's not your turn!")
                 return
 
-            col = (event.x - 20) // SQUARE_SIZE
-            row = (event.y - 20) // SQUARE_SIZE
-            if not (0 <= col < 8 and 0 <= row < 8):
-                logging.info(f"Click outside board at ({event.x}, {event.y})")
+            square = self.board_square(event.x, event.y)
+            if square is None:
+                ui_log.debug("Click outside board at (%d, %d)", event.x, event.y)
                 self.selected_square = None
                 self.possible_moves = []
-                self.update_pieces()
+                self.draw_highlights()
                 return
 
-            board_row = 7 - row if not self.board_flipped else row
-            board_col = col if not self.board_flipped else 7 - col
-            square = board_row * 8 + board_col
-
-            logging.info(f"Click at ({event.x}, {event.y}) -> Square {square}")
-            print(f"Click at ({event.x}, {event.y}) -> Square {square}")
+            ui_log.debug("Click at (%d, %d) -> Square %d", event.x, event.y, square)
 
             if self.selected_square is None:
                 piece = self.board.piece_at(square)
                 if piece and piece.color == self.board.turn:
                     self.selected_square = square
-                    self.possible_moves = [move for move in self.board.legal_moves if move.from_square == square and self.board.is_legal(move)]
-                    logging.info(f"Selected square {square} with piece {piece.symbol()}")
-                    print(f"Selected square {square} with piece {piece.symbol()}")
+                    # One entry per destination; promotion variants stay grouped in the index
+                    self.possible_moves = [group[0] for group in self.legal_move_index().get(square, {}).values()]
+                    ui_log.debug("Selected square %d with piece %s", square, piece)
                 else:
-                    logging.info(f"No piece or wrong color at square {square}")
-                    print(f"No piece or wrong color at square {square}")
+                    ui_log.debug("No piece or wrong color at square %d", square)
             else:
-                move = None
-                for m in self.possible_moves:
-                    if m.to_square == square and self.board.is_legal(m):
-                        move = m
-                        break
-                if move:
-                    if self.board.piece_at(move.from_square).piece_type == chess.PAWN and chess.square_rank(move.to_square) in [0, 7]:
-                        self.promotion_dialog(move)
+                group = self.legal_move_index().get(self.selected_square, {}).get(square)
+                if group:
+                    if len(group) > 1:
+                        self.promotion_dialog(group[0])
                     else:
-                        self.handle_move(move)
-                else:
-                    logging.info(f"No valid move at square {square}, deselecting")
-                    self.selected_square = None
-                    self.possible_moves = []
+                        self.handle_move(group[0])
+                    return
+                ui_log.debug("No valid move at square %d, deselecting", square)
+                self.selected_square = None
+                self.possible_moves = []
 
-            self.update_pieces()
+            self.draw_highlights()
         except Exception as e:
-            logging.error(f"On click failed: {e}")
+            ui_log.error(f"On click failed: {e}")
             messagebox.showerror("Error", f"On click failed: {e}")
 
+    def awaiting_opponent(self):
+        if self.multiplayer_mode:
+            return self.board.turn != self.player_color
+        return self.bot_pending
+
+    def on_press(self, event):
+        try:
+            if self.spectator_mode or self.engine_match:
+                return  # Spectators and engine matches are read-only
+            if self.view_ply is not None:
+                self.view_live()  # Moves are only made on the live position
+                return
+            self.input_time = time.perf_counter()
+            self.drag = None
+            if self.awaiting_opponent() and not self.board.is_game_over():
+                self.on_premove_click(event)
+                origin = self.premove_from
+            else:
+                self.on_click(event)
+                origin = self.selected_square
+            square = self.board_square(event.x, event.y)
+            piece = self.board.piece_at(square) if square is not None else None
+            if piece and origin == square:
+                item = self.canvas.create_text(event.x, event.y, text=PIECES_UNICODE.get(piece.symbol(), "♟"), font=("Arial", 40), tags="drag")
+                self.drag = {"from": square, "item": item}
+        except Exception as e:
+            ui_log.error(f"On press failed: {e}")
+            messagebox.showerror("Error", f"On press failed: {e}")
+
+    def on_drag(self, event):
+        if self.drag:
+            self.canvas.coords(self.drag["item"], event.x, event.y)
+
+    def on_release(self, event):
+        try:
+            if not self.drag:
+                return
+            drag, self.drag = self.drag, None
+            self.canvas.delete("drag")
+            square = self.board_square(event.x, event.y)
+            if square is None or square == drag["from"]:
+                return  # Plain click: keep the selection for click-click input
+            self.input_time = time.perf_counter()
+            if self.awaiting_opponent():
+                if self.premove_from == drag["from"]:
+                    self.on_premove_click(event)
+            elif self.selected_square == drag["from"]:
+                self.on_click(event)
+        except Exception as e:
+            ui_log.error(f"On release failed: {e}")
+            messagebox.showerror("Error", f"On release failed: {e}")
+
+    def on_premove_click(self, event):
+        square = self.board_square(event.x, event.y)
+        if self.premove_from is None:
+            piece = self.board.piece_at(square) if square is not None else None
+            queued = any(to_square == square for _, to_square in self.premoves)
+            if (piece and piece.color == self.player_color) or queued:
+                self.premove_from = square
+            else:
+                self.premoves = []  # Clicking elsewhere cancels the queue
+        else:
+            if square is not None and square != self.premove_from and len(self.premoves) < PREMOVE_LIMIT:
+                self.premoves.append((self.premove_from, square))
+                ui_log.debug("Premove queued: %s%s", chess.square_name(self.premove_from), chess.square_name(square))
+            self.premove_from = None
+        self.draw_premoves()
+
+    def clear_premoves(self):
+        self.premoves = []
+        self.premove_from = None
+        self.bot_pending = False
+        self.canvas.delete("premove")
+
+    def apply_premove(self):
+        # Runs right after the opponent's move is pushed, before any redraw
+        if not self.premoves or self.awaiting_opponent() or self.board.is_game_over():
+            return False
+        from_square, to_square = self.premoves.pop(0)
+        group = self.legal_move_index().get(from_square, {}).get(to_square)
+        if not group:
+            ui_log.debug("Premove %s%s no longer legal, clearing queue", chess.square_name(from_square), chess.square_name(to_square))
+            self.premoves = []
+            self.premove_from = None
+            return False
+        move = next((m for m in group if m.promotion in (None, chess.QUEEN)), group[0])
+        self.input_time = time.perf_counter()
+        self.handle_move(move, animate=False)
+        return True
+
+    def record_input_latency(self):
+        if self.input_time is None:
+            return
+        latency = (time.perf_counter() - self.input_time) * 1000
+        self.input_time = None
+        self.input_latencies.append(latency)
+        stats = self.input_latency_stats()
+        self.latency_label.config(text=f"Input latency: {latency:.0f} ms (avg {stats['mean']:.0f}, p95 {stats['p95']:.0f})")
+        ui_log.debug("Input-to-move latency: %.1f ms", latency)
+
+    def input_latency_stats(self):
+        samples = sorted(self.input_latencies)
+        if not samples:
+            return {"count": 0, "mean": 0.0, "p95": 0.0, "max": 0.0}
+        return {"count": len(samples), "mean": sum(samples) / len(samples), "p95": samples[min(len(samples) - 1, int(len(samples) * 0.95))], "max": samples[-1]}
+
+    def legal_move_index(self):
+        if self.move_index is None:
+            index = {}
+            for move in self.board.legal_moves:
+                index.setdefault(move.from_square, {}).setdefault(move.to_square, []).append(move)
+            self.move_index = index
+        return self.move_index
+
+    def open_dialog(self, name, title):
+        # Returns None and raises the existing window when one of this kind is already open
+        dialog = self.dialogs.get(name)
+        if dialog is not None and dialog.winfo_exists():
+            dialog.lift()
+            return None
+        dialog = self.dialogs[name] = tk.Toplevel(self.root)
+        dialog.title(title)
+        dialog.config(bg=THEMES[self.current_theme]["bg"])
+        return dialog
+
+    def dump_memory(self, event=None):
+        try:
+            extra = [f"Move history: {len(self.move_history)} moves, {len(self.evaluations)} evaluations, {len(self.best_moves)} best moves",
+                     f"Canvas items: {len(self.canvas.find_all())}",
+                     f"Open dialogs: {sum(dialog.winfo_exists() for dialog in self.dialogs.values())}"]
+            self.memory_snapshot = dump_memory(self.memory_snapshot, extra=extra)
+            ui_log.info(f"Memory dump written to {MEMORY_DUMP_FILE}")
+            self.status_label.config(text=f"Memory dump written to {MEMORY_DUMP_FILE}")
+        except Exception as e:
+            ui_log.error(f"Memory dump failed: {e}")
+            messagebox.showerror("Error", f"Memory dump failed: {e}")
+
     def promotion_dialog(self, move):
         try:
-            dialog = tk.Toplevel(self.root)
-            dialog.title("Choose Promotion")
+            dialog = self.open_dialog("promotion", "Choose Promotion")
+            if dialog is None:
+                return
             dialog.geometry("300x80")
-            dialog.config(bg=THEMES[self.current_theme]["bg"])
             pieces = [(chess.QUEEN, "Queen"), (chess.ROOK, "Rook"), (chess.BISHOP, "Bishop"), (chess.KNIGHT, "Knight")]
             for piece_type, name in pieces:
                 tk.Button(dialog, text=name, command=lambda pt=piece_type: self.set_promotion(move, pt, dialog), width=8, font=("Arial", 10), bg=THEMES[self.current_theme]["button"], fg="#FFFFFF").pack(side="left", padx=5, pady=5)
         except Exception as e:
-            logging.error(f"Promotion dialog failed: {e}")
+            ui_log.error(f"Promotion dialog failed: {e}")
             messagebox.showerror("Error", f"Promotion dialog failed: {e}")
 
     def set_promotion(self, move, piece_type, dialog):
@@ -697,84 +4682,366 @@ class ChessApp:
             dialog.destroy()
             self.handle_move(chess.Move(move.from_square, move.to_square, promotion=piece_type))
         except Exception as e:
-            logging.error(f"Set promotion failed: {e}")
+            ui_log.error(f"Set promotion failed: {e}")
             messagebox.showerror("Error", f"Set promotion failed: {e}")
 
-    def handle_move(self, move):
+    def handle_move(self, move, animate=True, redraw=True):
         try:
-            if not self.multiplayer_mode:
-                best_score, best_move = alpha_beta(self.board, self.difficulty + 1, -float('inf'), float('inf'), self.board.turn == chess.WHITE, self.learning_data)
-                self.best_moves.append((best_move, best_score))
-                self.player_moves.append(move)
-
-            before_eval = evaluate(self.board, self.learning_data)
-            captured_piece = self.board.piece_at(move.to_square)
-            if captured_piece:
-                self.captured_pieces[self.board.turn].append(captured_piece.piece_type)
-            self.animate_move(move.from_square, move.to_square)
-            san = self.board.san(move)
-            self.board.push(move)
-            after_eval = evaluate(self.board, self.learning_data)
-            self.evaluations.append(before_eval - after_eval if self.board.turn == chess.BLACK else after_eval - before_eval)
-            self.move_history.append(move)
+            ponder_hit = self.check_ponder(move) if self.ponder and not self.multiplayer_mode else False
+            if animate and not self.premoves:
+                self.animate_move(move.from_square, move.to_square)
+            position_before, san, captured_piece = self.make_move(move)
+            if position_before.turn == self.player_color:
+                self.record_input_latency()
+            after_eval = self.record_move(move, position_before)
+            self.broadcast_move(move, after_eval)
             player = "Human" if self.board.turn == chess.BLACK else "AI"
-            logging.info(f"Move: {san} by {player} | Eval: {after_eval/100:+.1f} | Board: {self.board.fen()}")
-            print(f"Move: {san} by {player}")
+            ui_log.info("Move: %s by %s | Eval: %+.1f", san, player, after_eval / 100)
+            if ui_log.isEnabledFor(logging.DEBUG):
+                ui_log.debug("Board: %s", self.board.fen())
 
             self.selected_square = None
             self.possible_moves = []
 
             if self.multiplayer_mode:
                 self.send_move(move)
+                self.update_pieces()
             else:
+                if redraw or self.board.is_game_over():
+                    self.update_pieces()
                 self.timer_running = True
-                if self.board.is_game_over():
+                if self.puzzle_mode:
+                    self.check_puzzle_move(move, san, captured_piece)
+                elif self.board.is_game_over():
                     messagebox.showinfo("Game Over", f"Result: {self.board.result()}")
-                    logging.info(f"Game Over: {self.board.result()}")
-                elif self.puzzle_mode and san != self.current_puzzle["solution"]:
-                    messagebox.showinfo("Puzzle", "Wrong move! Try again.")
-                    self.board.pop()
-                    self.move_history.pop()
-                    self.evaluations.pop()
-                    self.best_moves.pop()
-                    self.player_moves.pop()
-                    self.captured_pieces[self.board.turn].pop() if captured_piece else None
-                    self.update_pieces()
-                else:
-                    self.root.after(500, self.play_bot)
+                    ui_log.info(f"Game Over: {self.board.result()}")
+                elif self.board.turn == chess.BLACK:
+                    self.bot_pending = True
+                    self.root.after(0 if ponder_hit else 500, self.play_bot)
         except Exception as e:
-            logging.error(f"Move processing failed: {e}")
+            ui_log.error(f"Move processing failed: {e}")
             messagebox.showerror("Error", f"Move processing failed: {e}")
 
+    def check_puzzle_move(self, move, san, captured_piece):
+        solution = self.current_puzzle["solution"]
+        solver_turn = self.puzzle_step % 2 == 0
+        expected = solution[self.puzzle_step]
+        # Any mating move solves the puzzle, not only the listed one
+        if solver_turn and move.uci() != expected and san != expected and not self.board.is_checkmate():
+            messagebox.showinfo("Puzzle", "Wrong move! Try again.")
+            self.pop_move()
+            self.move_history.pop()
+            self.evaluations.pop()
+            self.captured_pieces[self.board.turn].pop() if captured_piece else None
+            self.update_pieces()
+            self.broadcast_reset()
+            return
+        self.puzzle_step += 1
+        if self.puzzle_step >= len(solution) or self.board.is_checkmate():
+            self.puzzle_mode = False
+            self.timer_running = False
+            messagebox.showinfo("Puzzle", "Puzzle solved!")
+            ui_log.info(f"Puzzle solved: {self.current_puzzle.get('id') or self.current_puzzle['fen']}")
+        elif solver_turn:
+            reply = chess.Move.from_uci(solution[self.puzzle_step])
+            self.root.after(400, lambda: self.handle_move(reply))
+
     def play_bot(self):
         try:
             if self.board.is_game_over() or self.puzzle_mode:
+                self.bot_pending = False
                 return
             if self.board.turn == chess.BLACK:
-                move = get_bot_move(self.board, self.difficulty, self.learning_data)
+                ponder = self.ponder
+                move = None
+                if ponder and ponder["key"] == chess.polyglot.zobrist_hash(self.board):
+                    if ponder["thread"].is_alive():
+                        # Ponder hit still searching: keep its work instead of restarting cold
+                        self.root.after(PONDER_POLL_MS, self.play_bot)
+                        return
+                    self.ponder = None
+                    move, pv = ponder["result"], ponder["pv"]
+                    if move is not None and not self.board.is_legal(move):
+                        move = None
+                if move is None:
+                    self.stop_ponder()
+                    pv = []
+                    move = get_bot_move(self.board, self.difficulty, self.learning_data, pv=pv)
+                self.bot_pending = False
                 if move:
-                    self.handle_move(move)
+                    # With a premove queued, the redraw waits for it so the reply lands straight after the bot move
+                    premove = bool(self.premoves)
+                    self.handle_move(move, redraw=not premove)
+                    if not self.apply_premove():
+                        if premove:
+                            self.update_pieces()
+                        self.start_ponder(pv)
                 else:
-                    logging.error("Bot failed to find a move")
+                    ui_log.error("Bot failed to find a move")
                     messagebox.showerror("Error", "Bot failed to find a move")
         except Exception as e:
-            logging.error(f"Bot move failed: {e}")
+            ui_log.error(f"Bot move failed: {e}")
             messagebox.showerror("Error", f"Bot move failed: {e}")
 
+    def engine_match_dialog(self):
+        try:
+            if self.engine_match:
+                self.stop_engine_match()
+                return
+            if self.multiplayer_mode or self.spectator_mode:
+                messagebox.showwarning("Warning", "Leave the current online game first!")
+                return
+            dialog = self.open_dialog("engine_match", "Engine Match")
+            if dialog is None:
+                return
+            fields = {}
+            for column, side in enumerate(("White", "Black")):
+                frame = tk.LabelFrame(dialog, text=side, bg=THEMES[self.current_theme]["bg"], fg=THEMES[self.current_theme]["text"], padx=5, pady=5)
+                frame.grid(row=0, column=column, padx=5, pady=5)
+                depth = tk.StringVar(value="3")
+                weights = tk.StringVar(value="Learned")
+                book = tk.BooleanVar(value=True)
+                tablebase = tk.BooleanVar(value=True)
+                tk.Label(frame, text="Depth", bg=THEMES[self.current_theme]["bg"], fg=THEMES[self.current_theme]["text"]).pack()
+                ttk.Combobox(frame, textvariable=depth, values=["1", "2", "3", "4", "5", "6"], state="readonly", width=10).pack()
+                tk.Label(frame, text="Weights", bg=THEMES[self.current_theme]["bg"], fg=THEMES[self.current_theme]["text"]).pack()
+                ttk.Combobox(frame, textvariable=weights, values=["Learned", "Default"], state="readonly", width=10).pack()
+                tk.Checkbutton(frame, text="Opening book", variable=book).pack(anchor="w")
+                tk.Checkbutton(frame, text="Tablebases", variable=tablebase).pack(anchor="w")
+                fields[chess.WHITE if side == "White" else chess.BLACK] = (depth, weights, book, tablebase)
+            tk.Label(dialog, text="Games", bg=THEMES[self.current_theme]["bg"], fg=THEMES[self.current_theme]["text"]).grid(row=1, column=0)
+            games_entry = tk.Entry(dialog, width=6)
+            games_entry.insert(0, "1")
+            games_entry.grid(row=1, column=1)
+
+            def start():
+                try:
+                    games = max(1, int(games_entry.get()))
+                except ValueError:
+                    messagebox.showerror("Error", "Number of games must be an integer!")
+                    return
+                configs = {}
+                for color, (depth, weights, book, tablebase) in fields.items():
+                    learning_data = self.learning_data if weights.get() == "Learned" else {"weights": {group: 1.0 for group in WEIGHT_GROUPS}, "games": 0}
+                    configs[color] = {"depth": int(depth.get()), "learning_data": learning_data, "book": book.get(), "tablebase": tablebase.get(),
+                                      "name": f"Depth {depth.get()} ({weights.get()}{', book' if book.get() else ''}{', TB' if tablebase.get() else ''})"}
+                dialog.destroy()
+                self.start_engine_match(configs, games)
+
+            tk.Button(dialog, text="Start", command=start, bg=THEMES[self.current_theme]["button"], fg="#FFFFFF").grid(row=2, column=0, columnspan=2, pady=5)
+        except Exception as e:
+            ui_log.error(f"Engine match dialog failed: {e}")
+            messagebox.showerror("Error", f"Engine match dialog failed: {e}")
+
+    def start_engine_match(self, configs, games):
+        self.new_game()
+        self.engine_match = {"configs": configs, "games": games, "played": 0, "score": {chess.WHITE: 0.0, chess.BLACK: 0.0}, "stats": [], "ctx": None}
+        self.game_recorded = True  # Engine games never touch the player's rating
+        ui_log.info(f"Engine match started: {configs[chess.WHITE]['name']} vs {configs[chess.BLACK]['name']}, {games} games")
+        self.engine_match_search()
+        self.poll_engine_match()
+
+    def engine_match_search(self):
+        match = self.engine_match
+        config = match["configs"][self.board.turn]
+        board = self.board.copy()
+        ctx = SearchContext()
+        match["ctx"] = ctx
+
+        def run():
+            started = time.perf_counter()
+            try:
+                move = get_bot_move(board, self.difficulty, config["learning_data"], ctx, depth=config["depth"], use_book=config["book"], use_tablebase=config["tablebase"])
+            except SearchAborted:
+                return
+            self.engine_results.put((ctx, move, time.perf_counter() - started, ctx.nodes))
+
+        threading.Thread(target=run, daemon=True).start()
+
+    def poll_engine_match(self):
+        match = self.engine_match
+        if not match:
+            return
+        try:
+            while True:
+                ctx, move, elapsed, nodes = self.engine_results.get_nowait()
+                if ctx is not match["ctx"]:
+                    continue  # Result of a search that was stopped
+                if move is None or not self.board.is_legal(move):
+                    engine_log.error(f"Engine returned illegal move {move} in {self.board.fen()}")
+                    self.stop_engine_match()
+                    messagebox.showerror("Error", f"Engine returned an illegal move in {self.board.fen()}")
+                    return
+                self.apply_engine_move(move, elapsed, nodes)
+                if self.board.is_game_over(claim_draw=True) or len(self.board.move_stack) >= ENGINE_MATCH_MAX_PLIES:
+                    self.finish_engine_game()
+                    if not self.engine_match:
+                        return
+                self.engine_match_search()
+        except queue.Empty:
+            pass
+        except Exception as e:
+            engine_log.error(f"Engine match failed: {e}")
+            self.stop_engine_match()
+            messagebox.showerror("Error", f"Engine match failed: {e}")
+            return
+        self.root.after(ENGINE_MATCH_POLL_MS, self.poll_engine_match)
+
+    def apply_engine_move(self, move, elapsed, nodes):
+        before_eval = evaluate(self.board, self.learning_data)
+        captured_piece = self.board.piece_at(move.to_square)
+        if captured_piece:
+            self.captured_pieces[self.board.turn].append(captured_piece.piece_type)
+        self.push_move(move)
+        self.move_history.append(move)
+        after_eval = evaluate(self.board, self.learning_data)
+        self.evaluations.append(before_eval - after_eval if self.board.turn == chess.BLACK else after_eval - before_eval)
+        self.engine_match["stats"].append((elapsed, nodes))
+        self.broadcast_move(move, after_eval)
+        self.request_render()
+
+    def request_render(self):
+        # Coalesce redraws: at most one per frame however fast moves arrive
+        if self.render_id is None:
+            delay = max(0, int((self.last_render + 1.0 / ENGINE_MATCH_FPS - time.perf_counter()) * 1000))
+            self.render_id = self.root.after(delay, self.render_frame)
+
+    def render_frame(self):
+        self.render_id = None
+        self.last_render = time.perf_counter()
+        self.update_pieces()
+
+    def finish_engine_game(self):
+        match = self.engine_match
+        result = self.board.result(claim_draw=True)
+        if result == "*":
+            result = "1/2-1/2"  # Adjudicated at ENGINE_MATCH_MAX_PLIES
+        if result == "1-0":
+            match["score"][chess.WHITE] += 1
+        elif result == "0-1":
+            match["score"][chess.BLACK] += 1
+        else:
+            match["score"][chess.WHITE] += 0.5
+            match["score"][chess.BLACK] += 0.5
+        match["played"] += 1
+        path = self.save_engine_game(result)
+        total_time = sum(elapsed for elapsed, _ in match["stats"])
+        total_nodes = sum(nodes for _, nodes in match["stats"])
+        ui_log.info(f"Engine game {match['played']}/{match['games']}: {result} in {len(self.board.move_stack)} plies, "
+                    f"{total_nodes / total_time if total_time else 0:.0f} nodes/s, saved to {path}")
+        if self.render_id:
+            self.root.after_cancel(self.render_id)
+        self.render_frame()
+        if match["played"] >= match["games"]:
+            self.engine_match = None
+            messagebox.showinfo("Engine Match", f"{match['configs'][chess.WHITE]['name']} {match['score'][chess.WHITE]} - "
+                                f"{match['score'][chess.BLACK]} {match['configs'][chess.BLACK]['name']}\nGames saved to {ENGINE_MATCH_DIR}/")
+            return
+        self.engine_match = None  # Let new_game reset the board without ending the match
+        self.new_game()
+        match["stats"] = []
+        self.engine_match = match
+        self.game_recorded = True
+
+    def save_engine_game(self, result):
+        match = self.engine_match
+        game = chess.pgn.Game()
+        game.headers["Event"] = "Engine match"
+        game.headers["Date"] = datetime.datetime.now().strftime("%Y.%m.%d")
+        game.headers["Round"] = str(match["played"])
+        game.headers["White"] = match["configs"][chess.WHITE]["name"]
+        game.headers["Black"] = match["configs"][chess.BLACK]["name"]
+        game.headers["Result"] = result
+        node = game
+        for move, (elapsed, nodes) in zip(self.board.move_stack, match["stats"]):
+            node = node.add_variation(move)
+            node.comment = f"[%emt {int(elapsed // 3600)}:{int(elapsed % 3600 // 60):02d}:{elapsed % 60:05.2f}] {nodes} nodes"
+        os.makedirs(ENGINE_MATCH_DIR, exist_ok=True)
+        path = os.path.join(ENGINE_MATCH_DIR, f"engine_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}_{match['played']}.pgn")
+        with open(path, "w") as f:
+            print(game, file=f)
+        prune_directory(ENGINE_MATCH_DIR, ENGINE_MATCH_KEEP, ".pgn")
+        return path
+
+    def stop_engine_match(self):
+        match, self.engine_match = self.engine_match, None
+        if match and match["ctx"]:
+            match["ctx"].stop_event.set()
+        if self.render_id:
+            self.root.after_cancel(self.render_id)
+            self.render_id = None
+        if match:
+            ui_log.info(f"Engine match stopped after {match['played']} games")
+            self.update_pieces()
+
+    def start_ponder(self, pv):
+        try:
+            self.stop_ponder()
+            if not self.ponder_enabled or self.multiplayer_mode or len(pv) < 2 or self.board.is_game_over():
+                return
+            predicted = pv[1]
+            if not self.board.is_legal(predicted):
+                return
+            board = self.board.copy()
+            board.push(predicted)
+            ponder = {"move": predicted, "key": chess.polyglot.zobrist_hash(board), "ctx": SearchContext(), "result": None, "pv": []}
+
+            def run():
+                try:
+                    ponder["result"] = get_bot_move(board, self.difficulty, self.learning_data, ponder["ctx"], ponder["pv"])
+                except SearchAborted:
+                    pass
+
+            ponder["thread"] = threading.Thread(target=run, daemon=True)
+            self.ponder = ponder
+            ponder["thread"].start()
+            engine_log.debug("Pondering on %s", predicted.uci())
+        except Exception as e:
+            engine_log.error(f"Start ponder failed: {e}")
+
+    def stop_ponder(self):
+        if self.ponder:
+            self.ponder["ctx"].stop_event.set()
+            self.ponder = None
+
+    def check_ponder(self, move):
+        if move == self.ponder["move"]:
+            self.ponder_stats["hits"] += 1
+            engine_log.info("Ponder hit on %s | Hit rate: %.0f%%", move.uci(), self.ponder_hit_rate() * 100)
+            return True
+        self.ponder_stats["misses"] += 1
+        engine_log.info("Ponder miss: expected %s, got %s | Hit rate: %.0f%%", self.ponder["move"].uci(), move.uci(), self.ponder_hit_rate() * 100)
+        self.stop_ponder()
+        return False
+
+    def ponder_hit_rate(self):
+        total = self.ponder_stats["hits"] + self.ponder_stats["misses"]
+        return self.ponder_stats["hits"] / total if total else 0.0
+
+    def toggle_pondering(self):
+        try:
+            self.ponder_enabled = not self.ponder_enabled
+            if not self.ponder_enabled:
+                self.stop_ponder()
+            state = "enabled" if self.ponder_enabled else "disabled"
+            total = self.ponder_stats["hits"] + self.ponder_stats["misses"]
+            messagebox.showinfo("Pondering", f"Pondering {state}\nHit rate: {self.ponder_hit_rate():.0%} ({self.ponder_stats['hits']}/{total})")
+            ui_log.info(f"Pondering {state}")
+        except Exception as e:
+            ui_log.error(f"Toggle pondering failed: {e}")
+            messagebox.showerror("Error", f"Toggle pondering failed: {e}")
+
     def new_game(self):
         try:
+            if self.spectator_mode:
+                self.stop_spectating()
+            if self.engine_match:
+                self.stop_engine_match()
+            self.stop_ponder()
+            self.clear_premoves()
             self.stop_timer()
-            self.board.reset()
-            self.move_history = []
-            self.captured_pieces = {chess.WHITE: [], chess.BLACK: []}
-            self.evaluations = []
-            self.best_moves = []
-            self.player_moves = []
-            self.timer = {"white": 600, "black": 600}
+            self.reset_game()
             self.timer_running = False
-            self.game = chess.pgn.Game()
-            self.puzzle_mode = False
-            self.current_puzzle = None
             self.selected_square = None
             self.possible_moves = []
             if not self.multiplayer_mode:
@@ -785,42 +5052,49 @@ class ChessApp:
             self.draw_board()
             self.update_pieces()
             self.update_timer()
-            logging.info("--- New Game Started ---")
+            self.broadcast_reset()
+            ui_log.info("--- New Game Started ---")
         except Exception as e:
-            logging.error(f"New game failed: {e}")
+            ui_log.error(f"New game failed: {e}")
             messagebox.showerror("Error", f"New game failed: {e}")
 
     def undo_move(self):
         try:
+            if self.engine_match:
+                self.stop_engine_match()
+            self.stop_ponder()
+            self.clear_premoves()
             if self.move_history and not self.puzzle_mode and not self.multiplayer_mode:
-                self.board.pop()
+                self.pop_move()
                 self.move_history.pop()
                 self.evaluations.pop() if self.evaluations else None
                 self.best_moves.pop() if self.best_moves else None
                 self.player_moves.pop() if self.player_moves else None
+                self.game_recorded = False
                 if self.captured_pieces[self.board.turn]:
                     self.captured_pieces[self.board.turn].pop()
                 self.selected_square = None
                 self.possible_moves = []
                 self.update_pieces()
-                logging.info("Move undone")
+                self.broadcast_reset()
+                ui_log.info("Move undone")
         except Exception as e:
-            logging.error(f"Undo failed: {e}")
+            ui_log.error(f"Undo failed: {e}")
             messagebox.showerror("Error", f"Undo failed: {e}")
 
     def get_hint(self):
         try:
-            if not self.board.is_game_over() and not self.puzzle_mode and not self.multiplayer_mode:
+            if not self.board.is_game_over() and not self.puzzle_mode and not self.multiplayer_mode and not self.engine_match:
                 move = get_bot_move(self.board, self.difficulty, self.learning_data)
                 if move:
                     san = self.board.san(move)
                     messagebox.showinfo("Hint", f"Suggested move: {san}")
-                    logging.info(f"Hint requested: {san}")
+                    ui_log.info(f"Hint requested: {san}")
                 else:
-                    logging.error("Hint generation failed: No move found")
+                    ui_log.error("Hint generation failed: No move found")
                     messagebox.showerror("Error", "No hint available")
         except Exception as e:
-            logging.error(f"Hint generation failed: {e}")
+            ui_log.error(f"Hint generation failed: {e}")
             messagebox.showerror("Error", f"Hint generation failed: {e}")
 
     def resign(self):
@@ -830,9 +5104,9 @@ class ChessApp:
                 messagebox.showinfo("Resign", f"{winner} wins by resignation!")
                 self.cleanup_multiplayer()
                 self.new_game()
-                logging.info(f"Game resigned: {winner} wins")
+                ui_log.info(f"Game resigned: {winner} wins")
         except Exception as e:
-            logging.error(f"Resign failed: {e}")
+            ui_log.error(f"Resign failed: {e}")
             messagebox.showerror("Error", f"Resign failed: {e}")
 
     def offer_draw(self):
@@ -842,9 +5116,9 @@ class ChessApp:
                     messagebox.showinfo("Draw", "Game ends in a draw!")
                     self.cleanup_multiplayer()
                     self.new_game()
-                    logging.info("Game ended in a draw")
+                    ui_log.info("Game ended in a draw")
         except Exception as e:
-            logging.error(f"Draw offer failed: {e}")
+            ui_log.error(f"Draw offer failed: {e}")
             messagebox.showerror("Error", f"Draw offer failed: {e}")
 
     def save_game(self):
@@ -861,9 +5135,9 @@ class ChessApp:
             if file:
                 with open(file, "w") as f:
                     print(game, file=f)
-                logging.info(f"Game saved to {file}")
+                ui_log.info(f"Game saved to {file}")
         except Exception as e:
-            logging.error(f"Failed to save game: {e}")
+            ui_log.error(f"Failed to save game: {e}")
             messagebox.showerror("Error", f"Failed to save game: {e}")
 
     def load_game(self):
@@ -873,140 +5147,141 @@ class ChessApp:
                 with open(file) as f:
                     game = chess.pgn.read_game(f)
                 if game:
-                    self.board.reset()
-                    self.move_history = []
-                    self.captured_pieces = {chess.WHITE: [], chess.BLACK: []}
-                    self.evaluations = []
-                    self.best_moves = []
-                    self.player_moves = []
-                    node = game
-                    temp_board = chess.Board()
-                    while node.variations:
-                        move = node.variations[0].move
-                        captured = temp_board.piece_at(move.to_square)
-                        if captured:
-                            self.captured_pieces[temp_board.turn].append(captured.piece_type)
-                        san = temp_board.san(move)
-                        temp_board.push(move)
-                        after_eval = evaluate(temp_board, self.learning_data)
-                        self.evaluations.append(evaluate(temp_board, self.learning_data) - after_eval if temp_board.turn == chess.BLACK else after_eval - evaluate(temp_board, self.learning_data))
-                        self.board.push(move)
-                        self.move_history.append(move)
-                        node = node.variations[0]
-                    self.selected_square = None
-                    self.possible_moves = []
-                    self.update_pieces()
-                    logging.info(f"Game loaded from {file}")
+                    self.open_game(game, file)
         except Exception as e:
-            logging.error(f"Failed to load game: {e}")
+            ui_log.error(f"Failed to load game: {e}")
             messagebox.showerror("Error", f"Failed to load game: {e}")
 
+    def open_game(self, game, source, ply=None):
+        # Loads the whole mainline, then shows the position after `ply` moves when given
+        if self.engine_match:
+            self.stop_engine_match()
+        self.stop_ponder()
+        self.clear_premoves()
+        start = game.board()  # Honours [SetUp]/[FEN] headers
+        self.board.set_fen(start.fen())
+        self.move_index = None
+        self.move_history = []
+        self.captured_pieces = {chess.WHITE: [], chess.BLACK: []}
+        self.evaluations = []
+        self.best_moves = []
+        self.player_moves = []
+        self.game_recorded = True  # Loaded games are not played here
+        self.last_deep_analysis = None
+        node = game
+        temp_board = start
+        after_eval = evaluate(temp_board, self.learning_data)
+        while node.variations:
+            move = node.variations[0].move
+            captured = temp_board.piece_at(move.to_square)
+            if captured:
+                self.captured_pieces[temp_board.turn].append(captured.piece_type)
+            before_eval = after_eval
+            temp_board.push(move)
+            after_eval = evaluate(temp_board, self.learning_data)
+            self.evaluations.append(before_eval - after_eval if temp_board.turn == chess.BLACK else after_eval - before_eval)
+            self.push_move(move)
+            self.move_history.append(move)
+            node = node.variations[0]
+        self.selected_square = None
+        self.possible_moves = []
+        self.update_pieces()
+        self.broadcast_reset()
+        if ply is not None:
+            self.show_ply(ply)
+        ui_log.info(f"Game loaded from {source}")
+
     def flip_board(self):
         try:
             self.board_flipped = not self.board_flipped
             self.canvas.delete("all")
             self.draw_board()
             self.update_pieces()
-            logging.info("Board flipped")
+            ui_log.info("Board flipped")
         except Exception as e:
-            logging.error(f"Flip board failed: {e}")
+            ui_log.error(f"Flip board failed: {e}")
             messagebox.showerror("Error", f"Flip board failed: {e}")
 
+    def start_puzzle_indexing(self):
+        try:
+            self.puzzle_index = get_puzzle_store().start_indexing()
+            self.poll_puzzle_index()
+        except Exception as e:
+            self.puzzle_index = None
+            ui_log.error(f"Puzzle indexing failed to start: {e}")
+
+    def poll_puzzle_index(self):
+        store = get_puzzle_store()
+        if self.puzzle_index and self.puzzle_index.is_alive():
+            self.puzzle_status.config(text=f"Indexing puzzles... {store.progress}")
+            self.root.after(500, self.poll_puzzle_index)
+            return
+        self.puzzle_index = None
+        self.puzzle_status.config(text=f"{store.progress} new puzzles indexed" if store.progress else "")
+
     def start_puzzle(self):
         try:
-            if not self.board.is_game_over() and not self.puzzle_mode and not self.multiplayer_mode:
-                self.current_puzzle = random.choice(PUZZLES)
+            if not self.board.is_game_over() and not self.puzzle_mode and not self.multiplayer_mode and not self.engine_match:
+                self.stop_ponder()
+                self.clear_premoves()
+                self.current_puzzle = None
+                try:
+                    store = get_puzzle_store()
+                    if store.ready.is_set():
+                        self.current_puzzle = store.random_puzzle(rating=int(self.learning_data.get("elo", 1500))) or store.random_puzzle()
+                    else:
+                        ui_log.info("Puzzle corpus still indexing, using a built-in puzzle")
+                except Exception as e:
+                    ui_log.error(f"Puzzle store unavailable: {e}")
+                if self.current_puzzle is None:
+                    self.current_puzzle = dict(random.choice(PUZZLES), id="")
                 self.board.set_fen(self.current_puzzle["fen"])
+                self.move_index = None
                 self.puzzle_mode = True
+                self.puzzle_step = 0
                 self.move_history = []
                 self.captured_pieces = {chess.WHITE: [], chess.BLACK: []}
                 self.evaluations = []
                 self.best_moves = []
                 self.player_moves = []
+                self.game_recorded = True  # Puzzles are not rated games
                 self.selected_square = None
                 self.possible_moves = []
                 self.canvas.delete("all")
                 self.draw_board()
-                messagebox.showinfo("Puzzle", f"Solve: Play {self.current_puzzle['move']} to start.")
+                side = "White" if self.board.turn == chess.WHITE else "Black"
+                rating = f" (rating {self.current_puzzle['rating']})" if self.current_puzzle["rating"] else ""
+                messagebox.showinfo("Puzzle", f"Find the best move for {side}{rating}.")
                 self.update_pieces()
-                logging.info(f"Puzzle started: {self.current_puzzle['fen']}")
+                self.broadcast_reset()
+                ui_log.info(f"Puzzle started: {self.current_puzzle['fen']}")
         except Exception as e:
-            logging.error(f"Start puzzle failed: {e}")
+            ui_log.error(f"Start puzzle failed: {e}")
             messagebox.showerror("Error", f"Start puzzle failed: {e}")
 
     def analyze_game(self):
         try:
             if self.board.is_game_over() or self.puzzle_mode:
                 messagebox.showinfo("Analysis", f"Final Evaluation: {evaluate(self.board, self.learning_data)/100:+.1f}")
-                logging.info(f"Game analyzed: {evaluate(self.board, self.learning_data)/100:+.1f}")
+                ui_log.info(f"Game analyzed: {evaluate(self.board, self.learning_data)/100:+.1f}")
             else:
                 messagebox.showwarning("Analysis", "Finish the game first!")
         except Exception as e:
-            logging.error(f"Analyze game failed: {e}")
+            ui_log.error(f"Analyze game failed: {e}")
             messagebox.showerror("Error", f"Analyze game failed: {e}")
 
     def analyze_game_end(self):
         try:
-            if not self.move_history or self.puzzle_mode:
+            if not self.move_history or self.puzzle_mode or self.game_recorded:
                 return
+            game_id, accuracy = self.finish_game()
 
-            total_moves = len(self.player_moves)
-            accurate_moves = 0
-            blunders = []
-            temp_board = chess.Board()
-            for i, (player_move, (best_move, best_score)) in enumerate(zip(self.player_moves, self.best_moves)):
-                if player_move == best_move:
-                    accurate_moves += 1
-                else:
-                    temp_board.push(player_move)
-                    player_score = evaluate(temp_board, self.learning_data)
-                    temp_board.pop()
-                    temp_board.push(best_move)
-                    best_score = evaluate(temp_board, self.learning_data)
-                    temp_board.pop()
-                    eval_diff = abs(player_score - best_score) / 100.0
-                    if eval_diff > 3:
-                        blunders.append((i + 1, temp_board.san(player_move), temp_board.san(best_move), eval_diff))
-                temp_board.push(player_move)
-
-            accuracy = (accurate_moves / total_moves * 100) if total_moves > 0 else 0
-            result = {"1-0": 1, "0-1": 0, "1/2-1/2": 0.5}.get(self.board.result(), 0)
-            expected_score = 1 / (1 + 10 ** ((self.learning_data["elo"] - 1500) / 400))
-            performance = result - expected_score
-            self.learning_data["elo"] = min(max(self.learning_data["elo"] + 20 * performance, 800), 2800)
-            self.adjust_learning_weights(result)
-
-            analysis = []
-            analysis.append(f"Game Analysis - {datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
-            analysis.append(f"Result: {self.board.result()}")
-            analysis.append(f"Estimated Elo: {int(self.learning_data['elo'])}")
-            analysis.append(f"Accuracy: {accuracy:.1f}%")
-            analysis.append(f"Accurate Moves: {accurate_moves}/{total_moves}")
-            if blunders:
-                analysis.append("\nMajor Blunders:")
-                for move_num, played, best, diff in blunders:
-                    analysis.append(f"Move {move_num}: Played {played}, Best was {best} (Eval diff: {diff:.1f})")
-            else:
-                analysis.append("\nNo major blunders! Well played.")
-
-            analysis.append("\nSuggestions for Improvement:")
-            if accuracy < 60:
-                analysis.append("- Focus on finding the best moves by evaluating positions carefully.")
-            if blunders:
-                analysis.append("- Avoid blunders by double-checking moves that significantly change the evaluation.")
-            if self.timer["white"] < 60 or self.timer["black"] < 60:
-                analysis.append("- Manage your time better to avoid time pressure mistakes.")
-            analysis.append("- Practice tactical puzzles to improve your calculation skills.")
-
-            with open("lvl.txt", "a") as f:
-                f.write("\n".join(analysis) + "\n\n")
-
-            summary = f"Game Over!\nEstimated Elo: {int(self.learning_data['elo'])}\nAccuracy: {accuracy:.1f}%\nCheck lvl.txt for details."
+            summary = f"Game Over!\nEstimated Elo: {int(self.learning_data['elo'])}\nAccuracy: {accuracy:.1f}%\nSee 'Progress' for your history."
             messagebox.showinfo("Game Analysis", summary)
-            logging.info(f"Game analysis written to lvl.txt | Elo: {int(self.learning_data['elo'])} | Accuracy: {accuracy:.1f}%")
-            self.save_learning_data()
+            ui_log.info(f"Game {game_id} recorded in {HISTORY_DB} | Elo: {int(self.learning_data['elo'])} | Accuracy: {accuracy:.1f}%")
+            ui_log.info(f"Evaluation cache: {EVAL_CACHE.stats()}")
         except Exception as e:
-            logging.error(f"End game analysis failed: {e}")
+            ui_log.error(f"End game analysis failed: {e}")
             messagebox.showerror("Error", f"End game analysis failed: {e}")
 
     def deep_analysis(self):
@@ -1014,74 +5289,23 @@ class ChessApp:
             if not self.move_history or self.puzzle_mode:
                 messagebox.showwarning("Analysis", "No moves to analyze or puzzle mode active!")
                 return
-
-            total_moves = len(self.player_moves)
-            accurate_moves = 0
-            blunders = []
-            missed_opportunities = []
-            temp_board = chess.Board()
-            for i, (player_move, (best_move, best_score)) in enumerate(zip(self.player_moves, self.best_moves)):
-                if player_move == best_move:
-                    accurate_moves += 1
-                else:
-                    temp_board.push(player_move)
-                    player_score = evaluate(temp_board, self.learning_data)
-                    temp_board.pop()
-                    temp_board.push(best_move)
-                    best_score = evaluate(temp_board, self.learning_data)
-                    temp_board.pop()
-                    eval_diff = abs(player_score - best_score) / 100.0
-                    if eval_diff > 3:
-                        blunders.append((i + 1, temp_board.san(player_move), temp_board.san(best_move), eval_diff))
-                    if eval_diff > 1:
-                        missed_opportunities.append((i + 1, temp_board.san(player_move), temp_board.san(best_move), eval_diff))
-                temp_board.push(player_move)
-
-            accuracy = (accurate_moves / total_moves * 100) if total_moves > 0 else 0
-            result = {"1-0": 1, "0-1": 0, "1/2-1/2": 0.5}.get(self.board.result(), 0)
-            elo = 800 + (accuracy * 10) + (result * 200) + (self.difficulty * 50)
-            elo = min(max(int(elo), 800), 2800)
-
-            analysis = []
-            analysis.append(f"Detailed Game Analysis - {datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
-            analysis.append(f"Result: {self.board.result()}")
-            analysis.append(f"Estimated Elo: {elo}")
-            analysis.append(f"Accuracy: {accuracy:.1f}%")
-            analysis.append(f"Accurate Moves: {accurate_moves}/{total_moves}")
-            if blunders:
-                analysis.append("\nMajor Blunders:")
-                for move_num, played, best, diff in blunders:
-                    analysis.append(f"Move {move_num}: Played {played}, Best was {best} (Eval diff: {diff:.1f})")
-            if missed_opportunities:
-                analysis.append("\nMissed Opportunities:")
-                for move_num, played, best, diff in missed_opportunities:
-                    analysis.append(f"Move {move_num}: Played {played}, Best was {best} (Eval diff: {diff:.1f})")
-            analysis.append("\nMove-by-Move Evaluation:")
-            temp_board = chess.Board()
-            for i, move in enumerate(self.move_history):
-                san = temp_board.san(move)
-                temp_board.push(move)
-                eval_score = evaluate(temp_board, self.learning_data) / 100.0
-                analysis.append(f"Move {i+1}: {san} (Eval: {eval_score:+.1f})")
-
-            self.last_deep_analysis = analysis
-            messagebox.showinfo("Deep Analysis", "\n".join(analysis[:10]) + "\n\nFull details available to save in analysis.txt")
-            logging.info("Deep analysis performed")
-        except Exception as e:
-            logging.error(f"Deep analysis failed: {e}")
+            analysis = self.build_deep_analysis()
+            messagebox.showinfo("Deep Analysis", "\n".join(analysis[:10]) + f"\n\nFull details available to save in {ANALYSIS_FILE}")
+            ui_log.info("Deep analysis performed")
+        except Exception as e:
+            ui_log.error(f"Deep analysis failed: {e}")
             messagebox.showerror("Error", f"Deep analysis failed: {e}")
 
     def save_analysis(self):
         try:
-            if not hasattr(self, 'last_deep_analysis'):
+            if not self.last_deep_analysis:
                 messagebox.showwarning("Save Analysis", "Perform a deep analysis first!")
                 return
-            with open("analysis.txt", "a") as f:
-                f.write("\n".join(self.last_deep_analysis) + "\n\n")
-            messagebox.showinfo("Save Analysis", "Analysis saved to analysis.txt")
-            logging.info("Deep analysis saved to analysis.txt")
+            self.save_deep_analysis()
+            messagebox.showinfo("Save Analysis", f"Analysis saved to {ANALYSIS_FILE}")
+            ui_log.info(f"Deep analysis saved to {ANALYSIS_FILE}")
         except Exception as e:
-            logging.error(f"Save analysis failed: {e}")
+            ui_log.error(f"Save analysis failed: {e}")
             messagebox.showerror("Error", f"Save analysis failed: {e}")
 
     def toggle_animation(self):
@@ -1089,9 +5313,9 @@ class ChessApp:
             self.animations_enabled = not self.animations_enabled
             state = "enabled" if self.animations_enabled else "disabled"
             messagebox.showinfo("Animations", f"Animations {state}")
-            logging.info(f"Animations {state}")
+            ui_log.info(f"Animations {state}")
         except Exception as e:
-            logging.error(f"Toggle animation failed: {e}")
+            ui_log.error(f"Toggle animation failed: {e}")
             messagebox.showerror("Error", f"Toggle animation failed: {e}")
 
     def change_theme(self, *args):
@@ -1114,69 +5338,82 @@ class ChessApp:
             self.canvas.delete("all")
             self.draw_board()
             self.update_pieces()
-            logging.info(f"Theme changed to {self.current_theme}")
+            ui_log.info(f"Theme changed to {self.current_theme}")
         except Exception as e:
-            logging.error(f"Theme change failed: {e}")
+            ui_log.error(f"Theme change failed: {e}")
             messagebox.showerror("Error", f"Theme change failed: {e}")
 
     def change_difficulty(self, *args):
         try:
             self.difficulty = int(self.difficulty_var.get())
-            logging.info(f"Difficulty changed to {self.difficulty}")
+            ui_log.info(f"Difficulty changed to {self.difficulty}")
         except ValueError:
             self.difficulty = 3
             messagebox.showwarning("Warning", "Invalid difficulty, defaulting to 3")
-            logging.warning("Invalid difficulty, defaulting to 3")
+            ui_log.warning("Invalid difficulty, defaulting to 3")
         except Exception as e:
-            logging.error(f"Difficulty change failed: {e}")
+            ui_log.error(f"Difficulty change failed: {e}")
             self.difficulty = 3
             messagebox.showerror("Error", f"Difficulty change failed: {e}")
 
     def load_learning_data(self):
         try:
-            if os.path.exists("learning_data.json"):
-                with open("learning_data.json", "r") as f:
+            snapshot = get_history().latest_snapshot()
+            changed = False
+            if snapshot is None and os.path.exists(LEGACY_LEARNING_FILE):
+                with open(LEGACY_LEARNING_FILE, "r") as f:
                     content = f.read().strip()
-                    if content:
-                        self.learning_data = json.loads(content)
-                    else:
-                        logging.warning("learning_data.json is empty, using default.")
-                        self.save_learning_data()
+                if content:
+                    snapshot = json.loads(content)
+                    changed = True
+                    ui_log.info(f"Imported {LEGACY_LEARNING_FILE} into {HISTORY_DB}")
+            if snapshot:
+                self.learning_data = snapshot
+                EVAL_CACHE.invalidate()
             else:
-                logging.info("learning_data.json not found, creating default.")
+                ui_log.info(f"No learning data in {HISTORY_DB}, creating default.")
+            if TUNED_WEIGHTS and self.learning_data.get("tuned_version", 0) < TUNED_WEIGHTS["version"]:
+                self.learning_data["weights"].update(TUNED_WEIGHTS["weights"])
+                self.learning_data["tuned_version"] = TUNED_WEIGHTS["version"]
+                EVAL_CACHE.invalidate()
+                changed = True
+                ui_log.info(f"Applied tuned weights version {TUNED_WEIGHTS['version']}")
+            if changed:
                 self.save_learning_data()
         except json.JSONDecodeError as e:
-            logging.error(f"Error decoding learning_data.json: {e}")
+            ui_log.error(f"Error decoding {LEGACY_LEARNING_FILE}: {e}")
             self.save_learning_data()
         except Exception as e:
-            logging.error(f"Load learning data failed: {e}")
-            self.save_learning_data()
+            ui_log.error(f"Load learning data failed: {e}")
 
     def save_learning_data(self):
         try:
-            with open("learning_data.json", "w") as f:
-                json.dump(self.learning_data, f, indent=4)
+            get_history().save_snapshot(self.learning_data)
         except Exception as e:
-            logging.error(f"Save learning data failed: {e}")
+            ui_log.error(f"Save learning data failed: {e}")
 
-    def adjust_learning_weights(self, result):
+    def show_progress(self):
         try:
-            expected = 1 / (1 + 10 ** ((self.learning_data["elo"] - 1500) / 400))
-            error = result - expected
-            for key in self.learning_data["weights"]:
-                self.learning_data["weights"][key] += 0.01 * error
-                self.learning_data["weights"][key] = max(0.1, min(2.0, self.learning_data["weights"][key]))
-            self.learning_data["performance"] = (self.learning_data["performance"] * (self.learning_data["games"] - 1) + result) / self.learning_data["games"]
-            self.learning_data["games"] += 1
+            history = get_history()
+            lines = ["Rating over time:"]
+            for period, elo, games in history.rating_over_time():
+                lines.append(f"{period}: {int(elo)} ({games} games)")
+            lines.append("\nAccuracy per opening:")
+            for opening, accuracy, score, games in history.accuracy_by_opening():
+                lines.append(f"{opening or '-'}: {accuracy:.1f}% | score {score:.2f} ({games} games)")
+            messagebox.showinfo("Progress", "\n".join(lines))
         except Exception as e:
-            logging.error(f"Adjust learning weights failed: {e}")
+            ui_log.error(f"Show progress failed: {e}")
+            messagebox.showerror("Error", f"Show progress failed: {e}")
 
 # --- MAIN ---
 if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        sys.exit(run_command(sys.argv[1:]))
     try:
         root = tk.Tk()
         app = ChessApp(root)
         root.mainloop()
     except Exception as e:
-        logging.error(f"Application failed: {e}")
+        ui_log.error(f"Application failed: {e}")
         messagebox.showerror("Error", f"Application failed: {e}")